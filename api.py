@@ -0,0 +1,243 @@
+"""Version 1 of the JSON API, under /api/v1.
+
+Read-only views of the same data as the HTML pages, for the logged-in user
+(the session cookie authenticates, as for pages):
+
+- GET /api/v1/feed                      home feed, newest first
+- GET /api/v1/users/<id>                a profile
+- GET /api/v1/users/<id>/messages       their messages, newest first
+- GET /api/v1/users/<id>/following      who they follow
+- GET /api/v1/users/<id>/followers      who follows them
+- GET /api/v1/messages/<id>             one message
+- GET /api/v1/messages?ids=3,1,2        up to MAX_BATCH_IDS messages, in
+                                        the order asked for
+
+Lists are keyset-paginated like the pages: pass the response's
+`next_cursor` back as `before` (messages) or `after` (users).
+
+Responses carry ETags and answer a matching If-None-Match with a 304 (see
+conditional.py). Bodies are encoded with orjson and streamed out a chunk
+of items at a time, so a long list is never held as one big string.
+"""
+
+from datetime import datetime
+from functools import wraps
+
+import orjson
+from flask import Blueprint, Response, abort, g, request, stream_with_context
+from werkzeug.exceptions import HTTPException
+
+from conditional import conditional, etag_for
+from hydration import load_authors, load_follow_state, load_like_state
+from listings import followers_page, following_page
+from models import Message, User
+from pagination import cursor_arg
+from timelines import home_timeline, profile_timeline
+
+MAX_BATCH_IDS = 100
+
+# Items encoded per chunk of a streamed response
+STREAM_CHUNK_SIZE = 50
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+
+# 404 by code too, or the app's HTML 404 page would take precedence
+@api.errorhandler(404)
+@api.errorhandler(HTTPException)
+def json_error(error):
+    """Errors as {"error": description}, with the error's status."""
+
+    return Response(orjson.dumps({"error": error.description}),
+                    status=error.code, mimetype='application/json')
+
+
+def is_api_path(path):
+    """Is `path` under the API's prefix?
+
+    URLs that match no route never reach the blueprint's error handlers,
+    so the app's 404 handler asks this to answer them with json_error().
+    """
+
+    return path == api.url_prefix or path.startswith(api.url_prefix + '/')
+
+
+def login_required(view):
+    """401 unless someone is logged in."""
+
+    @wraps(view)
+    def wrapped(*args, **kwargs):
+        if not g.user:
+            abort(401, "Log in first.")
+        return view(*args, **kwargs)
+
+    return wrapped
+
+
+def message_json(message, author, like_state):
+    return {
+        "id": message.id,
+        "text": message.text,
+        "timestamp": message.timestamp,
+        "like_count": message.like_count,
+        "liked": like_state.liked(message),
+        "user": {
+            "id": author.id,
+            "username": author.username,
+            "image_url": author.image_url,
+        },
+    }
+
+
+def user_json(user, follow_state):
+    return {
+        "id": user.id,
+        "username": user.username,
+        "image_url": user.image_url,
+        "header_image_url": user.header_image_url,
+        "bio": user.bio,
+        "following": follow_state.follows(user),
+    }
+
+
+def profile_json(user, follow_state):
+    return dict(
+        user_json(user, follow_state),
+        location=user.location,
+        messages_count=user.messages_count,
+        followers_count=user.followers_count,
+        following_count=user.following_count,
+        likes_count=user.likes_count,
+    )
+
+
+def stream_json(key, items, encode, **fields):
+    """Stream {key: [encode(item), ...], **fields} as JSON, in chunks."""
+
+    yield b'{"' + key.encode() + b'":['
+
+    for start in range(0, len(items), STREAM_CHUNK_SIZE):
+        chunk = items[start:start + STREAM_CHUNK_SIZE]
+        if start:
+            yield b','
+        yield b','.join(orjson.dumps(encode(item)) for item in chunk)
+
+    yield b']'
+    for name, value in fields.items():
+        yield b',"' + name.encode() + b'":' + orjson.dumps(value)
+    yield b'}'
+
+
+def json_list(versions, key, items, encode, **fields):
+    """A conditional, streamed JSON response listing `items`."""
+
+    return conditional(
+        etag_for(*versions),
+        lambda: Response(
+            stream_with_context(stream_json(key, items, encode, **fields)),
+            mimetype='application/json'))
+
+
+def json_object(versions, build):
+    """A conditional JSON response of the dict `build()` returns."""
+
+    return conditional(
+        etag_for(*versions),
+        lambda: Response(orjson.dumps(build()), mimetype='application/json'))
+
+
+def message_list(messages, next_cursor):
+    """A JSON page of `messages` with their authors and the viewer's likes."""
+
+    authors = {author.id: author for author in load_authors(messages)}
+    like_state = load_like_state(messages, g.user)
+
+    return json_list(
+        [messages, list(authors.values()), next_cursor,
+         like_state.liked_ids],
+        "messages", messages,
+        lambda msg: message_json(msg, authors[msg.user_id], like_state),
+        next_cursor=next_cursor)
+
+
+def user_list(user, page):
+    users, next_cursor = page(user.id, cursor_arg('after', int))
+    follow_state = load_follow_state(users, g.user)
+
+    return json_list(
+        [users, next_cursor, follow_state.followed_ids],
+        "users", users, lambda card: user_json(card, follow_state),
+        next_cursor=next_cursor)
+
+
+@api.get('/feed')
+@login_required
+def feed():
+    messages, next_cursor = home_timeline(
+        g.user, cursor=cursor_arg('before', datetime, int))
+
+    return message_list(messages, next_cursor)
+
+
+@api.get('/users/<int:user_id>')
+@login_required
+def user_profile(user_id):
+    user = User.query.get_or_404(user_id)
+    follow_state = load_follow_state([user], g.user)
+
+    return json_object([user, follow_state.followed_ids],
+                       lambda: profile_json(user, follow_state))
+
+
+@api.get('/users/<int:user_id>/messages')
+@login_required
+def user_messages(user_id):
+    user = User.query.get_or_404(user_id)
+    messages, next_cursor = profile_timeline(
+        user.id, cursor=cursor_arg('before', datetime, int))
+
+    return message_list(messages, next_cursor)
+
+
+@api.get('/users/<int:user_id>/following')
+@login_required
+def user_following(user_id):
+    return user_list(User.query.get_or_404(user_id), following_page)
+
+
+@api.get('/users/<int:user_id>/followers')
+@login_required
+def user_followers(user_id):
+    return user_list(User.query.get_or_404(user_id), followers_page)
+
+
+@api.get('/messages/<int:message_id>')
+@login_required
+def message(message_id):
+    msg = Message.query.get_or_404(message_id)
+    like_state = load_like_state([msg], g.user)
+
+    return json_object([msg, msg.user, like_state.liked_ids],
+                       lambda: message_json(msg, msg.user, like_state))
+
+
+@api.get('/messages')
+@login_required
+def messages_by_id():
+    """The messages in `ids`, comma-separated; unknown ids are left out."""
+
+    try:
+        ids = [int(part) for part in request.args.get('ids', '').split(',')
+               if part]
+    except ValueError:
+        abort(400, "ids must be comma-separated integers.")
+
+    if len(ids) > MAX_BATCH_IDS:
+        abort(400, f"At most {MAX_BATCH_IDS} ids at a time.")
+
+    found = {msg.id: msg
+             for msg in Message.query.filter(Message.id.in_(ids))}
+    messages = [found[message_id] for message_id in dict.fromkeys(ids)
+                if message_id in found]
+
+    return message_list(messages, None)
@@ -1,13 +1,43 @@
+import math
 import os
+from datetime import datetime
 from dotenv import load_dotenv
 
-from flask import Flask, render_template, request, flash, redirect, session, g
+import click
+
+from flask import (
+    Flask, render_template, request, flash, redirect, session, g,
+    make_response)
 from werkzeug.exceptions import Unauthorized
 from flask_debugtoolbar import DebugToolbarExtension
 from sqlalchemy.exc import IntegrityError
 
 from forms import UserAddForm, LoginForm, MessageForm, CSRFForm, UserEditForm
-from models import db, connect_db, User, Message, Like
+from models import db, connect_db, hasher, User, Message, Like, Follow
+from api import api, is_api_path, json_error
+from assets import build_assets, init_assets, use_assets
+from caching import forget_user, get_current_user
+from conditional import render_conditional
+from counters import (
+    bump, reconcile_counters, release_message_counts, release_user_counts)
+from followgraph import (
+    init_follow_graph, record_follow, record_unfollow, record_user_deleted)
+from fragments import init_fragments
+from hydration import load_authors, load_follow_state, load_like_state
+from instrumentation import init_instrumentation
+from lazy_globals import init_lazy_globals, lazy_global
+from listings import (
+    all_user_cards, followers_cards, followers_page, following_cards,
+    following_page, likes_page)
+from migrations import migrate
+from pagination import cursor_arg
+from query_plans import check_query_plans
+from ratelimit import throttle_login, trust_proxies
+from recommendations import (
+    rebuild_recommendations, refresh_recommendations, who_to_follow)
+from search import browse_users, decode_search_cursor, search_users
+from streaming import StreamedCards, stream_listing
+from timelines import home_timeline, profile_timeline, trim_timelines
 
 load_dotenv()
 
@@ -19,36 +49,58 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ['DATABASE_URL']
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 app.config['SECRET_KEY'] = os.environ['SECRET_KEY']
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['FOLLOW_GRAPH_ENABLED'] = os.environ.get('FOLLOW_GRAPH_ENABLED') == '1'
+app.config['TIMING_SAMPLE_RATE'] = float(
+    os.environ.get('TIMING_SAMPLE_RATE', 0.1))
+app.config['ASSETS_DIR'] = os.environ.get(
+    'ASSETS_DIR', os.path.join(app.static_folder, 'dist'))
+app.config['STREAM_LISTINGS'] = os.environ.get('STREAM_LISTINGS') == '1'
+app.config['TRUSTED_PROXIES'] = int(os.environ.get('TRUSTED_PROXIES', 0))
+trust_proxies(app)
+init_lazy_globals(app)
+init_fragments(app)
+init_assets(app)
+app.register_blueprint(api)
 toolbar = DebugToolbarExtension(app)
 
 connect_db(app)
+init_follow_graph(app)
+init_instrumentation(app, db.engine)
 
 
 ##############################################################################
 # User signup/login/logout
 
 
-@app.before_request
+@lazy_global('user')
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, the current user for `g.user`; else None.
+
+    Runs the first time a request reads `g.user` (see lazy_globals.py). The
+    user is usually served from the per-process cache in caching.py.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        return get_current_user(session[CURR_USER_KEY])
 
-    else:
-        g.user = None
+    return None
 
 
-@app.before_request
+@lazy_global('csrf_form')
 def add_csrf_form():
-    """Instantiate CSRF for logout function before each request."""
+    """CSRF form for `g.csrf_form`, used by logout and other POST buttons.
+
+    Runs the first time a request reads `g.csrf_form`.
+    """
 
-    g.csrf_form = CSRFForm()
+    return CSRFForm()
 
 
 def do_login(user):
     """Log in user."""
 
+    forget_user(user.id)
     session[CURR_USER_KEY] = user.id
 
 
@@ -104,12 +156,26 @@ def login():
     form = LoginForm()
 
     if form.validate_on_submit():
+        # Checked before any database or bcrypt work, so a flood of guesses
+        # is turned away cheaply.
+        wait = throttle_login(request.remote_addr, form.username.data)
+
+        if wait:
+            flash("Too many login attempts. Please try again later.",
+                  'danger')
+            resp = make_response(
+                render_template('users/login.html', form=form), 429)
+            resp.retry_after = math.ceil(wait)
+            return resp
+
         user = User.authenticate(
             form.username.data,
             form.password.data,
         )
 
         if user:
+            # Saves the password's new hash if authenticate() upgraded it
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -140,7 +206,9 @@ def logout():
 def list_users():
     """Page with listing of users.
 
-    Can take a 'q' param in querystring to search by that username.
+    Can take a 'q' param in querystring to search by that username, and an
+    'after' cursor for the next page of users/results. Without a search,
+    the page is streamed if STREAM_LISTINGS is on (see streaming.py).
     """
 
     if not g.user:
@@ -150,48 +218,128 @@ def list_users():
     search = request.args.get('q')
 
     if not search:
-        users = User.query.all()
+        cursor = cursor_arg('after', int)
+
+        if app.config['STREAM_LISTINGS']:
+            users = StreamedCards(all_user_cards(cursor), g.user)
+            return stream_listing('users/index.html', users,
+                                  users=users,
+                                  search=search,
+                                  form=g.csrf_form)
+
+        users, next_cursor = browse_users(cursor)
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        cursor = cursor_arg('after', decode=decode_search_cursor)
+        users, next_cursor = search_users(search, cursor)
 
-    return render_template('users/index.html', users=users, form=g.csrf_form)
+    return render_template('users/index.html',
+                           users=users,
+                           search=search,
+                           next_cursor=next_cursor,
+                           follow_state=load_follow_state(users, g.user),
+                           form=g.csrf_form)
 
 
 @app.get('/users/<int:user_id>')
 def show_user(user_id):
-    """Show user profile."""
+    """Show user profile.
+
+    Their messages come a page at a time, newest first; pass the `before`
+    cursor from the "Load older" link for the next page.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-
-    return render_template('users/show.html', user=user, form=g.csrf_form)
+    cursor = cursor_arg('before', datetime, int)
+    messages, next_cursor = profile_timeline(user_id, cursor=cursor)
+    like_state = load_like_state(messages, g.user)
+    follow_state = load_follow_state([user], g.user)
+
+    return render_conditional(
+        [user, messages, next_cursor, like_state.liked_ids,
+         follow_state.followed_ids],
+        'users/show.html',
+        user=user,
+        messages=messages,
+        next_cursor=next_cursor,
+        like_state=like_state,
+        follow_state=follow_state,
+        form=g.csrf_form)
 
 
 @app.get('/users/<int:user_id>/following')
 def show_following(user_id):
-    """Show list of people this user is following."""
+    """Show list of people this user is following.
+
+    A page at a time, in id order; pass the `after` cursor from the "Load
+    more" link for the next page. Streamed if STREAM_LISTINGS is on.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user, form=g.csrf_form)
+    cursor = cursor_arg('after', int)
+
+    if app.config['STREAM_LISTINGS']:
+        following = StreamedCards(following_cards(user_id, cursor), g.user,
+                                  also=[user])
+        return stream_listing('users/following.html', following,
+                              user=user,
+                              following=following,
+                              form=g.csrf_form)
+
+    following, next_cursor = following_page(user_id, cursor)
+    follow_state = load_follow_state(following + [user], g.user)
+
+    return render_conditional(
+        [user, following, next_cursor, follow_state.followed_ids],
+        'users/following.html',
+        user=user,
+        following=following,
+        next_cursor=next_cursor,
+        follow_state=follow_state,
+        form=g.csrf_form)
 
 
 @app.get('/users/<int:user_id>/followers')
 def show_followers(user_id):
-    """Show list of followers of this user."""
+    """Show list of followers of this user.
+
+    A page at a time, in id order; pass the `after` cursor from the "Load
+    more" link for the next page. Streamed if STREAM_LISTINGS is on.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user, form=g.csrf_form)
+    cursor = cursor_arg('after', int)
+
+    if app.config['STREAM_LISTINGS']:
+        followers = StreamedCards(followers_cards(user_id, cursor), g.user,
+                                  also=[user])
+        return stream_listing('users/followers.html', followers,
+                              user=user,
+                              followers=followers,
+                              form=g.csrf_form)
+
+    followers, next_cursor = followers_page(user_id, cursor)
+    follow_state = load_follow_state(followers + [user], g.user)
+
+    return render_conditional(
+        [user, followers, next_cursor, follow_state.followed_ids],
+        'users/followers.html',
+        user=user,
+        followers=followers,
+        next_cursor=next_cursor,
+        follow_state=follow_state,
+        form=g.csrf_form)
 
 
 @app.post('/users/follow/<int:follow_id>')
@@ -210,10 +358,18 @@ def start_following(follow_id):
         return redirect('/users')
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
-    db.session.commit()
+    # Read before the commit expires g.user, which would reload it
+    user_id = g.user.id
+
+    if not db.session.get(Follow, (follow_id, user_id)):
+        db.session.add(Follow(user_being_followed_id=follow_id,
+                              user_following_id=user_id))
+        bump(g.user, following_count=1)
+        bump(followed_user, followers_count=1)
+        db.session.commit()
+        record_follow(user_id, follow_id)
 
-    return redirect(f"/users/{g.user.id}/following")
+    return redirect(f"/users/{user_id}/following")
 
 
 @app.post('/users/stop-following/<int:follow_id>')
@@ -228,22 +384,47 @@ def stop_following(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.remove(followed_user)
-    db.session.commit()
+    # Read before the commit expires g.user, which would reload it
+    user_id = g.user.id
+    follow = db.session.get(Follow, (follow_id, user_id))
+
+    if follow:
+        db.session.delete(follow)
+        bump(g.user, following_count=-1)
+        bump(followed_user, followers_count=-1)
+        db.session.commit()
+        record_unfollow(user_id, follow_id)
 
-    return redirect(f"/users/{g.user.id}/following")
+    return redirect(f"/users/{user_id}/following")
 
 
 @app.get('/users/<int:user_id>/likes')
 def show_likes(user_id):
-    """Show list of likes of this user."""
+    """Show list of likes of this user.
+
+    A page at a time, newest message first; pass the `before` cursor from
+    the "Load older" link for the next page.
+    """
 
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user, form=g.csrf_form)
+    messages, next_cursor = likes_page(user_id, cursor_arg('before', int))
+    like_state = load_like_state(messages, g.user)
+    follow_state = load_follow_state([user], g.user)
+
+    return render_conditional(
+        [user, messages, next_cursor, like_state.liked_ids,
+         follow_state.followed_ids],
+        'users/likes.html',
+        user=user,
+        messages=messages,
+        next_cursor=next_cursor,
+        like_state=like_state,
+        follow_state=follow_state,
+        form=g.csrf_form)
 
 
 @app.post('/users/like/<int:message_id>')
@@ -256,11 +437,13 @@ def like_message(message_id):
 
     message = Message.query.get_or_404(message_id)
 
-    if message.user_id != g.user.id:
-        g.user.liked_messages.add(message)
-        db.session.commit()
-    else:
+    if message.user_id == g.user.id:
         flash('You cannot like your own Warble!', 'danger')
+    elif not db.session.get(Like, (g.user.id, message_id)):
+        db.session.add(Like(user_id=g.user.id, message_id=message_id))
+        bump(g.user, likes_count=1)
+        bump(message, like_count=1)
+        db.session.commit()
 
     return redirect(request.args['next'])
 
@@ -274,9 +457,13 @@ def unlike_message(message_id):
         return redirect("/")
 
     message = Message.query.get_or_404(message_id)
+    like = db.session.get(Like, (g.user.id, message_id))
 
-    g.user.liked_messages.remove(message)
-    db.session.commit()
+    if like:
+        db.session.delete(like)
+        bump(g.user, likes_count=-1)
+        bump(message, like_count=-1)
+        db.session.commit()
 
     return redirect(request.args['next'])
 
@@ -307,6 +494,7 @@ def update_profile():
             g.user.bio = form_fields["bio"]
 
             db.session.commit()
+            forget_user(g.user.id)
 
             flash('Profile updated successfully!', 'success')
             return redirect(F"/users/{g.user.id}")
@@ -329,9 +517,15 @@ def delete_user():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
+    release_user_counts(g.user.id)
+    Like.query.filter(
+        Like.message_id.in_(db.select(Message.id).filter_by(user_id=g.user.id))
+    ).delete()
     Message.query.filter_by(user_id=g.user.id).delete()
     db.session.delete(g.user)
     db.session.commit()
+    forget_user(g.user.id)
+    record_user_deleted(g.user.id)
 
     do_logout()
 
@@ -356,8 +550,10 @@ def add_message():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        # Added directly rather than through g.user.messages, which would
+        # load every message the user has written first.
+        db.session.add(Message(text=form.text.data, user_id=g.user.id))
+        bump(g.user, messages_count=1)
         db.session.commit()
 
         return redirect(f"/users/{g.user.id}")
@@ -374,7 +570,16 @@ def show_message(message_id):
         return redirect("/")
 
     msg = Message.query.get_or_404(message_id)
-    return render_template('messages/show.html', message=msg, form=g.csrf_form)
+    like_state = load_like_state([msg], g.user)
+    follow_state = load_follow_state([msg.user], g.user)
+
+    return render_conditional(
+        [msg, msg.user, like_state.liked_ids, follow_state.followed_ids],
+        'messages/show.html',
+        message=msg,
+        like_state=like_state,
+        follow_state=follow_state,
+        form=g.csrf_form)
 
 
 @app.post('/messages/<int:message_id>/delete')
@@ -385,13 +590,19 @@ def delete_message(message_id):
     Redirect to user page on success.
     """
 
-    if not g.user or not g.csrf_form.validate_on_submit() or \
-         message_id not in [m.id for m in g.user.messages]:
+    if not g.user or not g.csrf_form.validate_on_submit():
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    msg = Message.query.get_or_404(message_id)
+    msg = db.session.get(Message, message_id)
+
+    if not msg or msg.user_id != g.user.id:
+        flash("Access unauthorized.", "danger")
+        return redirect("/")
+
+    release_message_counts(message_id)
     db.session.delete(msg)
+    bump(g.user, messages_count=-1)
     db.session.commit()
 
     return redirect(f"/users/{g.user.id}")
@@ -406,20 +617,27 @@ def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of self & followed_users
+    - logged in: 100 most recent messages of self & followed_users,
+      read from the user's materialized timeline. Pass the `before` cursor
+      from the "Load older" link to get the next 100.
     """
 
     if g.user:
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
-
-        messages = (Message
-                    .query
-                    .filter((Message.user_id.in_(following_ids)))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
-
-        return render_template('home.html', messages=messages, form=g.csrf_form)
+        cursor = cursor_arg('before', datetime, int)
+        messages, next_cursor = home_timeline(g.user, cursor=cursor)
+        authors = load_authors(messages)
+        like_state = load_like_state(messages, g.user)
+        recommendations = who_to_follow(g.user)
+
+        return render_conditional(
+            [messages, authors, next_cursor, like_state.liked_ids,
+             recommendations],
+            'home.html',
+            messages=messages,
+            next_cursor=next_cursor,
+            like_state=like_state,
+            recommendations=recommendations,
+            form=g.csrf_form)
 
     return render_template('home-anon.html', form=g.csrf_form)
 
@@ -427,15 +645,117 @@ def homepage():
 
 @app.errorhandler(404)
 def page_not_found(error):
-    """Display custom error page on 404 status codes."""
+    """Display custom error page on 404 status codes.
+
+    Unknown URLs under the API get its JSON error instead.
+    """
+
+    if is_api_path(request.path):
+        return json_error(error)
 
     return render_template("404.html", form=g.csrf_form), 404
 
 
 @app.after_request
 def add_header(response):
-    """Add non-caching headers on every request."""
+    """Add non-caching headers to responses without a validator.
+
+    Pages rendered with render_conditional() (see conditional.py), and
+    static files, carry an ETag and are revalidated instead.
+    """
 
     # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Cache-Control
-    response.cache_control.no_store = True
+    if response.get_etag()[0] is None:
+        response.cache_control.no_store = True
     return response
+
+
+##############################################################################
+# CLI commands
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters_command():
+    """Recompute denormalized like/follow/message counters."""
+
+    users, messages = reconcile_counters()
+    print(f"Fixed counters on {users} users and {messages} messages.")
+
+
+@app.cli.command('trim-timelines')
+def trim_timelines_command():
+    """Drop home timeline entries past each user's stored history."""
+
+    entries = trim_timelines()
+    print(f"Dropped {entries} timeline entries.")
+
+
+@app.cli.command('refresh-recommendations')
+def refresh_recommendations_command():
+    """Recompute "Who to follow" for users whose follows changed."""
+
+    users = refresh_recommendations()
+    print(f"Refreshed recommendations for {users} users.")
+
+
+@app.cli.command('rebuild-recommendations')
+def rebuild_recommendations_command():
+    """Recompute "Who to follow" for every user."""
+
+    users = rebuild_recommendations()
+    print(f"Rebuilt recommendations for {users} users.")
+
+
+@app.cli.command('calibrate-hasher')
+@click.option('--target-ms', default=250, show_default=True,
+              help="Longest acceptable time to hash one password.")
+def calibrate_hasher_command(target_ms):
+    """Suggest a BCRYPT_LOG_ROUNDS for this machine."""
+
+    rounds = hasher.calibrate(target_ms / 1000)
+    print(f"Use BCRYPT_LOG_ROUNDS={rounds} (currently {hasher.rounds}).")
+    print("Existing hashes are upgraded as their users log in.")
+
+
+@app.cli.command('build-assets')
+def build_assets_command():
+    """Fingerprint and compress static files for far-future caching."""
+
+    out_dir = app.config['ASSETS_DIR']
+    manifest = build_assets(app.static_folder, out_dir)
+    use_assets(out_dir)
+    print(f"Built {len(manifest)} assets into {out_dir}.")
+
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Bring an existing database up to the current schema."""
+
+    applied = migrate()
+    for version in applied:
+        print(f"Applied {version}.")
+    print(f"{len(applied)} migrations applied.")
+
+
+@app.cli.command('check-query-plans')
+def check_query_plans_command():
+    """EXPLAIN the busiest pages' queries; fail on full table scans."""
+
+    user = User.query.order_by(User.following_count.desc()).first()
+    message = Message.query.order_by(Message.id.desc()).first()
+    if not user or not message:
+        raise click.ClickException("Seed the database first.")
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user.id
+
+    problems = check_query_plans(client, user, message)
+    for problem in problems:
+        print(f"{problem.url}: full scan of {problem.table}")
+        print(f"    {' '.join(problem.statement.split())}")
+
+    if problems:
+        raise click.ClickException(
+            f"{len(problems)} queries fell back to full table scans.")
+    print("Every hot query uses an index.")
@@ -0,0 +1,189 @@
+"""Fingerprinted, precompressed static files.
+
+`flask build-assets` copies everything under static/ into ASSETS_DIR
+(static/dist by default) with a hash of its contents in the name, e.g.
+stylesheets/style.3e1f09a2c4.css, and rewrites `url(/static/...)`
+references in stylesheets to the hashed names. Text files also get .gz
+(and, if the `brotli` package is installed, .br) variants, kept when they
+are smaller. manifest.json maps each original path to its hashed one.
+
+Templates link files with `asset_url('stylesheets/style.css')`. With a
+manifest, that is /assets/<hashed name>, served with far-future
+`immutable` caching, since a change to the file changes its URL. The best
+variant the browser accepts is sent with its Content-Encoding. Without a
+manifest (nothing built yet), asset_url falls back to plain /static/ URLs.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shutil
+
+from flask import abort, request, send_file, url_for
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ASSETS_URL = '/assets'
+DIST = 'dist'
+MANIFEST = 'manifest.json'
+
+# A year: the longest max-age browsers honour. The URL changes when the
+# content does, so cached copies never go stale.
+ASSETS_MAX_AGE = 365 * 24 * 3600
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript', 'text/javascript', 'text/css',
+    'image/svg+xml', 'image/vnd.microsoft.icon', 'image/x-icon',
+}
+
+# Only keep a compressed variant if it saves at least this much
+MIN_SAVING = 0.1
+
+_STATIC_URL = re.compile(r'''url\(\s*(["']?)/static/([^"')]+)\1\s*\)''')
+
+# (Content-Encoding, file suffix), most preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+_manifest = {}
+_directory = None
+
+
+def fingerprint(path, data):
+    """`path` with a hash of `data` before its extension."""
+
+    base, ext = os.path.splitext(path)
+    return f"{base}.{hashlib.sha256(data).hexdigest()[:10]}{ext}"
+
+
+def _compressed(data):
+    """{suffix: compressed data} for the variants worth keeping."""
+
+    variants = {'.gz': gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(data, quality=11)
+
+    return {suffix: compressed for suffix, compressed in variants.items()
+            if len(compressed) <= len(data) * (1 - MIN_SAVING)}
+
+
+def build_assets(static_folder, out_dir):
+    """Fingerprint and compress `static_folder` into `out_dir`.
+
+    Replaces `out_dir`. Returns the manifest.
+    """
+
+    out_dir = os.path.abspath(out_dir)
+    sources = []
+
+    for root, dirs, files in os.walk(static_folder):
+        # Never build from a previous build
+        dirs[:] = sorted(
+            d for d in dirs
+            if d != DIST and os.path.abspath(os.path.join(root, d)) != out_dir)
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            sources.append(os.path.relpath(full, static_folder)
+                           .replace(os.sep, '/'))
+
+    # Stylesheets last, so the files they refer to are already named
+    sources.sort(key=lambda path: path.endswith('.css'))
+
+    shutil.rmtree(out_dir, ignore_errors=True)
+    manifest = {}
+
+    for path in sources:
+        with open(os.path.join(static_folder, path), 'rb') as f:
+            data = f.read()
+
+        if path.endswith('.css'):
+            data = _STATIC_URL.sub(
+                lambda match: 'url({0}{1}/{2}{0})'.format(
+                    match.group(1), ASSETS_URL,
+                    manifest.get(match.group(2), match.group(2))),
+                data.decode()).encode()
+
+        hashed = fingerprint(path, data)
+        manifest[path] = hashed
+        target = os.path.join(out_dir, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+
+        with open(target, 'wb') as f:
+            f.write(data)
+
+        if mimetypes.guess_type(path)[0] in COMPRESSIBLE_TYPES:
+            for suffix, compressed in _compressed(data).items():
+                with open(target + suffix, 'wb') as f:
+                    f.write(compressed)
+
+    with open(os.path.join(out_dir, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def use_assets(directory):
+    """Serve built assets from `directory`, if it holds a manifest."""
+
+    global _manifest, _directory
+
+    try:
+        with open(os.path.join(directory, MANIFEST)) as f:
+            _manifest = json.load(f)
+    except FileNotFoundError:
+        _manifest = {}
+
+    _directory = directory
+
+
+def asset_url(path):
+    """The URL for static file `path`, fingerprinted if it has been built."""
+
+    hashed = _manifest.get(path)
+
+    if hashed is None:
+        return url_for('static', filename=path)
+
+    return f"{ASSETS_URL}/{hashed}"
+
+
+def serve_asset(filename):
+    """A built asset, in the best encoding the browser accepts."""
+
+    if filename not in _manifest.values():
+        abort(404)
+
+    path = os.path.join(_directory, filename)
+    encoding = None
+
+    for name, suffix in ENCODINGS:
+        if request.accept_encodings[name] and os.path.exists(path + suffix):
+            encoding = name
+            path += suffix
+            break
+
+    response = send_file(path, mimetype=mimetypes.guess_type(filename)[0],
+                         max_age=ASSETS_MAX_AGE, conditional=True)
+
+    if encoding:
+        response.content_encoding = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+
+    return response
+
+
+def init_assets(app):
+    """Route /assets/ and give templates `asset_url`."""
+
+    use_assets(app.config.get('ASSETS_DIR',
+                              os.path.join(app.static_folder, DIST)))
+
+    app.add_template_global(asset_url)
+    app.add_url_rule(f'{ASSETS_URL}/<path:filename>', 'asset', serve_asset)
@@ -0,0 +1,91 @@
+"""Benchmark streaming a large messages CSV in through bulkload.copy_csv().
+
+Writes `--messages` synthetic messages (from `--users` users) to a
+temporary CSV, loads the users and then the messages the way seed.py does,
+and prints rows per second and the process's peak memory. Peak memory
+should stay flat as `--messages` grows.
+
+Run from the repo root against a throwaway database:
+
+    createdb warbler_bench
+    python -m benchmarks.bulkload --messages 1000000
+    python -m benchmarks.bulkload --messages 10000000
+
+The database is dropped and recreated.
+"""
+
+import argparse
+import csv
+import os
+import resource
+import tempfile
+import time
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL', "postgresql:///warbler_bench")
+
+from app import app  # noqa: E402, F401
+from bulkload import copy_csv, finish_load, start_load  # noqa: E402
+from models import db, Message, User  # noqa: E402
+
+
+def write_csvs(directory, num_users, num_messages):
+    users_path = os.path.join(directory, "users.csv")
+    messages_path = os.path.join(directory, "messages.csv")
+
+    with open(users_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["email", "username", "password"])
+        for n in range(num_users):
+            writer.writerow([f"user{n}@example.com", f"user{n}", "x"])
+
+    with open(messages_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["text", "timestamp", "user_id"])
+        for n in range(num_messages):
+            writer.writerow([f"Warble number {n}, with a comma",
+                             "2021-02-12 06:41:25.698388",
+                             1 + n % num_users])
+
+    return users_path, messages_path
+
+
+def peak_memory_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=1000000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        users_path, messages_path = write_csvs(
+            directory, args.users, args.messages)
+        size = os.path.getsize(messages_path) / 2 ** 20
+
+        db.drop_all()
+        db.create_all()
+        start_load([User.__table__, Message.__table__])
+        before = peak_memory_mib()
+
+        copy_csv(User.__table__, users_path, report=lambda line: None)
+        start = time.perf_counter()
+        copy_csv(Message.__table__, messages_path, report=lambda line: None)
+        copied = time.perf_counter() - start
+
+        start = time.perf_counter()
+        finish_load()
+        finished = time.perf_counter() - start
+
+    print(f"{args.messages} messages ({size:.0f} MiB of CSV)")
+    print(f"copy: {copied:.1f}s ({args.messages / copied:,.0f} rows/s)")
+    print(f"indexes and constraints afterwards: {finished:.1f}s")
+    print(f"peak memory: {before:.0f} MiB before loading, "
+          f"{peak_memory_mib():.0f} MiB after")
+
+
+if __name__ == "__main__":
+    main()
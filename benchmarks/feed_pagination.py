@@ -0,0 +1,131 @@
+"""Benchmark home feed paging: keyset cursors vs. OFFSET.
+
+Fills a scratch database with one user whose timeline holds N messages,
+then times fetching page 1, 10, 100, ... both through `home_timeline()`
+(keyset on (timestamp, id)) and through an equivalent OFFSET query, and
+prints the keyset query plan.
+
+Run from the repo root against a throwaway database:
+
+    createdb warbler_bench
+    python -m benchmarks.feed_pagination --messages 200000
+
+The database is dropped and recreated.
+"""
+
+import argparse
+import os
+import statistics
+import time
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL', "postgresql:///warbler_bench")
+
+from sqlalchemy import select, text  # noqa: E402
+
+from app import app  # noqa: E402, F401
+from models import db, Message, TimelineEntry, User  # noqa: E402
+from timelines import home_timeline, TIMELINE_PAGE_SIZE  # noqa: E402
+
+
+def seed(num_messages):
+    """Create a viewer with `num_messages` messages in their timeline."""
+
+    db.drop_all()
+    db.create_all()
+
+    viewer = User(username="viewer", email="viewer@example.com",
+                  password="x")
+    db.session.add(viewer)
+    db.session.flush()
+
+    db.session.execute(text("""
+        INSERT INTO messages (text, timestamp, user_id)
+        SELECT 'warble ' || n,
+               now() - (n || ' seconds')::interval,
+               :user_id
+        FROM generate_series(1, :n) AS n
+    """), {"user_id": viewer.id, "n": num_messages})
+    db.session.execute(text("""
+        INSERT INTO timeline_entries (user_id, message_id, author_id, timestamp)
+        SELECT user_id, id, user_id, timestamp FROM messages
+    """))
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+
+    return viewer
+
+
+def cursor_for_page(viewer, page):
+    """Sort key of the last row before `page` (1-based), or None."""
+
+    if page == 1:
+        return None
+
+    return db.session.execute(
+        select(TimelineEntry.timestamp, TimelineEntry.message_id)
+        .where(TimelineEntry.user_id == viewer.id)
+        .order_by(TimelineEntry.timestamp.desc(),
+                  TimelineEntry.message_id.desc())
+        .offset((page - 1) * TIMELINE_PAGE_SIZE - 1)
+        .limit(1)
+    ).one()
+
+
+def offset_page(viewer, page):
+    ids = (
+        select(TimelineEntry.message_id)
+        .where(TimelineEntry.user_id == viewer.id)
+        .order_by(TimelineEntry.timestamp.desc(),
+                  TimelineEntry.message_id.desc())
+        .offset((page - 1) * TIMELINE_PAGE_SIZE)
+        .limit(TIMELINE_PAGE_SIZE)
+    )
+    return Message.query.filter(Message.id.in_(ids)).all()
+
+
+def timed(fn, repeat):
+    """Median wall time of `fn()` in milliseconds."""
+
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=200000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    viewer = seed(args.messages)
+    last_page = args.messages // TIMELINE_PAGE_SIZE
+    pages = [p for p in (1, 10, 100, 1000, 10000) if p <= last_page]
+
+    print(f"{'page':>8} {'keyset ms':>10} {'offset ms':>10}")
+    for page in pages:
+        cursor = cursor_for_page(viewer, page)
+        keyset = timed(lambda: home_timeline(viewer, cursor=cursor),
+                       args.repeat)
+        offset = timed(lambda: offset_page(viewer, page), args.repeat)
+        print(f"{page:>8} {keyset:>10.2f} {offset:>10.2f}")
+
+    cursor = cursor_for_page(viewer, pages[-1])
+    plan = db.session.execute(text("""
+        EXPLAIN SELECT message_id, timestamp FROM timeline_entries
+        WHERE user_id = :user_id AND (timestamp, message_id) < (:ts, :id)
+        ORDER BY timestamp DESC, message_id DESC
+        LIMIT :limit
+    """), {"user_id": viewer.id, "ts": cursor[0], "id": cursor[1],
+           "limit": TIMELINE_PAGE_SIZE + 1}).scalars()
+
+    print("\nKeyset query plan:")
+    for line in plan:
+        print("  " + line)
+
+
+if __name__ == "__main__":
+    main()
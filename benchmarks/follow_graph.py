@@ -0,0 +1,57 @@
+"""Benchmark the in-memory follow graph: memory per million edges, and
+lookup speed.
+
+Builds a FollowGraph from a random graph of `--users` users and `--edges`
+follows (no database needed), then prints the bytes held by its arrays,
+per million edges, and the time for membership checks and follower lists.
+
+Run from the repo root:
+
+    python -m benchmarks.follow_graph --users 1000000 --edges 10000000
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from followgraph import FollowGraph
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=1000000)
+    parser.add_argument("--edges", type=int, default=10000000)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    followers = rng.integers(1, args.users + 1, args.edges)
+    followed = rng.integers(1, args.users + 1, args.edges)
+
+    start = time.perf_counter()
+    graph = FollowGraph(followers, followed)
+    build = time.perf_counter() - start
+
+    mib = graph.nbytes / 2 ** 20
+    print(f"{args.users} users, {args.edges} edges, built in {build:.2f}s")
+    print(f"arrays: {mib:.1f} MiB total, "
+          f"{mib / (args.edges / 1e6):.1f} MiB per million edges")
+
+    pairs = rng.integers(1, args.users + 1, (args.lookups, 2)).tolist()
+    start = time.perf_counter()
+    for follower_id, followed_id in pairs:
+        graph.is_following(follower_id, followed_id)
+    elapsed = time.perf_counter() - start
+    print(f"is_following: {elapsed / args.lookups * 1e6:.2f} us each")
+
+    start = time.perf_counter()
+    for user_id, _ in pairs:
+        graph.follower_ids(user_id)
+    elapsed = time.perf_counter() - start
+    print(f"follower_ids: {elapsed / args.lookups * 1e6:.2f} us each")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Benchmark rendering a full home feed, with and without cached fragments.
+
+Fills a scratch database with a viewer following --authors users, who
+between them have written a page of messages (TIMELINE_PAGE_SIZE, 100),
+half of them liked by the viewer. Then requests the home page --repeat
+times and prints the median template render time from its Server-Timing
+header: first with the message fragment cache emptied before every
+request (every item rendered), then with it warm.
+
+Run from the repo root against a throwaway database:
+
+    createdb warbler_bench
+    python -m benchmarks.fragments
+
+The database is dropped and recreated.
+"""
+
+import argparse
+import os
+import statistics
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL', "postgresql:///warbler_bench")
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from fragments import fragments  # noqa: E402
+from models import db, Follow, Like, Message, User  # noqa: E402
+from timelines import TIMELINE_PAGE_SIZE  # noqa: E402
+
+
+def seed(num_authors):
+    """Create a viewer with a full first page of home feed."""
+
+    db.drop_all()
+    db.create_all()
+
+    viewer = User(username="viewer", email="viewer@example.com",
+                  password="x")
+    authors = [User(username=f"author{n}", email=f"author{n}@example.com",
+                    password="x")
+               for n in range(num_authors)]
+    db.session.add_all([viewer] + authors)
+    db.session.flush()
+
+    db.session.add_all([Follow(user_being_followed_id=author.id,
+                               user_following_id=viewer.id)
+                        for author in authors])
+    messages = [Message(text=f"Warble number {n}, about nothing much.",
+                        user_id=authors[n % num_authors].id)
+                for n in range(TIMELINE_PAGE_SIZE)]
+    db.session.add_all(messages)
+    db.session.flush()
+
+    db.session.add_all([Like(user_id=viewer.id, message_id=message.id)
+                        for message in messages[::2]])
+    db.session.commit()
+
+    return viewer.id
+
+
+def render_times(client, repeat, cold):
+    """Render time of the home page in ms, per request."""
+
+    samples = []
+
+    for _ in range(repeat):
+        if cold:
+            fragments.clear()
+        resp = client.get('/')
+        timings = dict(
+            entry.split(";", 1) for entry in
+            resp.headers['Server-Timing'].split(", "))
+        samples.append(float(timings["render"].split(";")[0][4:]))
+
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--authors", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    viewer_id = seed(args.authors)
+    app.config['TIMING_SAMPLE_RATE'] = 1
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = viewer_id
+
+    print(f"{'fragments':>10} {'median ms':>10} {'p95 ms':>10}")
+    for label, cold in [("rendered", True), ("cached", False)]:
+        render_times(client, 10, cold)
+        samples = render_times(client, args.repeat, cold)
+        p95 = statistics.quantiles(samples, n=20)[-1]
+        print(f"{label:>10} {statistics.median(samples):>10.2f} "
+              f"{p95:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Benchmark sustained password checks (logins) per second per core.
+
+For each bcrypt cost, hashes a password once and then has `--clients`
+threads call `hasher.verify()` in a loop for `--seconds`, as a burst of
+logins would. Checks run on the hasher's bounded pool, so throughput is
+capped by the pool size and the number of cores, whichever is smaller.
+
+Also times one full POST /login through the app at the configured cost.
+
+Run from the repo root against a throwaway database:
+
+    createdb warbler_bench
+    python -m benchmarks.logins --rounds 10 11 12
+
+The database is dropped and recreated.
+"""
+
+import argparse
+import os
+import threading
+import time
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL', "postgresql:///warbler_bench")
+
+from app import app  # noqa: E402
+from models import db, hasher, BcryptHasher, HASHER_THREADS, User  # noqa: E402
+
+
+def sustained_rate(test_hasher, clients, seconds):
+    """Password checks per second with `clients` threads verifying."""
+
+    hashed = test_hasher.hash("password")
+    deadline = time.perf_counter() + seconds
+    done = []
+
+    def client():
+        count = 0
+        while time.perf_counter() < deadline:
+            test_hasher.verify(hashed, "password")
+            count += 1
+        done.append(count)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return sum(done) / (time.perf_counter() - start)
+
+
+def login_latency(repeat):
+    """Median milliseconds for a full POST /login."""
+
+    db.drop_all()
+    db.create_all()
+    User.signup("bench", "bench@example.com", "password", None)
+    db.session.commit()
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    client = app.test_client()
+    samples = []
+
+    for _ in range(repeat):
+        start = time.perf_counter()
+        resp = client.post('/login', data={"username": "bench",
+                                           "password": "password"})
+        samples.append((time.perf_counter() - start) * 1000)
+        assert resp.status_code == 302
+
+    return sorted(samples)[len(samples) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--rounds", type=int, nargs="+",
+                        default=[10, 11, 12])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--threads", type=int, default=HASHER_THREADS)
+    args = parser.parse_args()
+
+    cores = min(args.threads, os.cpu_count())
+
+    print(f"{args.clients} clients, {args.threads} hasher threads, "
+          f"{os.cpu_count()} cores")
+    print(f"{'rounds':>6} {'logins/s':>10} {'per core':>10}")
+    for rounds in args.rounds:
+        rate = sustained_rate(BcryptHasher(rounds, args.threads),
+                              args.clients, args.seconds)
+        print(f"{rounds:>6} {rate:>10.1f} {rate / cores:>10.1f}")
+
+    print(f"\nPOST /login at {hasher.rounds} rounds: "
+          f"{login_latency(5):.1f} ms median")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark computing "Who to follow" recommendations.
+
+Fills a scratch database with `--users` users and `--edges` random follows,
+then times a full `rebuild_recommendations()` and an incremental
+`refresh_recommendations()` of `--stale` queued users.
+
+Run from the repo root against a throwaway database:
+
+    createdb warbler_bench
+    python -m benchmarks.recommendations --users 1000 --edges 5000
+    python -m benchmarks.recommendations --users 1000000 --edges 5000000
+
+The database is dropped and recreated.
+"""
+
+import argparse
+import os
+import time
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL', "postgresql:///warbler_bench")
+
+from sqlalchemy import func, select, text  # noqa: E402
+
+from app import app  # noqa: E402, F401
+from models import db, Recommendation  # noqa: E402
+from recommendations import (  # noqa: E402
+    rebuild_recommendations, refresh_recommendations)
+
+
+def seed(num_users, num_edges):
+    db.drop_all()
+    db.create_all()
+
+    db.session.execute(text("""
+        INSERT INTO users (id, email, username, image_url, header_image_url,
+                           bio, location, password, merge_on_read,
+                           messages_count, followers_count, following_count,
+                           likes_count)
+        SELECT n, 'user' || n || '@example.com', 'user' || n, '', '', '', '',
+               'x', false, 0, 0, 0, 0
+        FROM generate_series(1, :n) AS n
+    """), {"n": num_users})
+    db.session.execute(text("""
+        INSERT INTO follows (user_being_followed_id, user_following_id)
+        SELECT 1 + floor(random() * :users)::int,
+               1 + floor(random() * :users)::int
+        FROM generate_series(1, :edges)
+        ON CONFLICT DO NOTHING
+    """), {"users": num_users, "edges": num_edges})
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--edges", type=int, default=5000)
+    parser.add_argument("--stale", type=int, default=1000)
+    args = parser.parse_args()
+
+    seed(args.users, args.edges)
+
+    start = time.perf_counter()
+    rebuild_recommendations()
+    rebuild = time.perf_counter() - start
+    stored = db.session.scalar(select(func.count()).select_from(
+        Recommendation))
+
+    print(f"{args.users} users, {args.edges} follows")
+    print(f"rebuild: {rebuild:.2f}s "
+          f"({rebuild / args.users * 1e6:.0f} us/user), {stored} rows")
+
+    db.session.execute(text("""
+        INSERT INTO stale_recommendations (user_id)
+        SELECT id FROM users ORDER BY random() LIMIT :n
+    """), {"n": args.stale})
+    db.session.commit()
+
+    start = time.perf_counter()
+    refreshed = refresh_recommendations()
+    refresh = time.perf_counter() - start
+    print(f"refresh of {refreshed} stale users: {refresh:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
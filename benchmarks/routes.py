@@ -0,0 +1,344 @@
+"""End-to-end benchmark of the busiest routes.
+
+Seeds a scratch database at the chosen scale (generator/create_csvs.py,
+then seed.py), then requests every route in ROUTES in turn, `--requests`
+rounds, as the user who follows the most people. Prints p50/p95/p99
+latency, requests per second and SQL statements per request for each.
+
+Requests go through the Flask test client by default. With --gunicorn they
+go over HTTP to a local gunicorn instead, from `--clients` threads, each
+logged in as a different one of the users following the most people. SQL
+isn't counted then, since the queries run in other processes.
+
+Run from the repo root against a throwaway database:
+
+    createdb warbler_bench
+    python -m benchmarks.routes --users 10000 --save baseline.json
+    python -m benchmarks.routes --reuse --compare baseline.json
+    python -m benchmarks.routes --reuse --gunicorn 4 --clients 8
+
+--compare exits non-zero if any route's p95 grew by more than --tolerance,
+or it runs more SQL per request than in the baseline. --reuse benchmarks
+the database as it is instead of reseeding it; without it the database is
+dropped and recreated.
+"""
+
+import argparse
+import http.cookiejar
+import json
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+import numpy as np
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL', "postgresql:///warbler_bench")
+
+from sqlalchemy import event  # noqa: E402
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from models import db, Message, User  # noqa: E402
+from seed import seed  # noqa: E402
+
+# (name, method, path); paths are filled in with the viewer's user_id and
+# the message_id of someone else's message.
+ROUTES = [
+    ("home", "GET", "/"),
+    ("users", "GET", "/users"),
+    ("search", "GET", "/users?q=a"),
+    ("profile", "GET", "/users/{user_id}"),
+    ("following", "GET", "/users/{user_id}/following"),
+    ("followers", "GET", "/users/{user_id}/followers"),
+    ("likes", "GET", "/users/{user_id}/likes"),
+    ("message", "GET", "/messages/{message_id}"),
+    ("like", "POST", "/users/like/{message_id}?next=/"),
+    ("unlike", "POST", "/users/unlike/{message_id}?next=/"),
+    ("new message", "POST", "/messages/new"),
+]
+
+MESSAGE_TEXT = "Benchmarking, one two three."
+
+
+def seed_dataset(args):
+    with tempfile.TemporaryDirectory() as directory:
+        subprocess.run([
+            sys.executable, "generator/create_csvs.py", "--out", directory,
+            "--users", str(args.users), "--messages", str(args.messages),
+            "--follows", str(args.follows), "--likes", str(args.likes),
+        ], check=True)
+        seed(directory, report=lambda line: None)
+
+
+def pick_viewers(count):
+    """(user_id, message_id) for the `count` users following the most people.
+
+    The message is the newest one someone else wrote, for them to like.
+    """
+
+    viewers = []
+
+    for user in User.query.order_by(User.following_count.desc(), User.id
+                                    ).limit(count):
+        message = (Message.query.filter(Message.user_id != user.id)
+                   .order_by(Message.id.desc()).first())
+        viewers.append((user.id, message.id))
+
+    db.session.rollback()
+    return viewers
+
+
+class TestClientDriver:
+    """Sends requests through the Flask test client, counting SQL."""
+
+    def __init__(self, viewers):
+        app.config['WTF_CSRF_ENABLED'] = False
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = viewers[0][0]
+
+        self.statements = 0
+        event.listen(db.engine, 'before_cursor_execute', self.count)
+
+    def count(self, *args):
+        self.statements += 1
+
+    def send(self, client, method, path):
+        data = {"text": MESSAGE_TEXT} if method == "POST" else None
+        before = self.statements
+        start = time.perf_counter()
+        resp = self.client.open(path, method=method, data=data)
+        elapsed = time.perf_counter() - start
+        assert resp.status_code < 400, (path, resp.status_code)
+        return elapsed, self.statements - before
+
+    def close(self):
+        event.remove(db.engine, 'before_cursor_execute', self.count)
+
+
+class GunicornDriver:
+    """Sends requests over HTTP to a gunicorn it starts, a client per viewer.
+
+    Each client has its own session cookie, logged in as its viewer.
+    """
+
+    def __init__(self, viewers, workers, port):
+        self.base = f"http://127.0.0.1:{port}"
+        self.server = subprocess.Popen(
+            ["gunicorn", "--workers", str(workers), "--bind",
+             f"127.0.0.1:{port}", "--log-level", "warning", "app:app"],
+            env=dict(os.environ, FLASK_DEBUG="0"))
+
+        self.clients = []
+        try:
+            for user_id, message_id in viewers:
+                self.clients.append(self.login(user_id))
+        except BaseException:
+            self.close()
+            raise
+
+    def login(self, user_id):
+        """(opener, csrf_token) for a client logged in as `user_id`."""
+
+        # A session cookie signed the way the app signs its own
+        serializer = app.session_interface.get_signing_serializer(app)
+        jar = http.cookiejar.CookieJar()
+        jar.set_cookie(http.cookiejar.Cookie(
+            0, app.config['SESSION_COOKIE_NAME'],
+            serializer.dumps({CURR_USER_KEY: user_id}), None, False,
+            "127.0.0.1", False, False, "/", True, False, None, False, None,
+            None, {}))
+        opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(jar))
+
+        for _ in range(100):
+            try:
+                page = opener.open(self.base + "/").read().decode()
+                break
+            except OSError:
+                time.sleep(0.1)
+        else:
+            raise RuntimeError("gunicorn didn't start")
+
+        csrf_token = re.search(
+            r'name="csrf_token" type="hidden" value="([^"]+)"', page).group(1)
+        return opener, csrf_token
+
+    def send(self, client, method, path):
+        opener, csrf_token = self.clients[client]
+        data = None
+        if method == "POST":
+            data = urllib.parse.urlencode({
+                "csrf_token": csrf_token, "text": MESSAGE_TEXT,
+            }).encode()
+
+        start = time.perf_counter()
+        with opener.open(self.base + path, data) as resp:
+            resp.read()
+        return time.perf_counter() - start, None
+
+    def close(self):
+        self.server.terminate()
+        self.server.wait()
+
+
+def routes_for(user_id, message_id):
+    return [(name, method, path.format(user_id=user_id,
+                                       message_id=message_id))
+            for name, method, path in ROUTES]
+
+
+def run(driver, clients, rounds, warmup):
+    """Drive each client's routes from a thread of its own.
+
+    `clients` holds a list of routes per client. Returns
+    {route: (latencies, statements)} and the total wall time.
+    """
+
+    results = {name: ([], []) for name, method, path in ROUTES}
+    lock = threading.Lock()
+
+    def client(index, rounds, record):
+        for _ in range(rounds):
+            for name, method, path in clients[index]:
+                elapsed, statements = driver.send(index, method, path)
+                if record:
+                    with lock:
+                        results[name][0].append(elapsed)
+                        results[name][1].append(statements)
+
+    for index in range(len(clients)):
+        client(index, warmup, record=False)
+
+    threads = [threading.Thread(target=client, args=(index, rounds, True))
+               for index in range(len(clients))]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return results, time.perf_counter() - start
+
+
+def summarize(results, concurrency):
+    summary = {}
+
+    for name, (latencies, statements) in results.items():
+        latencies = np.array(latencies) * 1000
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+        counted = [count for count in statements if count is not None]
+        summary[name] = {
+            "p50": p50,
+            "p95": p95,
+            "p99": p99,
+            "rps": concurrency * 1000 / latencies.mean(),
+            "sql": np.mean(counted) if counted else None,
+        }
+
+    return summary
+
+
+def print_summary(summary, baseline=None):
+    print(f"{'route':<12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+          f"{'req/s':>8} {'sql':>6}" + ("  p95 vs baseline" if baseline
+                                        else ""))
+    for name, row in summary.items():
+        sql = "-" if row["sql"] is None else f"{row['sql']:.1f}"
+        line = (f"{name:<12} {row['p50']:>8.2f} {row['p95']:>8.2f} "
+                f"{row['p99']:>8.2f} {row['rps']:>8.0f} {sql:>6}")
+        if baseline and name in baseline:
+            change = row["p95"] / baseline[name]["p95"] - 1
+            line += f"  {change:+.0%}"
+        print(line)
+
+
+def regressions(summary, baseline, tolerance):
+    found = []
+
+    for name, row in summary.items():
+        before = baseline.get(name)
+        if not before:
+            continue
+        if row["p95"] > before["p95"] * (1 + tolerance):
+            found.append(f"{name}: p95 {before['p95']:.2f} ms -> "
+                         f"{row['p95']:.2f} ms")
+        if (row["sql"] is not None and before["sql"] is not None
+                and row["sql"] > before["sql"]):
+            found.append(f"{name}: {before['sql']:.1f} -> "
+                         f"{row['sql']:.1f} SQL statements per request")
+
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--messages", type=int, default=100000)
+    parser.add_argument("--follows", type=int, default=200000)
+    parser.add_argument("--likes", type=int, default=200000)
+    parser.add_argument("--reuse", action="store_true",
+                        help="Benchmark the existing data; don't reseed.")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Requests per route (per client).")
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--gunicorn", type=int, metavar="WORKERS",
+                        help="Go through a local gunicorn with WORKERS.")
+    parser.add_argument("--clients", type=int, default=4,
+                        help="Client threads when using gunicorn.")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--save", metavar="FILE")
+    parser.add_argument("--compare", metavar="FILE")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Allowed p95 growth over the baseline.")
+    args = parser.parse_args()
+
+    if not args.reuse:
+        seed_dataset(args)
+
+    viewers = pick_viewers(args.clients if args.gunicorn else 1)
+    clients = [routes_for(*viewer) for viewer in viewers]
+
+    if args.gunicorn:
+        driver = GunicornDriver(viewers, args.gunicorn, args.port)
+    else:
+        driver = TestClientDriver(viewers)
+
+    try:
+        results, wall = run(driver, clients, args.requests, args.warmup)
+    finally:
+        driver.close()
+
+    summary = summarize(results, len(clients))
+    total = sum(len(latencies) for latencies, statements in results.values())
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    print(f"{User.query.count()} users, {Message.query.count()} messages; "
+          f"viewing as user {viewers[0][0]}"
+          + (f" and {len(viewers) - 1} more" if len(viewers) > 1 else ""))
+    print_summary(summary, baseline)
+    print(f"\n{total} requests in {wall:.1f}s: {total / wall:.0f} req/s")
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if baseline:
+        found = regressions(summary, baseline, args.tolerance)
+        for problem in found:
+            print(f"REGRESSION {problem}")
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark streamed against rendered followers pages.
+
+Fills a scratch database with a user followed by --followers users, then
+requests their followers page --repeat times each way and prints the
+median time to the first byte and to the last, and the peak Python
+memory allocated while serving one request (tracemalloc):
+
+- rendered, at the normal page size (LISTING_PAGE_SIZE, 60);
+- rendered, at the streamed page size (STREAMED_PAGE_SIZE, 600);
+- streamed (STREAM_LISTINGS on), at the streamed page size.
+
+Run from the repo root against a throwaway database:
+
+    createdb warbler_bench
+    python -m benchmarks.streaming
+
+The database is dropped and recreated.
+"""
+
+import argparse
+import os
+import statistics
+import time
+import tracemalloc
+from functools import partial
+from unittest.mock import patch
+
+os.environ['DATABASE_URL'] = os.environ.get(
+    'BENCH_DATABASE_URL', "postgresql:///warbler_bench")
+
+from app import app, CURR_USER_KEY  # noqa: E402
+from listings import LISTING_PAGE_SIZE, followers_page  # noqa: E402
+from models import db, Follow, User  # noqa: E402
+from streaming import STREAMED_PAGE_SIZE  # noqa: E402
+
+
+def seed(num_followers):
+    """Create a user with `num_followers` followers; return their id."""
+
+    db.drop_all()
+    db.create_all()
+
+    user = User(username="popular", email="popular@example.com",
+                password="x")
+    followers = [User(username=f"fan{n}", email=f"fan{n}@example.com",
+                      password="x", bio="Here for the warbles.")
+                 for n in range(num_followers)]
+    db.session.add_all([user] + followers)
+    db.session.flush()
+
+    db.session.add_all([Follow(user_being_followed_id=user.id,
+                               user_following_id=follower.id)
+                        for follower in followers])
+    db.session.commit()
+
+    return user.id
+
+
+def fetch(client, url):
+    """(ms to first chunk, ms to last, peak bytes allocated)."""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    resp = client.get(url, buffered=False)
+    chunks = iter(resp.response)
+    next(chunks, None)
+    first = time.perf_counter()
+    for _ in chunks:
+        pass
+    resp.close()
+    last = time.perf_counter()
+
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return (first - start) * 1000, (last - start) * 1000, peak
+
+
+def measure(client, url, repeat):
+    for _ in range(5):
+        fetch(client, url)
+
+    samples = [fetch(client, url) for _ in range(repeat)]
+    return [statistics.median(column) for column in zip(*samples)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--followers", type=int,
+                        default=STREAMED_PAGE_SIZE)
+    parser.add_argument("--repeat", type=int, default=50)
+    args = parser.parse_args()
+
+    user_id = seed(args.followers)
+    url = f'/users/{user_id}/followers'
+
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess[CURR_USER_KEY] = user_id
+
+    print(f"{'mode':>16} {'first ms':>10} {'last ms':>10} {'peak KiB':>10}")
+
+    runs = [
+        (f"rendered {LISTING_PAGE_SIZE}", False, followers_page),
+        (f"rendered {STREAMED_PAGE_SIZE}", False,
+         partial(followers_page, limit=STREAMED_PAGE_SIZE)),
+        (f"streamed {STREAMED_PAGE_SIZE}", True, followers_page),
+    ]
+
+    for label, stream, page in runs:
+        app.config['STREAM_LISTINGS'] = stream
+        with patch('app.followers_page', page):
+            first, last, peak = measure(client, url, args.repeat)
+        print(f"{label:>16} {first:>10.2f} {last:>10.2f} "
+              f"{peak / 1024:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
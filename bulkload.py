@@ -0,0 +1,210 @@
+"""Streaming bulk loads of CSV files, resumable from checkpoints.
+
+`copy_csv()` streams a file into its table through Postgres' COPY, which
+skips per-row statement overhead entirely, `COPY_CHUNK_ROWS` rows at a time.
+Each chunk commits together with its LoadCheckpoint row, so memory use
+doesn't grow with the file and an interrupted load picks up after the last
+committed chunk.
+
+Maintaining indexes and checking constraints row by row is most of the cost
+of a big insert. `start_load()` drops the secondary indexes, unique and
+foreign-key constraints of the tables about to be loaded (saving the DDL to
+recreate them as DeferredDDL rows), and `finish_load()` rebuilds them in one
+pass each once the data is in. Primary keys stay.
+
+Files must hold one row per line: COPY handles quoting, but chunks are
+split on newlines.
+"""
+
+import csv
+import io
+import os
+
+from sqlalchemy import delete, inspect, select, text
+
+from models import db, DeferredDDL, LoadCheckpoint
+
+COPY_CHUNK_ROWS = 100000
+
+
+class _Lines:
+    """File-like view of the next `limit` lines of binary file `f`.
+
+    What COPY reads from; `suffix` is spliced onto the end of each line.
+    """
+
+    def __init__(self, f, limit, suffix=b""):
+        self.f = f
+        self.left = limit
+        self.suffix = suffix
+        self.rows = 0
+
+    def read(self, size=-1):
+        lines = []
+        length = 0
+
+        while self.left and (size < 0 or length < size):
+            line = self.f.readline()
+            if not line:
+                self.left = 0
+                break
+            if self.suffix:
+                line = line.rstrip(b"\r\n") + self.suffix + b"\n"
+            lines.append(line)
+            length += len(line)
+            self.left -= 1
+            self.rows += 1
+
+        return b"".join(lines)
+
+
+def _default_columns(table, header):
+    """Columns missing from `header` that COPY must be given values for.
+
+    Returns (names, suffix): the columns with a Python-side default, and
+    those defaults as the CSV text to append to each line. COPY never runs
+    Python defaults; callable ones are evaluated once for the whole load.
+    """
+
+    names = []
+    values = []
+
+    for column in table.columns:
+        if column.name in header or column.default is None:
+            continue
+        default = column.default
+        value = default.arg(None) if default.is_callable else default.arg
+        names.append(column.name)
+        values.append(str(value).lower() if isinstance(value, bool)
+                      else value)
+
+    if not names:
+        return names, b""
+
+    # Quoted, or COPY would read an empty string as NULL
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="",
+               quoting=csv.QUOTE_NONNUMERIC).writerow(values)
+    return names, b"," + buffer.getvalue().encode()
+
+
+def load_in_progress():
+    """Did a load start that hasn't finished?"""
+
+    # On a connection of its own: a session transaction left open here
+    # would block the caller's drop_all().
+    with db.engine.connect() as conn:
+        if not inspect(conn).has_table(LoadCheckpoint.__tablename__):
+            return False
+
+        return bool(conn.scalar(select(LoadCheckpoint.path).limit(1))
+                    or conn.scalar(select(DeferredDDL.id).limit(1)))
+
+
+def start_load(tables):
+    """Drop the secondary indexes and constraints of `tables` until later.
+
+    Saves the DDL to restore them as DeferredDDL rows, in the order to run
+    it: indexes and unique constraints first, then the foreign keys that
+    may depend on them. Commits.
+    """
+
+    conn = db.session.connection()
+    indexes = []
+    uniques = []
+    foreign_keys = []
+
+    for table in tables:
+        constraints = conn.execute(text("""
+            SELECT conname, contype, pg_get_constraintdef(oid)
+            FROM pg_constraint
+            WHERE conrelid = CAST(:table AS regclass)
+              AND contype IN ('u', 'f')
+        """), {'table': table.name}).all()
+        for name, kind, definition in constraints:
+            restore = (f'ALTER TABLE "{table.name}" '
+                       f'ADD CONSTRAINT "{name}" {definition}')
+            drop = f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{name}"'
+            (uniques if kind == 'u' else foreign_keys).append((drop, restore))
+
+        secondary = conn.execute(text("""
+            SELECT relname, pg_get_indexdef(indexrelid)
+            FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+            WHERE indrelid = CAST(:table AS regclass)
+              AND NOT indisprimary
+              AND indexrelid NOT IN (SELECT conindid FROM pg_constraint)
+        """), {'table': table.name}).all()
+        for name, definition in secondary:
+            indexes.append((f'DROP INDEX "{name}"', definition))
+
+    for drop, restore in foreign_keys + uniques + indexes:
+        conn.exec_driver_sql(drop)
+
+    db.session.add_all([DeferredDDL(statement=restore)
+                        for drop, restore in indexes + uniques + foreign_keys])
+    db.session.commit()
+
+
+def copy_csv(table, path, chunk_rows=COPY_CHUNK_ROWS, report=print):
+    """Stream the CSV file at `path` into `table`; return the rows loaded.
+
+    The header line names the columns. Resumes from the file's
+    LoadCheckpoint, if any, and calls `report` with a progress line after
+    each committed chunk.
+    """
+
+    checkpoint = db.session.get(LoadCheckpoint, path)
+    size = os.path.getsize(path)
+
+    with open(path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode()]))
+        names, suffix = _default_columns(table, header)
+        columns = ", ".join(f'"{name}"' for name in header + names)
+        statement = f'COPY "{table.name}" ({columns}) FROM STDIN (FORMAT csv)'
+
+        if checkpoint:
+            f.seek(checkpoint.position)
+        else:
+            checkpoint = LoadCheckpoint(path=path, position=f.tell(), rows=0)
+            db.session.add(checkpoint)
+
+        # Ids burnt by a chunk that rolled back would shift every later
+        # row's id, and files loaded after this one refer to rows by id.
+        column = table.autoincrement_column
+        if column is not None:
+            db.session.execute(text(f"""
+                SELECT setval(pg_get_serial_sequence(:table, :column),
+                              COALESCE(MAX("{column.name}"), 0) + 1, false)
+                FROM "{table.name}"
+            """), {'table': table.name, 'column': column.name})
+
+        while checkpoint.position < size:
+            lines = _Lines(f, chunk_rows, suffix)
+            cursor = db.session.connection().connection.cursor()
+            cursor.copy_expert(statement, lines)
+
+            checkpoint.position = f.tell()
+            checkpoint.rows += lines.rows
+            db.session.commit()
+            report(f"{path}: {checkpoint.rows:,} rows "
+                   f"({checkpoint.position / size:.0%})")
+
+    return checkpoint.rows
+
+
+def finish_load():
+    """Restore what start_load() dropped, forget the checkpoints, ANALYZE.
+
+    Each statement commits with the removal of its DeferredDDL row, so an
+    interrupted finish resumes too.
+    """
+
+    for ddl in DeferredDDL.query.order_by(DeferredDDL.id).all():
+        db.session.connection().exec_driver_sql(ddl.statement)
+        db.session.delete(ddl)
+        db.session.commit()
+
+    db.session.execute(delete(LoadCheckpoint))
+    db.session.commit()
+    db.session.execute(text("ANALYZE"))
+    db.session.commit()
@@ -0,0 +1,139 @@
+"""Small in-process caches.
+
+`TTLCache` is a bounded LRU map whose entries also expire after a fixed
+time. Each worker process has its own, so entries can be stale for up to
+`ttl` seconds after another process changes the underlying row; only cache
+things where that is acceptable, and invalidate explicitly where this
+process makes the change.
+
+`current_users` holds the logged-in user's row for `add_user_to_g`, so most
+requests don't need a primary-key lookup on users.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import make_transient_to_detached
+
+from models import db, User
+
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL = 60
+
+
+class TTLCache:
+    """A thread-safe LRU cache of at most `maxsize` entries, each kept for
+    at most `ttl` seconds.
+
+    `hits` and `misses` count lookups, for judging how much it saves.
+    """
+
+    def __init__(self, maxsize, ttl, clock=monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """Return the live value for `key`, or None."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None or entry[0] <= self.clock():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """Store `value` under `key`, evicting the least recently used."""
+
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """Drop `key`, if present."""
+
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Drop every entry and reset the counters."""
+
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """Return a dict of hits, misses, hit rate and current size."""
+
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'size': len(self),
+        }
+
+
+current_users = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
+_USER_COLUMNS = [attr.key for attr in inspect(User).column_attrs]
+
+
+def get_current_user(user_id):
+    """Return the User with `user_id`, attached to the current session.
+
+    On a cache hit the user is rebuilt from its cached column values and
+    merged into the session without a query; relationships still lazy-load
+    as usual. Returns None if there is no such user.
+    """
+
+    columns = current_users.get(user_id)
+
+    if columns is None:
+        user = db.session.get(User, user_id)
+
+        if user is not None:
+            current_users.set(user_id, {name: getattr(user, name)
+                                        for name in _USER_COLUMNS})
+        return user
+
+    user = User(**columns)
+    make_transient_to_detached(user)
+    return db.session.merge(user, load=False)
+
+
+def forget_user(user_id):
+    """Drop `user_id` from the current-user cache."""
+
+    current_users.invalidate(user_id)
+
+
+@event.listens_for(db.session, 'after_flush')
+def forget_flushed_users(session, flush_context):
+    """Invalidate cached users changed or deleted in this flush.
+
+    Covers counter bumps and other writes through the session; routes that
+    change the current user outside it (bulk updates) call forget_user().
+    """
+
+    for user in (*session.dirty, *session.deleted):
+        if isinstance(user, User):
+            forget_user(user.id)
@@ -0,0 +1,133 @@
+"""Conditional GET for pages whose content we can version cheaply.
+
+A page that supports it loads its data as usual, then calls
+`render_conditional()` with the versions of everything the page shows
+instead of `render_template()`. The versions (see `version()`) and the
+viewer's own state are hashed into a weak ETag; if the browser's
+If-None-Match already holds it, the response is a 304 and the template is
+never rendered. Responses that aren't templates (the JSON API) use
+`etag_for()` and `conditional()` the same way.
+
+Such pages are sent `Cache-Control: private, no-cache`: browsers keep them
+but revalidate on every use. Other responses, forms in particular, stay
+`no-store` (see `add_header` in app.py).
+
+Every page embeds a CSRF token, which Flask-WTF only accepts from the
+session whose secret signed it, and only for WTF_CSRF_TIME_LIMIT seconds.
+The ETag covers that secret, so a page cached under another session (a
+re-login, a restarted browser) is re-rendered, and changes every half of
+the time limit (see `csrf_window()`), so a cached page is re-rendered with
+a fresh token well before the one it holds expires. A session without a
+secret yet always gets the page rendered, which creates one. Pages with
+flashed messages waiting are always rendered too, so the messages get
+shown.
+"""
+
+import hashlib
+import time
+from operator import attrgetter
+
+from flask import (
+    current_app, g, make_response, render_template, request, session)
+from flask_wtf.csrf import generate_csrf
+from sqlalchemy.engine import Row
+
+from models import Message, User
+
+# The columns of each model a page can show and that can change. Message
+# text and timestamps never do.
+VERSION_COLUMNS = {
+    User: attrgetter(
+        'id', 'username', 'image_url', 'header_image_url', 'bio',
+        'location', 'messages_count', 'followers_count', 'following_count',
+        'likes_count'),
+    Message: attrgetter('id', 'user_id', 'like_count'),
+}
+
+
+def version(value):
+    """A comparable stand-in for everything about `value` a page can show.
+
+    Models in VERSION_COLUMNS become those columns' values, Rows their
+    values; lists, tuples and sets are versioned item by item.
+    """
+
+    columns = VERSION_COLUMNS.get(type(value))
+    if columns is not None:
+        return columns(value)
+
+    if isinstance(value, Row):
+        return tuple(value)
+
+    if isinstance(value, (list, tuple)):
+        return tuple(version(item) for item in value)
+
+    if isinstance(value, (set, frozenset)):
+        return tuple(sorted(value))
+
+    return value
+
+
+def csrf_window():
+    """A number that goes up every half CSRF token lifetime."""
+
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600) or 3600
+    return int(time.time() // (limit / 2))
+
+
+def etag_for(*versions):
+    """The ETag for a response showing `versions` to the current viewer."""
+
+    state = (request.endpoint, version(g.user), version(versions))
+    return hashlib.sha1(repr(state).encode()).hexdigest()
+
+
+def csrf_secret():
+    """The session's CSRF secret, which the page's token is signed with."""
+
+    return session.get(
+        current_app.config.get('WTF_CSRF_FIELD_NAME', 'csrf_token'))
+
+
+def page_etag(*versions):
+    """etag_for() a page, which also changes with its CSRF token."""
+
+    return etag_for(csrf_secret(), csrf_window(), *versions)
+
+
+def conditional(etag, build, allow_304=True):
+    """The response `build()` makes, or a 304 if the client has `etag`.
+
+    Either way it carries the ETag and is revalidated before reuse.
+    """
+
+    if allow_304 and request.if_none_match.contains_weak(etag):
+        response = make_response("", 304)
+    else:
+        response = make_response(build())
+
+    response.set_etag(etag, weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+
+    return response
+
+
+def render_conditional(versions, template, **context):
+    """render_template(template, **context), or a 304 if nothing changed.
+
+    `versions` lists everything the page shows that can change, beyond the
+    viewer (always included).
+    """
+
+    csrf_pending = False
+
+    if current_app.config.get('WTF_CSRF_ENABLED', True):
+        csrf_pending = not csrf_secret()
+        # Make the secret now, so the ETag covers the one the page uses
+        generate_csrf()
+
+    return conditional(page_etag(*versions),
+                       lambda: render_template(template, **context),
+                       allow_304=not (csrf_pending or
+                                      session.get('_flashes')))
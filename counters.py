@@ -0,0 +1,142 @@
+"""Denormalized engagement counters.
+
+`User` carries messages/followers/following/likes counts and `Message`
+carries its like count, so pages can print a number without loading the
+collection behind it. Routes bump them in the same transaction as the row
+they count; `reconcile_counters()` recomputes them from the underlying tables
+when they drift (bulk loads, manual SQL, bugs).
+"""
+
+from sqlalchemy import func, or_, select, update
+
+from models import db, Follow, Like, Message, User
+
+RECONCILE_BATCH_SIZE = 10000
+
+
+def bump(obj, **deltas):
+    """Add `deltas` to counter columns of `obj` as an atomic SQL update.
+
+    e.g. bump(user, followers_count=1) flushes as
+    `UPDATE users SET followers_count = followers_count + 1`, so concurrent
+    requests can't lose each other's increments.
+    """
+
+    for name, delta in deltas.items():
+        setattr(obj, name, getattr(type(obj), name) + delta)
+
+
+def release_user_counts(user_id):
+    """Decrement other rows' counters for everything `user_id` is part of.
+
+    Call before deleting the user: the people they follow lose a follower,
+    their followers follow one fewer user, messages they liked lose a like,
+    and users who liked their messages lose those likes.
+    """
+
+    followed = select(Follow.user_being_followed_id).where(
+        Follow.user_following_id == user_id)
+    followers = select(Follow.user_following_id).where(
+        Follow.user_being_followed_id == user_id)
+    liked = select(Like.message_id).where(Like.user_id == user_id)
+
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(followed))
+        .values(followers_count=User.followers_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(followers))
+        .values(following_count=User.following_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.execute(
+        update(Message)
+        .where(Message.id.in_(liked))
+        .values(like_count=Message.like_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+    likers = (
+        select(Like.user_id, func.count().label('n'))
+        .join(Message, Message.id == Like.message_id)
+        .where(Message.user_id == user_id)
+        .group_by(Like.user_id)
+        .subquery()
+    )
+    db.session.execute(
+        update(User)
+        .where(User.id == likers.c.user_id)
+        .values(likes_count=User.likes_count - likers.c.n)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def release_message_counts(message_id):
+    """Decrement likes_count of everyone who liked `message_id`.
+
+    Call before deleting the message.
+    """
+
+    likers = select(Like.user_id).where(Like.message_id == message_id)
+
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(likers))
+        .values(likes_count=User.likes_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def _count_where(column, key):
+    return select(func.count()).where(column == key).scalar_subquery()
+
+
+def _reconcile_range(model, counts, start, stop):
+    """Rewrite drifted counters for ids in [start, stop); return rowcount."""
+
+    drifted = or_(*(getattr(model, name) != value
+                    for name, value in counts.items()))
+    result = db.session.execute(
+        update(model)
+        .where(model.id >= start, model.id < stop, drifted)
+        .values(**counts)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+def reconcile_counters(batch_size=RECONCILE_BATCH_SIZE):
+    """Recompute every counter from the rows it counts.
+
+    Works through id ranges of `batch_size`, committing after each, so it
+    can run against a live database without holding long locks. Only rows
+    whose stored counts are wrong are written.
+
+    Returns (users_fixed, messages_fixed).
+    """
+
+    user_counts = {
+        'messages_count': _count_where(Message.user_id, User.id),
+        'followers_count': _count_where(Follow.user_being_followed_id, User.id),
+        'following_count': _count_where(Follow.user_following_id, User.id),
+        'likes_count': _count_where(Like.user_id, User.id),
+    }
+    message_counts = {
+        'like_count': _count_where(Like.message_id, Message.id),
+    }
+
+    fixed = []
+    for model, counts in ((User, user_counts), (Message, message_counts)):
+        total = 0
+        last_id = db.session.scalar(select(func.max(model.id))) or 0
+
+        for start in range(1, last_id + 1, batch_size):
+            total += _reconcile_range(model, counts, start, start + batch_size)
+            db.session.commit()
+
+        fixed.append(total)
+
+    return tuple(fixed)
@@ -0,0 +1,388 @@
+"""An in-memory copy of the follow graph, for workers that want one.
+
+When FOLLOW_GRAPH_ENABLED is set, each worker loads the `follows` table at
+boot into compressed sparse row (CSR) arrays: for each direction, an
+`indptr` array indexed by user id and an `indices` array holding each
+user's neighbours, sorted. Lists, counts and membership checks are then
+array slices and binary searches, with no query and no User objects.
+
+Follows and unfollows made by this worker's routes are applied as they
+happen, to small per-user added/removed sets that are folded back into the
+arrays once they grow past COMPACT_THRESHOLD. Changes made by other
+workers (or by SQL) only show up when the graph is reloaded, which happens
+in the background once it is older than FOLLOW_GRAPH_MAX_AGE seconds; so
+treat answers as possibly that stale. Changes this worker makes while a
+reload runs are replayed onto the new graph.
+
+Being stale, the graph doesn't answer anything a page shows the viewer
+about their own follows (see hydration.load_follow_state). Follower and
+following counts come from the counters on `users`, which are exact, and
+the following/followers pages read a keyset page of user cards straight
+from the database (see listings.py); the graph would add staleness there
+without saving a query. It serves work that can tolerate a lag: when a
+process has one, "who to follow" recommendations are computed from
+`follow_matrix()` instead of reading the follows table for each batch
+(see recommendations.py).
+
+Memory is about 8 bytes per edge (a 4-byte id in each direction) plus
+16 bytes per user id; see benchmarks/follow_graph.py. Loading streams the
+table into int32 arrays of the same 8 bytes per edge, and building the
+sorted arrays from them briefly needs a few times that again, so a reload
+peaks at several times the graph's size, not at a Python row per edge.
+"""
+
+import threading
+import time
+from collections import defaultdict
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import func, select
+
+from models import db, Follow
+
+COMPACT_THRESHOLD = 10000
+LOAD_CHUNK_SIZE = 100000
+FOLLOW_GRAPH_MAX_AGE = 300
+
+_EMPTY = np.empty(0, dtype=np.int32)
+
+
+class Adjacency:
+    """One direction of the graph: row id -> sorted array of column ids."""
+
+    def __init__(self, rows, cols):
+        order = np.lexsort((cols, rows))
+        rows = rows[order]
+        size = int(rows[-1]) + 1 if len(rows) else 0
+
+        self.indptr = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=size), out=self.indptr[1:])
+        self.indices = cols[order].astype(np.int32)
+        self.added = defaultdict(set)
+        self.removed = defaultdict(set)
+        self.pending = 0
+        self.size = len(self.indices)
+        self._matrix = None
+
+    @property
+    def nbytes(self):
+        """Bytes held by the CSR arrays."""
+
+        return self.indptr.nbytes + self.indices.nbytes
+
+    def _base(self, row):
+        if row >= len(self.indptr) - 1:
+            return _EMPTY
+        return self.indices[self.indptr[row]:self.indptr[row + 1]]
+
+    def _in_base(self, row, col):
+        base = self._base(row)
+        i = np.searchsorted(base, col)
+        return bool(i < len(base) and base[i] == col)
+
+    def contains(self, row, col):
+        if col in self.added.get(row, ()):
+            return True
+        if col in self.removed.get(row, ()):
+            return False
+        return self._in_base(row, col)
+
+    def row(self, row):
+        """Sorted array of `row`'s neighbours."""
+
+        ids = self._base(row)
+        removed = self.removed.get(row)
+        added = self.added.get(row)
+
+        if removed:
+            ids = ids[~np.isin(ids, list(removed))]
+        if added:
+            ids = np.union1d(ids, np.fromiter(added, dtype=np.int32))
+        return ids
+
+    def count(self, row):
+        return (len(self._base(row)) - len(self.removed.get(row, ()))
+                + len(self.added.get(row, ())))
+
+    def matrix(self, size=0):
+        """The arrays as a square scipy CSR matrix of ones, sharing them.
+
+        At least `size` rows. Pending changes aren't included. Built once,
+        and again only for a bigger `size`.
+        """
+
+        if self._matrix is None or self._matrix.shape[0] < size:
+            size = max(size, len(self.indptr) - 1,
+                       int(self.indices.max(initial=-1)) + 1)
+            indptr = np.pad(self.indptr, (0, size + 1 - len(self.indptr)),
+                            mode='edge')
+            self._matrix = sparse.csr_matrix(
+                (np.ones(len(self.indices), dtype=np.int32), self.indices,
+                 indptr),
+                shape=(size, size),
+            )
+        return self._matrix
+
+    def add(self, row, col):
+        if col in self.removed.get(row, ()):
+            self.removed[row].discard(col)
+            self.pending -= 1
+            self.size += 1
+        elif not self._in_base(row, col) and col not in self.added[row]:
+            self.added[row].add(col)
+            self.pending += 1
+            self.size += 1
+
+    def discard(self, row, col):
+        if col in self.added.get(row, ()):
+            self.added[row].discard(col)
+            self.pending -= 1
+            self.size -= 1
+        elif self._in_base(row, col) and col not in self.removed[row]:
+            self.removed[row].add(col)
+            self.pending += 1
+            self.size -= 1
+
+    def edges(self):
+        """Return (rows, cols) arrays of every edge, changes included."""
+
+        rows = np.repeat(np.arange(len(self.indptr) - 1, dtype=np.int64),
+                         np.diff(self.indptr))
+        cols = self.indices.astype(np.int64)
+
+        removed = [(row << 32) | col
+                   for row, cols_removed in self.removed.items()
+                   for col in cols_removed]
+        if removed:
+            keep = ~np.isin((rows << 32) | cols, removed)
+            rows, cols = rows[keep], cols[keep]
+
+        added = [(row, col) for row, cols_added in self.added.items()
+                 for col in cols_added]
+        if added:
+            extra = np.array(added, dtype=np.int64)
+            rows = np.concatenate([rows, extra[:, 0]])
+            cols = np.concatenate([cols, extra[:, 1]])
+
+        return rows, cols
+
+
+class FollowGraph:
+    """Both directions of the follow graph, safe to share between threads.
+
+    Every read and change holds the lock, since changes edit the
+    added/removed sets in place and compaction swaps both directions.
+    """
+
+    def __init__(self, followers, followed):
+        """Build from parallel arrays of follower and followed user ids."""
+
+        followers = np.asarray(followers, dtype=np.int32)
+        followed = np.asarray(followed, dtype=np.int32)
+
+        self._following = Adjacency(followers, followed)
+        self._followers = Adjacency(followed, followers)
+        self._lock = threading.Lock()
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def load(cls, conn, chunk_size=LOAD_CHUNK_SIZE):
+        """Read every row of `follows` through `conn`.
+
+        Rows are streamed `chunk_size` at a time into int32 arrays sized
+        from a count first, so only one chunk is ever held as Python rows.
+        """
+
+        size = conn.scalar(select(func.count()).select_from(Follow))
+        pairs = np.empty((size, 2), dtype=np.int32)
+        loaded = 0
+
+        result = conn.execute(
+            select(Follow.user_following_id, Follow.user_being_followed_id),
+            execution_options={'yield_per': chunk_size})
+        for rows in result.partitions():
+            # Follows made since the count need more room
+            if loaded + len(rows) > len(pairs):
+                pairs = np.resize(
+                    pairs, (max(2 * len(pairs), loaded + len(rows)), 2))
+            pairs[loaded:loaded + len(rows)] = rows
+            loaded += len(rows)
+
+        pairs = pairs[:loaded]
+        return cls(pairs[:, 0], pairs[:, 1])
+
+    @property
+    def nbytes(self):
+        """Bytes held by the arrays of both directions."""
+
+        with self._lock:
+            return self._following.nbytes + self._followers.nbytes
+
+    def __len__(self):
+        with self._lock:
+            return self._following.size
+
+    def is_following(self, follower_id, followed_id):
+        with self._lock:
+            return self._following.contains(follower_id, followed_id)
+
+    def following_ids(self, user_id):
+        """Sorted array of the ids `user_id` follows."""
+
+        with self._lock:
+            return self._following.row(user_id)
+
+    def follower_ids(self, user_id):
+        """Sorted array of the ids following `user_id`."""
+
+        with self._lock:
+            return self._followers.row(user_id)
+
+    def following_count(self, user_id):
+        with self._lock:
+            return self._following.count(user_id)
+
+    def followers_count(self, user_id):
+        with self._lock:
+            return self._followers.count(user_id)
+
+    def follow_matrix(self, size=0):
+        """Sparse matrix A, at least `size` square, with A[u, v] = 1 if u
+        follows v.
+
+        Pending changes are folded into the arrays first, so the matrix
+        shares them rather than copying.
+        """
+
+        with self._lock:
+            if self._following.pending:
+                self._compact()
+            return self._following.matrix(size)
+
+    def add(self, follower_id, followed_id):
+        with self._lock:
+            self._following.add(follower_id, followed_id)
+            self._followers.add(followed_id, follower_id)
+            self._maybe_compact()
+
+    def remove(self, follower_id, followed_id):
+        with self._lock:
+            self._following.discard(follower_id, followed_id)
+            self._followers.discard(followed_id, follower_id)
+            self._maybe_compact()
+
+    def remove_user(self, user_id):
+        """Drop every edge touching `user_id`."""
+
+        for followed_id in self.following_ids(user_id):
+            self.remove(user_id, int(followed_id))
+        for follower_id in self.follower_ids(user_id):
+            self.remove(int(follower_id), user_id)
+
+    def _maybe_compact(self):
+        if self._following.pending > COMPACT_THRESHOLD:
+            self._compact()
+
+    def _compact(self):
+        rows, cols = self._following.edges()
+        self._following = Adjacency(rows, cols)
+        self._followers = Adjacency(cols, rows)
+
+
+_graph = None
+_reloading = threading.Lock()
+
+# (method, args) of the changes applied while a reload runs, to replay on
+# the graph it loads; None when no reload is running
+_journal = None
+_changes = threading.Lock()
+
+
+def get_follow_graph():
+    """This worker's FollowGraph, or None if it isn't enabled."""
+
+    return _graph
+
+
+def _record(method, *args):
+    with _changes:
+        if _graph is not None:
+            getattr(_graph, method)(*args)
+        if _journal is not None:
+            _journal.append((method, args))
+
+
+def record_follow(follower_id, followed_id):
+    """Apply a committed follow to this worker's graph, if it has one."""
+
+    _record('add', follower_id, followed_id)
+
+
+def record_unfollow(follower_id, followed_id):
+    """Apply a committed unfollow to this worker's graph, if it has one."""
+
+    _record('remove', follower_id, followed_id)
+
+
+def record_user_deleted(user_id):
+    """Drop a deleted user's edges from this worker's graph, if it has one."""
+
+    _record('remove_user', user_id)
+
+
+def reload_follow_graph():
+    """Replace this worker's graph with a fresh copy of `follows`.
+
+    Changes recorded while it loads are replayed onto the new copy, which
+    may or may not already include them (replaying is harmless either way).
+    Needs an app context.
+    """
+
+    global _graph, _journal
+
+    with _changes:
+        _journal = []
+
+    try:
+        with db.engine.connect() as conn:
+            graph = FollowGraph.load(conn)
+    except BaseException:
+        with _changes:
+            _journal = None
+        raise
+
+    with _changes:
+        for method, args in _journal:
+            getattr(graph, method)(*args)
+        _graph = graph
+        _journal = None
+
+
+def _reload_in_background(app):
+    if not _reloading.acquire(blocking=False):
+        return
+
+    def reload():
+        try:
+            with app.app_context():
+                reload_follow_graph()
+        finally:
+            _reloading.release()
+
+    threading.Thread(target=reload, daemon=True).start()
+
+
+def init_follow_graph(app):
+    """Load the graph now, and reload it when stale, if it is enabled."""
+
+    if not app.config.get('FOLLOW_GRAPH_ENABLED'):
+        return
+
+    reload_follow_graph()
+    max_age = app.config.get('FOLLOW_GRAPH_MAX_AGE', FOLLOW_GRAPH_MAX_AGE)
+
+    @app.before_request
+    def refresh_follow_graph():
+        if _graph is not None and time.monotonic() - _graph.loaded_at > max_age:
+            _reload_in_background(app)
@@ -0,0 +1,103 @@
+"""Cached HTML for messages in lists.
+
+Every page listing messages (home, profile, likes) renders each one with
+`message_item`, and the message page renders its like button with
+`like_form`; both come from the macros in templates/messages/item.html.
+
+Most of that HTML is the same for every viewer, so it is rendered once and
+kept in `fragments`, a per-process cache. Keys hold everything the HTML
+shows that can change: the message id, its author's username and avatar
+(standing in for a profile version) and its like count (the like-count
+version). A change makes a new key rather than a stale entry, so nothing
+is ever invalidated; old entries age out of the LRU.
+
+The viewer-specific parts (like or unlike, disabled on their own message,
+the page to return to, their CSRF token) are left in the cached HTML as
+slots and filled in on each request by joining strings.
+"""
+
+import re
+
+from flask import g, get_template_attribute
+from markupsafe import Markup, escape
+
+from caching import TTLCache
+
+FRAGMENT_CACHE_SIZE = 20000
+FRAGMENT_CACHE_TTL = 3600
+
+MACROS = 'messages/item.html'
+
+# Slots are NUL-delimited: Postgres text can't hold a NUL, so no message
+# text or username can forge one
+_SLOT = re.compile('\0(\\w+)\0')
+
+fragments = TTLCache(FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL)
+
+
+def _slot(name):
+    return Markup(f"\0{name}\0")
+
+
+SLOTS = {name: _slot(name)
+         for name in ('action', 'button', 'icon', 'next', 'csrf')}
+
+
+def _cached(key, macro, *args):
+    """The parts of `macro(*args)`: static HTML alternating with slot names."""
+
+    parts = fragments.get(key)
+
+    if parts is None:
+        html = get_template_attribute(MACROS, macro)(*args, **SLOTS)
+        parts = _SLOT.split(str(html))
+        fragments.set(key, parts)
+
+    return parts
+
+
+def _fill(parts, message, liked, csrf, next_url):
+    own = g.user is not None and message.user_id == g.user.id
+    slots = {
+        'action': 'unlike' if liked and not own else 'like',
+        'button': 'like-button  disabled-like' if own else 'like-button',
+        'icon': 'bi-heart-fill' if liked and not own else 'bi-heart',
+        'next': str(escape(next_url)),
+        'csrf': str(csrf),
+    }
+
+    filled = parts[:]
+    filled[1::2] = [slots[name] for name in parts[1::2]]
+    return Markup("".join(filled))
+
+
+def message_item(message, author_username, author_image_url, liked, csrf,
+                 next_url):
+    """The <li> for `message` in a list, as the current viewer sees it.
+
+    `csrf` is the page's form.hidden_tag(); `next_url` is where liking it
+    returns to.
+    """
+
+    key = ('item', message.id, author_username, author_image_url,
+           message.like_count)
+    parts = _cached(key, 'message_item', message, author_username,
+                    author_image_url)
+
+    return _fill(parts, message, liked, csrf, next_url)
+
+
+def like_form(message, liked, csrf, next_url, form_class):
+    """The like/unlike button and count for `message`."""
+
+    key = ('like_form', message.id, message.like_count, form_class)
+    parts = _cached(key, 'like_form', message, form_class)
+
+    return _fill(parts, message, liked, csrf, next_url)
+
+
+def init_fragments(app):
+    """Make `message_item` and `like_form` available to templates."""
+
+    app.add_template_global(message_item)
+    app.add_template_global(like_form)
@@ -2,88 +2,214 @@
 
 Students won't need to run this for the exercise; they will just use the CSV
 files that this generates. You should only need to run this if you wanted to
-tweak the CSV formats or generate fewer/more rows.
+tweak the CSV formats or generate fewer/more rows:
+
+    python generator/create_csvs.py --users 1000000 --messages 10000000 \\
+        --follows 50000000 --likes 20000000
+
+It runs offline, and the same --seed always gives the same files. Samples
+are drawn with numpy a chunk at a time and written out as they go, so
+memory holds a few arrays sized by users and messages, never by follows
+or likes.
+
+The data is shaped like a real network's:
+
+- Popularity is a power law: a few users get most of the follows and
+  their messages most of the likes. Who posts and who follows a lot are
+  heavy-tailed too, independently.
+- Messages spread over the last --days days, growing busier towards the
+  end, and cluster in the evening.
+- Nobody follows themselves or likes their own messages, and there are no
+  duplicate follows or likes.
+
+likes.csv refers to messages by line number in messages.csv, which is the
+id each gets when seed.py loads them into an empty database.
 """
 
+import argparse
+import csv
 import os
-from dotenv import load_dotenv
+from contextlib import contextmanager
+from datetime import datetime
 
-import csv
-from random import choice, randint, sample
-from itertools import permutations
-import requests
-from faker import Faker
-from helpers import get_random_datetime
+import numpy as np
 
-load_dotenv()
+from helpers import (
+    CITIES, WORDS, distinct_pairs, heavy_tailed_counts, power_law_cdf,
+    sample, sentences)
 
-UNSPLASH_CID = os.environ['UNSPLASH_CID']
+CHUNK_SIZE = 100000
 
 MAX_WARBLER_LENGTH = 140
 
-USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio', 'header_image_url', 'location']
-MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
-FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+# Ends where the original sample data did, rather than at "now", so output
+# depends on nothing but the arguments
+END_DATE = datetime(2023, 11, 17)
 
-NUM_USERS = 300
-NUM_MESSAGES = 1000
-NUM_FOLLWERS = 5000
+PASSWORD = '$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe'
 
-fake = Faker()
+USERS_CSV_HEADERS = ['email', 'username', 'image_url', 'password', 'bio',
+                     'header_image_url', 'location']
+MESSAGES_CSV_HEADERS = ['text', 'timestamp', 'user_id']
+FOLLOWS_CSV_HEADERS = ['user_being_followed_id', 'user_following_id']
+LIKES_CSV_HEADERS = ['user_id', 'message_id']
 
-# Generate random profile image URLs to use for users
+# Exponents of the power laws. Popularity over 1 concentrates follows and
+# likes on a few accounts; the degree tails need over 2 for a finite mean.
+POPULARITY_EXPONENT = 1.1
+ACTIVITY_EXPONENT = 0.8
+FOLLOWING_TAIL = 2.2
+LIKES_TAIL = 2.0
 
-image_urls = [
+IMAGE_URLS = [
     f"https://randomuser.me/api/portraits/{kind}/{i}.jpg"
     for kind, count in [("lego", 10), ("men", 100), ("women", 100)]
     for i in range(count)
 ]
 
-# Generate random header image URLs to use for users
-# NOTE: You will need to create a dev account at unsplash.com, 
-# generate an access key and set that to an environment
-# variable to successfully ping the API. 
+with open(os.path.join(os.path.dirname(__file__),
+                       'header_image_urls.txt')) as urls:
+    HEADER_IMAGE_URLS = urls.read().split()
 
-header_image_urls = [
-    requests.get(
-        "https://api.unsplash.com/topics/wallpapers/photos" \
-        f"?per_page=30&orientation=landscape&client_id={UNSPLASH_CID}"
-    ).json()[i]['urls']['regular'] for i in range(0,29)
-]
 
-with open('generator/users.csv', 'w') as users_csv:
-    users_writer = csv.DictWriter(users_csv, fieldnames=USERS_CSV_HEADERS)
-    users_writer.writeheader()
-
-    for i in range(NUM_USERS):
-        users_writer.writerow(dict(
-            email=fake.email(),
-            username=fake.user_name(),
-            image_url=choice(image_urls),
-            password='$2b$12$Q1PUFjhN/AWRQ21LbGYvjeLpZZB6lfZ1BPwifHALGO6oIbyC3CmJe',
-            bio=fake.sentence(),
-            header_image_url=choice(header_image_urls),
-            location=fake.city()
+@contextmanager
+def csv_writer(directory, name, headers):
+    """A csv.writer for the file `name` in `directory`, headers written."""
+
+    with open(os.path.join(directory, name), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(headers)
+        yield writer
+
+
+def chunks(size):
+    """(start, stop) ranges covering range(size), CHUNK_SIZE at a time."""
+
+    for start in range(0, size, CHUNK_SIZE):
+        yield start, min(start + CHUNK_SIZE, size)
+
+
+def write_users(rng, writer, num_users):
+    words = np.array(WORDS)
+
+    for start, stop in chunks(num_users):
+        size = stop - start
+        first = words[rng.integers(0, len(words), size)]
+        second = words[rng.integers(0, len(words), size)]
+        usernames = [f"{a}{b}{n}" for a, b, n in zip(
+            first.tolist(), second.tolist(), range(start + 1, stop + 1))]
+
+        writer.writerows(zip(
+            [f"{username}@example.com" for username in usernames],
+            usernames,
+            rng.choice(IMAGE_URLS, size).tolist(),
+            [PASSWORD] * size,
+            sentences(rng, size, 3, 12, MAX_WARBLER_LENGTH),
+            rng.choice(HEADER_IMAGE_URLS, size).tolist(),
+            rng.choice(CITIES, size).tolist(),
         ))
 
-with open('generator/messages.csv', 'w') as messages_csv:
-    messages_writer = csv.DictWriter(messages_csv, fieldnames=MESSAGES_CSV_HEADERS)
-    messages_writer.writeheader()
 
-    for i in range(NUM_MESSAGES):
-        messages_writer.writerow(dict(
-            text=fake.paragraph()[:MAX_WARBLER_LENGTH],
-            timestamp=get_random_datetime(),
-            user_id=randint(1, NUM_USERS)
+def write_follows(rng, writer, num_users, num_follows, popularity):
+    """Each user follows a heavy-tailed number of users, popular ones first.
+
+    Drawn a chunk of followers at a time; a duplicate follow can only come
+    from the same chunk, where it is redrawn.
+    """
+
+    for start, stop in chunks(num_users):
+        counts = heavy_tailed_counts(rng, num_follows / num_users,
+                                     FOLLOWING_TAIL, stop - start,
+                                     num_users - 1)
+        followers, followed = distinct_pairs(
+            rng, counts, start, popularity,
+            lambda followers, followed: followers != followed)
+
+        writer.writerows(zip((followed + 1).tolist(),
+                             (followers + 1).tolist()))
+
+
+def write_messages(rng, writer, num_messages, days, activity):
+    """Write messages oldest first; return the author index of each."""
+
+    # Activity grows fourfold over the period
+    busy = np.linspace(1, 4, days)
+    per_day = rng.multinomial(num_messages, busy / busy.sum())
+    first_day = np.datetime64(END_DATE, 'D') - days
+    authors = np.empty(num_messages, dtype=np.int32)
+    written = 0
+
+    for day, count in enumerate(per_day.tolist()):
+        # Mostly in the evening, some at any hour
+        hours = np.where(rng.random(count) < 0.7,
+                         rng.normal(20, 3, count) % 24,
+                         rng.uniform(0, 24, count))
+        micros = np.sort((hours * 3600e6).astype(np.int64))
+        stamps = (first_day + day) + micros.astype('timedelta64[us]')
+
+        day_authors = sample(rng, activity, count)
+        authors[written:written + count] = day_authors
+        written += count
+
+        writer.writerows(zip(
+            sentences(rng, count, 3, 25, MAX_WARBLER_LENGTH),
+            np.datetime_as_string(stamps).tolist(),
+            (day_authors + 1).tolist(),
         ))
 
-# Generate follows.csv from random pairings of users
+    return authors
+
+
+def write_likes(rng, writer, num_users, num_likes, popularity, authors):
+    """Users like a heavy-tailed number of messages, by popular authors most.
+
+    Each message's appeal is its author's popularity times some luck of its
+    own. Drawn a chunk of likers at a time, as for follows.
+    """
+
+    appeal = np.diff(popularity, prepend=0)[authors]
+    appeal *= 1 + rng.pareto(LIKES_TAIL, len(authors))
+    liked = np.cumsum(appeal)
+    liked /= liked[-1]
+
+    for start, stop in chunks(num_users):
+        counts = heavy_tailed_counts(rng, num_likes / num_users, LIKES_TAIL,
+                                     stop - start, len(authors))
+        likers, messages = distinct_pairs(
+            rng, counts, start, liked,
+            lambda likers, messages: authors[messages] != likers)
+
+        writer.writerows(zip((likers + 1).tolist(),
+                             (messages + 1).tolist()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--follows", type=int, default=5000)
+    parser.add_argument("--likes", type=int, default=3000)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", default=os.path.dirname(__file__))
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    popularity = power_law_cdf(rng, args.users, POPULARITY_EXPONENT)
+    activity = power_law_cdf(rng, args.users, ACTIVITY_EXPONENT)
+
+    with csv_writer(args.out, 'users.csv', USERS_CSV_HEADERS) as writer:
+        write_users(rng, writer, args.users)
+
+    with csv_writer(args.out, 'follows.csv', FOLLOWS_CSV_HEADERS) as writer:
+        write_follows(rng, writer, args.users, args.follows, popularity)
 
-with open('generator/follows.csv', 'w') as follows_csv:
-    all_pairs = list(permutations(range(1, NUM_USERS + 1), 2))
+    with csv_writer(args.out, 'messages.csv', MESSAGES_CSV_HEADERS) as writer:
+        authors = write_messages(rng, writer, args.messages, args.days,
+                                 activity)
 
-    users_writer = csv.DictWriter(follows_csv, fieldnames=FOLLOWS_CSV_HEADERS)
-    users_writer.writeheader()
+    with csv_writer(args.out, 'likes.csv', LIKES_CSV_HEADERS) as writer:
+        write_likes(rng, writer, args.users, args.likes, popularity, authors)
 
-    for followed_user, follower in sample(all_pairs, NUM_FOLLWERS):
-        users_writer.writerow(dict(user_being_followed_id=followed_user, user_following_id=follower))
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,137 @@
-"""Support functions for CSV generation."""
+"""Support functions for CSV generation.
 
-from datetime import datetime
-from random import uniform
+Everything samples from a numpy Generator passed in by the caller, so the
+same seed always produces the same files.
+"""
 
+import numpy as np
 
-def get_random_datetime(year_gap=2):
-    """Get a random datetime within the last few years."""
+WORDS = """
+    able about above across act after again against air all almost along
+    also always among animal answer any area around art ask away back bad
+    ball bank base bear beat beautiful because become bed before begin
+    behind believe best better between big bird black blood blue board boat
+    body book both box boy bring brother build burn business buy call came
+    can car care carry case cat catch cause cell center chair chance change
+    child city class clear close cold color come common contain control cook
+    cool corner could country course cover cross crowd cry current cut dance
+    dark day dead deal dear death decide deep desert design develop die
+    different dinner direct do doctor dog door down draw dream dress drink
+    drive drop dry during each early earth east eat edge effect egg eight
+    either else end energy enjoy enough enter even evening event ever every
+    exactly example eye face fact fair fall family far farm fast father fear
+    feel few field fight figure fill film final find fine fire first fish
+    five floor flower fly follow food foot force forest forget form forward
+    four free fresh friend front fruit full fun game garden gas gather give
+    glass go gold good government great green ground group grow guess hair
+    half hand happen happy hard hat have head hear heart heat heavy help
+    here high hill history hold home hope horse hot hour house huge human
+    hundred hunt idea imagine inside island job join joy jump just keep key
+    kid kind king kitchen know lake land language large last late laugh law
+    lay lead learn leave left leg less letter level lie life light like line
+    list listen little live long look lose loud love low machine main make
+    man many map mark market matter mean meet memory middle might mile milk
+    mind minute miss moment money month moon morning mother mountain mouth
+    move music name nation nature near need never new news next night noise
+    north note nothing notice now number ocean offer office often old once
+    open order other outside over own page paint paper park part party pass
+    past pay people perhaps person pick picture piece place plan plant play
+    please poem point poor power present pretty probably problem produce
+    pull push question quick quiet race radio rain reach read ready real
+    reason record red remember rest rich ride right river road rock room
+    rope round rule run safe sail salt same sand save say school science sea
+    season seat second see seed sell send sense serve set seven shape share
+    sharp ship shoe shop short shoulder show side sign silver simple sing
+    sister sit six size skin sky sleep slow small smell smile snow soft soil
+    soldier song sound south space speak special speed spend spring square
+    stand star start state station stay step stick still stone stop store
+    story street strong student study subject sudden summer sun sure surface
+    sweet swim table tail take talk tall teach team tell ten test thank
+    thick thin thing think third though thousand three through tie time
+    tiny today together tomorrow tonight tool top touch toward town track
+    trade train travel tree trip trouble true try turn twenty two under
+    until up use usual valley very village visit voice wait walk wall want
+    war warm wash watch water wave way wear weather week weight well west
+    wheel while white whole why wide wild wind window winter wish woman
+    wonder wood word work world write yard year yellow yes yet young
+""".split()
 
-    now = datetime.now()
-    then = now.replace(year=now.year - year_gap)
-    random_timestamp = uniform(then.timestamp(), now.timestamp())
+CITIES = [
+    "Ashford", "Bayview", "Brookside", "Cedar Falls", "Clearwater",
+    "Eastport", "Fairview", "Glenwood", "Greenville", "Harbor City",
+    "Highland", "Lakeside", "Maplewood", "Midvale", "Millbrook", "New Hope",
+    "Northfield", "Oakridge", "Pinecrest", "Riverside", "Rockport", "Salem",
+    "Springfield", "Stonebridge", "Summit", "Sunnyvale", "Westbrook",
+    "Willowdale",
+]
 
-    return datetime.fromtimestamp(random_timestamp)
+
+def power_law_cdf(rng, size, exponent):
+    """Cumulative weights of `size` items with power-law popularity.
+
+    The item at rank r has weight r ** -exponent; ranks are a random
+    permutation, so popularity isn't tied to the item's position. Sample
+    with `sample()`.
+    """
+
+    weights = np.arange(1, size + 1, dtype=np.float64) ** -exponent
+    weights = weights[rng.permutation(size)]
+    cdf = np.cumsum(weights)
+    return cdf / cdf[-1]
+
+
+def sample(rng, cdf, size):
+    """`size` indexes drawn from the distribution with cumulative `cdf`."""
+
+    picks = np.searchsorted(cdf, rng.random(size), side='right')
+    return np.minimum(picks, len(cdf) - 1)
+
+
+def heavy_tailed_counts(rng, mean, exponent, size, maximum):
+    """`size` Pareto-distributed counts averaging about `mean`."""
+
+    scale = mean * (exponent - 1) / exponent
+    counts = np.rint(scale * (1 + rng.pareto(exponent, size)))
+    return np.minimum(counts, maximum).astype(np.int64)
+
+
+def sentences(rng, size, min_words, max_words, max_length):
+    """`size` random sentences of capitalized, space-separated words."""
+
+    words = np.array(WORDS)
+    lengths = rng.integers(min_words, max_words + 1, size)
+    picks = words[rng.integers(0, len(words), (size, max_words))]
+
+    return [" ".join(row[:length]).capitalize()[:max_length - 1] + "."
+            for row, length in zip(picks.tolist(), lengths.tolist())]
+
+
+def distinct_pairs(rng, counts, start, cdf, allowed, rounds=8):
+    """Pair owners start, start + 1, ... with `counts` distinct picks each.
+
+    Picks are drawn from `cdf`; `allowed(owners, picks)` masks out pairs
+    that mustn't exist. Duplicates and disallowed pairs are redrawn, up to
+    `rounds` times, so an owner may end up a few short. Returns
+    (owners, picks), sorted.
+    """
+
+    size = len(cdf)
+    owners = np.arange(start, start + len(counts))
+    keys = np.empty(0, dtype=np.int64)
+    missing = counts
+
+    for _ in range(rounds):
+        drawn = np.repeat(owners, missing)
+        if not len(drawn):
+            break
+        picks = sample(rng, cdf, len(drawn))
+        keep = allowed(drawn, picks)
+        keys = np.sort(np.concatenate([keys,
+                                       drawn[keep] * size + picks[keep]]))
+        # np.unique, without the hash table it builds in numpy 2, which is
+        # several times slower than sorting here
+        keys = keys[np.concatenate([[True], keys[1:] != keys[:-1]])]
+        have = np.bincount(keys // size - start, minlength=len(counts))
+        missing = counts - have
+
+    return np.divmod(keys, size)
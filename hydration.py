@@ -0,0 +1,105 @@
+"""Batch-load the state templates need to render a page of messages or users.
+
+Rendering a message used to evaluate `msg in g.user.liked_messages`, loading
+the viewer's whole Like collection, and rendering a user card walked the
+viewer's whole `following` collection. These helpers answer the same
+questions for a whole page in a fixed number of queries, whatever its
+length. (Like counts are read from the denormalized `Message.like_count`.)
+"""
+
+from sqlalchemy import select
+from sqlalchemy.orm.attributes import set_committed_value
+
+from models import db, Follow, Like, User
+
+
+class LikeState:
+    """The viewer's likes among one page of messages."""
+
+    def __init__(self, liked_ids):
+        self.liked_ids = liked_ids
+
+    def liked(self, message):
+        """Has the viewer liked `message`?"""
+
+        return message.id in self.liked_ids
+
+
+def load_like_state(messages, viewer):
+    """Return the LikeState for `messages` as seen by `viewer`.
+
+    At most one query, whatever the number of messages.
+    """
+
+    ids = [msg.id for msg in messages]
+
+    if not ids or not viewer:
+        return LikeState(set())
+
+    liked_ids = set(db.session.scalars(
+        select(Like.message_id)
+        .where(Like.user_id == viewer.id, Like.message_id.in_(ids))
+    ))
+
+    return LikeState(liked_ids)
+
+
+class FollowState:
+    """Which of one page of users the viewer follows."""
+
+    def __init__(self, followed_ids):
+        self.followed_ids = followed_ids
+
+    def follows(self, user):
+        """Does the viewer follow `user`?"""
+
+        return user.id in self.followed_ids
+
+
+def load_follow_state(users, viewer):
+    """Return the FollowState for `users` as seen by `viewer`.
+
+    At most one query, on the follows primary key. This is never answered
+    from the in-memory follow graph (see followgraph.py): that can lag
+    behind follows made through other workers, and a viewer who has just
+    followed someone must see an Unfollow button on the next page.
+    """
+
+    if not viewer:
+        return FollowState(set())
+
+    # Nobody follows themselves, so that needn't be looked up
+    ids = [user.id for user in users if user.id != viewer.id]
+
+    if not ids:
+        return FollowState(set())
+
+    followed_ids = set(db.session.scalars(
+        select(Follow.user_being_followed_id)
+        .where(Follow.user_following_id == viewer.id,
+               Follow.user_being_followed_id.in_(ids))
+    ))
+
+    return FollowState(followed_ids)
+
+
+def load_authors(messages):
+    """Load the authors of `messages` with one query.
+
+    Each author is set as the loaded value of `msg.user`, so rendering the
+    page doesn't lazy-load them one message at a time. Returns the authors,
+    in id order.
+    """
+
+    author_ids = {msg.user_id for msg in messages}
+
+    if not author_ids:
+        return []
+
+    authors = {user.id: user
+               for user in User.query.filter(User.id.in_(author_ids))}
+
+    for msg in messages:
+        set_committed_value(msg, 'user', authors[msg.user_id])
+
+    return [authors[author_id] for author_id in sorted(authors)]
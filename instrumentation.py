@@ -0,0 +1,184 @@
+"""Per-request timings, sent as a Server-Timing header and a log line.
+
+A sampled request (TIMING_SAMPLE_RATE of them, chosen at random) counts
+its SQL statements and adds up time spent in the database, rendering
+templates and hashing passwords. The response then carries e.g.
+
+    Server-Timing: db;dur=4.1;desc="3 queries", render;dur=6.3,
+        hash;dur=0.0, total;dur=12.9
+
+and the `warbler.timing` logger gets one JSON line with the same numbers
+plus the endpoint and status. Requests that aren't sampled cost a context
+lookup per statement and nothing else.
+
+`count_queries` collects the statements run inside a block, for tests that
+hold routes to a query budget.
+"""
+
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+
+from flask import (
+    before_render_template, g, has_app_context, request, template_rendered)
+from sqlalchemy import event
+
+TIMING_SAMPLE_RATE = 0.1
+
+logger = logging.getLogger('warbler.timing')
+
+
+class RequestTiming:
+    """Running totals for one request, in seconds."""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.render = 0.0
+        self.hash = 0.0
+        self._render_starts = []
+
+    def metrics(self):
+        """(name, milliseconds, description) for the Server-Timing header."""
+
+        total = time.perf_counter() - self.start
+        return [
+            ("db", self.db * 1000, f"{self.queries} queries"),
+            ("render", self.render * 1000, None),
+            ("hash", self.hash * 1000, None),
+            ("total", total * 1000, None),
+        ]
+
+
+def current_timing():
+    """The current request's RequestTiming, or None if it isn't sampled."""
+
+    if not has_app_context():
+        return None
+    return g.get('timing')
+
+
+@contextmanager
+def timed(name):
+    """Add the time spent in the block to the current request's `name`."""
+
+    timing = current_timing()
+    if timing is None:
+        yield
+        return
+
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        setattr(timing, name,
+                getattr(timing, name) + time.perf_counter() - start)
+
+
+@contextmanager
+def count_queries(engine):
+    """Collect the SQL statements `engine` runs inside the block.
+
+    Yields a list, which statements are appended to as they run.
+    """
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', record)
+
+
+def server_timing(metrics):
+    """The Server-Timing header value for `metrics`."""
+
+    entries = []
+
+    for name, duration, description in metrics:
+        entry = f"{name};dur={duration:.1f}"
+        if description:
+            entry += f';desc="{description}"'
+        entries.append(entry)
+
+    return ", ".join(entries)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context,
+                           executemany):
+    if current_timing() is not None:
+        context._timing_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    timing = current_timing()
+    start = getattr(context, '_timing_start', None)
+    if timing is None or start is None:
+        return
+
+    timing.queries += 1
+    timing.db += time.perf_counter() - start
+
+
+def _before_render(app, template, context, **extra):
+    timing = current_timing()
+    if timing is not None:
+        timing._render_starts.append(time.perf_counter())
+
+
+def _rendered(app, template, context, **extra):
+    timing = current_timing()
+    if timing is not None and timing._render_starts:
+        timing.render += time.perf_counter() - timing._render_starts.pop()
+
+
+def init_instrumentation(app, engine):
+    """Time a TIMING_SAMPLE_RATE sample of `app`'s requests.
+
+    `engine` is the engine whose statements to count.
+    """
+
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+    before_render_template.connect(_before_render, app)
+    template_rendered.connect(_rendered, app)
+
+    @app.before_request
+    def start_timing():
+        # The app context, and so `g`, can outlive a request (see
+        # lazy_globals.py), so clear the last request's timing
+        g.pop('timing', None)
+
+        rate = app.config.get('TIMING_SAMPLE_RATE', TIMING_SAMPLE_RATE)
+        if random.random() < rate:
+            g.timing = RequestTiming()
+
+    @app.after_request
+    def report_timing(response):
+        timing = g.pop('timing', None)
+        if timing is None:
+            return response
+
+        metrics = timing.metrics()
+        response.headers['Server-Timing'] = server_timing(metrics)
+
+        line = {
+            "method": request.method,
+            "path": request.path,
+            "endpoint": request.endpoint,
+            "status": response.status_code,
+            "queries": timing.queries,
+        }
+        for name, duration, description in metrics:
+            line[f"{name}_ms"] = round(duration, 1)
+        logger.info(json.dumps(line))
+
+        return response
@@ -0,0 +1,119 @@
+"""Request globals that are only computed when something reads them.
+
+`g.user` costs a session read and maybe a query, and `g.csrf_form` builds a
+form and a CSRF token. Registering them with `@lazy_global` instead of in a
+before_request hook means redirects, 404s and pages that don't use them
+skip that work. Endpoints in LIGHTWEIGHT_ENDPOINTS never compute them: lazy
+globals read as None there.
+
+`lazy_stats` counts, per endpoint, requests served and how many of them
+computed each lazy global, so the work saved can be read off per route.
+"""
+
+from collections import Counter, defaultdict
+from threading import Lock
+
+from flask import g, has_request_context, request
+from flask.ctx import _AppCtxGlobals
+
+LIGHTWEIGHT_ENDPOINTS = {
+    'static',
+    'asset',
+    '_debug_toolbar.static',
+}
+
+
+class LazyGlobalStats:
+    """Per-endpoint counts of requests and lazy globals computed."""
+
+    def __init__(self):
+        self.requests = Counter()
+        self.loads = defaultdict(Counter)
+        self._lock = Lock()
+
+    def record_request(self, endpoint):
+        with self._lock:
+            self.requests[endpoint] += 1
+
+    def record_load(self, endpoint, name):
+        with self._lock:
+            self.loads[endpoint][name] += 1
+
+    def clear(self):
+        with self._lock:
+            self.requests.clear()
+            self.loads.clear()
+
+    def saved(self):
+        """Return {endpoint: {name: requests that skipped computing it}}."""
+
+        with self._lock:
+            return {
+                endpoint: {name: count - self.loads[endpoint][name]
+                           for name in LazyGlobals.loaders}
+                for endpoint, count in self.requests.items()
+            }
+
+
+lazy_stats = LazyGlobalStats()
+
+
+class LazyGlobals(_AppCtxGlobals):
+    """`g`, with attributes registered by `lazy_global` computed on first
+    read in each request.
+
+    Install as `app.app_ctx_globals_class` before any app context is pushed.
+    """
+
+    loaders = {}
+
+    def __getattr__(self, name):
+        loader = self.loaders.get(name)
+
+        if loader is None or not has_request_context():
+            return super().__getattr__(name)
+
+        if request.endpoint in LIGHTWEIGHT_ENDPOINTS:
+            value = None
+        else:
+            lazy_stats.record_load(request.endpoint, name)
+            value = loader()
+
+        setattr(self, name, value)
+        return value
+
+    def reset(self):
+        """Forget everything set on `g`, so lazy globals are recomputed.
+
+        That includes what extensions cache on `g`: Flask-WTF keeps the
+        request's CSRF token there, which would otherwise be handed to the
+        next request, whatever its session.
+        """
+
+        self.__dict__.clear()
+
+
+def lazy_global(name):
+    """Register the decorated function to compute `g.<name>` on demand."""
+
+    def register(loader):
+        LazyGlobals.loaders[name] = loader
+        return loader
+
+    return register
+
+
+def init_lazy_globals(app):
+    """Use LazyGlobals as `app`'s `g`, reset at the start of every request.
+
+    The reset matters because an app context (and its `g`) can outlive a
+    request: requests reuse an already-pushed context for the same app. It
+    must run before any other before_request hook that sets `g`.
+    """
+
+    app.app_ctx_globals_class = LazyGlobals
+
+    @app.before_request
+    def reset_lazy_globals():
+        g.reset()
+        lazy_stats.record_request(request.endpoint)
@@ -0,0 +1,119 @@
+"""Paginated lists for the following, followers and likes pages.
+
+Each page selects only the columns its template renders, as Rows rather
+than ORM objects, and seeks to its keyset cursor through an index that
+matches its order, so a user with 100k followers costs the same per page
+as one with ten:
+
+- following: ix_follows_following (user_following_id, followed id)
+- followers: the follows primary key (followed id, user_following_id)
+- likes: the likes primary key (user_id, message_id), newest message first
+
+The user card queries are also available unpaginated (`following_cards()`
+and friends), for streamed pages to read through a server-side cursor;
+`all_user_cards()` reads the users primary key. See streaming.py.
+"""
+
+from sqlalchemy import select
+
+from models import db, Follow, Like, Message, User
+from pagination import after, before, paginate
+
+LISTING_PAGE_SIZE = 60
+
+USER_CARD_COLUMNS = (
+    User.id,
+    User.username,
+    User.image_url,
+    User.header_image_url,
+    User.bio,
+)
+
+
+def _user_cards(owner_column, other_column, user_id, cursor):
+    cards = (
+        select(*USER_CARD_COLUMNS)
+        .join(Follow, other_column == User.id)
+        .where(owner_column == user_id)
+        .order_by(other_column)
+    )
+
+    if cursor:
+        cards = cards.where(after((other_column,), cursor))
+
+    return cards
+
+
+def _page(cards, limit):
+    return paginate(db.session.execute(cards.limit(limit + 1)).all(), limit,
+                    key=lambda card: (card.id,))
+
+
+def following_cards(user_id, cursor=None):
+    """Select the cards of who `user_id` follows, after `cursor`."""
+
+    return _user_cards(Follow.user_following_id,
+                       Follow.user_being_followed_id,
+                       user_id, cursor)
+
+
+def followers_cards(user_id, cursor=None):
+    """Select the cards of who follows `user_id`, after `cursor`."""
+
+    return _user_cards(Follow.user_being_followed_id,
+                       Follow.user_following_id,
+                       user_id, cursor)
+
+
+def all_user_cards(cursor=None):
+    """Select the cards of every user, by id, after `cursor`."""
+
+    cards = select(*USER_CARD_COLUMNS).order_by(User.id)
+
+    if cursor:
+        cards = cards.where(after((User.id,), cursor))
+
+    return cards
+
+
+def following_page(user_id, cursor=None, limit=LISTING_PAGE_SIZE):
+    """Return (cards, next_cursor) for a page of who `user_id` follows."""
+
+    return _page(following_cards(user_id, cursor), limit)
+
+
+def followers_page(user_id, cursor=None, limit=LISTING_PAGE_SIZE):
+    """Return (cards, next_cursor) for a page of who follows `user_id`."""
+
+    return _page(followers_cards(user_id, cursor), limit)
+
+
+def likes_page(user_id, cursor=None, limit=LISTING_PAGE_SIZE):
+    """Return (messages, next_cursor) for a page of what `user_id` liked.
+
+    Each row has the message's columns plus its author's username and
+    image_url as `author_username` and `author_image_url`.
+    """
+
+    messages = (
+        select(
+            Message.id,
+            Message.text,
+            Message.timestamp,
+            Message.user_id,
+            Message.like_count,
+            User.username.label('author_username'),
+            User.image_url.label('author_image_url'),
+        )
+        .join(Like, Like.message_id == Message.id)
+        .join(User, User.id == Message.user_id)
+        .where(Like.user_id == user_id)
+        .order_by(Like.message_id.desc())
+        .limit(limit + 1)
+    )
+
+    if cursor:
+        messages = messages.where(before((Like.message_id,), cursor))
+
+    return paginate(db.session.execute(messages).all(), limit,
+                    key=lambda message: (message.id,))
@@ -0,0 +1,185 @@
+"""Schema migrations for databases created before the current models.
+
+`db.create_all()` only creates tables that are missing; it never adds a
+column or an index to a table that already exists, so a database loaded
+under an older models.py falls behind. Each migration here is one step
+towards the current schema, and `flask migrate` applies the ones a database
+hasn't had yet, recording each in schema_migrations. Nothing is dropped.
+
+Indexes on the big tables are built with CREATE INDEX CONCURRENTLY, which
+lets reads and writes carry on while it runs. Postgres won't run that inside
+a transaction, so those migrations get an autocommit connection of their
+own. An interrupted build leaves an INVALID index behind; the next run drops
+it and builds it again.
+
+Every step is idempotent, so migrating a database made by `create_all()`
+is harmless; `stamp_migrations()` skips the work by marking every step as
+applied (seed.py does this).
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import select, text
+from sqlalchemy.schema import CreateIndex
+
+from counters import reconcile_counters
+from models import (
+    db, Follow, Like, Message, Recommendation, SchemaMigration,
+    StaleRecommendation, TimelineEntry, User, UsernameTrigram)
+from recommendations import rebuild_recommendations
+from search import rebuild_search_index
+from timelines import rebuild_timelines
+
+Migration = namedtuple('Migration', 'version run concurrent')
+
+MIGRATIONS = []
+
+
+def migration(version, concurrent=False):
+    """Register the decorated function as the migration `version`.
+
+    Migrations run in the order they are registered. A regular migration is
+    called with the session's connection and commits with its
+    schema_migrations row; a `concurrent` one is called with an autocommit
+    connection, for statements that can't run in a transaction.
+    """
+
+    def register(run):
+        MIGRATIONS.append(Migration(version, run, concurrent))
+        return run
+
+    return register
+
+
+def _index(model, name):
+    return next(index for index in model.__table__.indexes
+                if index.name == name)
+
+
+def create_index_concurrently(conn, index):
+    """Build `index` (from the models) without blocking writes to its table.
+
+    `conn` must be in autocommit mode.
+    """
+
+    invalid = conn.scalar(text("""
+        SELECT NOT indisvalid
+        FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+        WHERE pg_class.relname = :name
+    """), {'name': index.name})
+
+    if invalid:
+        conn.exec_driver_sql(f'DROP INDEX CONCURRENTLY "{index.name}"')
+
+    ddl = str(CreateIndex(index, if_not_exists=True).compile(
+        dialect=conn.dialect))
+    conn.exec_driver_sql(
+        ddl.replace('CREATE INDEX', 'CREATE INDEX CONCURRENTLY', 1))
+
+
+@migration('0001_counter_columns')
+def add_counter_columns(conn):
+    # With a constant default Postgres adds these without rewriting the
+    # table; the backfill migration fills in the real counts.
+    conn.execute(text("""
+        ALTER TABLE users
+            ADD COLUMN IF NOT EXISTS merge_on_read boolean
+                NOT NULL DEFAULT false,
+            ADD COLUMN IF NOT EXISTS messages_count integer
+                NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS followers_count integer
+                NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS following_count integer
+                NOT NULL DEFAULT 0,
+            ADD COLUMN IF NOT EXISTS likes_count integer
+                NOT NULL DEFAULT 0
+    """))
+    conn.execute(text("""
+        ALTER TABLE messages
+            ADD COLUMN IF NOT EXISTS like_count integer NOT NULL DEFAULT 0
+    """))
+
+
+@migration('0002_derived_tables')
+def add_derived_tables(conn):
+    # New and empty, so their own indexes can be built in the transaction
+    db.metadata.create_all(conn, tables=[
+        UsernameTrigram.__table__,
+        Recommendation.__table__,
+        StaleRecommendation.__table__,
+        TimelineEntry.__table__,
+    ])
+
+
+@migration('0003_ix_messages_user_timestamp', concurrent=True)
+def index_messages_by_user(conn):
+    create_index_concurrently(
+        conn, _index(Message, 'ix_messages_user_timestamp'))
+
+
+@migration('0004_ix_follows_following', concurrent=True)
+def index_follows_by_follower(conn):
+    create_index_concurrently(conn, _index(Follow, 'ix_follows_following'))
+
+
+@migration('0005_ix_likes_message', concurrent=True)
+def index_likes_by_message(conn):
+    create_index_concurrently(conn, _index(Like, 'ix_likes_message'))
+
+
+@migration('0006_ix_users_username_search', concurrent=True)
+def index_usernames(conn):
+    create_index_concurrently(conn, _index(User, 'ix_users_username_search'))
+
+
+@migration('0007_backfill_derived_data')
+def backfill_derived_data(conn):
+    # The same rebuilds seed.py runs after a bulk load. Each works through
+    # id ranges and commits after every one, so none holds its locks, or
+    # its share of the WAL, for the whole backfill.
+    rebuild_timelines()
+    rebuild_search_index()
+    reconcile_counters()
+    rebuild_recommendations()
+
+
+def applied_migrations():
+    """The versions already applied to this database, as a set."""
+
+    SchemaMigration.__table__.create(db.session.connection(), checkfirst=True)
+    return set(db.session.scalars(select(SchemaMigration.version)))
+
+
+def migrate():
+    """Apply every pending migration, in order; return their versions."""
+
+    done = applied_migrations()
+    db.session.commit()
+    applied = []
+
+    for step in MIGRATIONS:
+        if step.version in done:
+            continue
+
+        if step.concurrent:
+            # The session must not hold a transaction open meanwhile: a
+            # concurrent index build waits for every older transaction.
+            with db.engine.connect() as conn:
+                step.run(conn.execution_options(isolation_level='AUTOCOMMIT'))
+        else:
+            step.run(db.session.connection())
+
+        db.session.add(SchemaMigration(version=step.version))
+        db.session.commit()
+        applied.append(step.version)
+
+    return applied
+
+
+def stamp_migrations():
+    """Mark every migration as applied, for a database made by create_all()."""
+
+    done = applied_migrations()
+    db.session.add_all([SchemaMigration(version=step.version)
+                        for step in MIGRATIONS if step.version not in done])
+    db.session.commit()
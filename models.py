@@ -1,13 +1,20 @@
 """SQLAlchemy models for Warbler."""
 
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
+import bcrypt
 from flask_sqlalchemy import SQLAlchemy
 
-bcrypt = Bcrypt()
+from instrumentation import timed
+
 db = SQLAlchemy()
 
+BCRYPT_LOG_ROUNDS = 12
+HASHER_THREADS = 4
+
 DEFAULT_IMAGE_URL = (
     "https://icon-library.com/images/default-user-icon/" +
     "default-user-icon-28.jpg")
@@ -18,6 +25,82 @@ DEFAULT_HEADER_IMAGE_URL = (
     "mat&fit=crop&w=2070&q=80")
 
 
+class PasswordHasher(ABC):
+    """Hashes and checks passwords on a bounded pool of worker threads.
+
+    Subclasses implement `_hash`, `_verify` and `needs_rehash` for one
+    algorithm. Hashing is slow on purpose; the pool caps how many hashes run
+    at once, so a burst of logins queues there instead of tying up every
+    request thread's CPU.
+    """
+
+    def __init__(self, max_workers=HASHER_THREADS):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers,
+                                        thread_name_prefix='hasher')
+
+    def hash(self, password):
+        """Return the hash (a str) to store for `password`."""
+
+        with timed('hash'):
+            return self._pool.submit(self._hash, password).result()
+
+    def verify(self, hashed, password):
+        """Does `password` match the stored `hashed`?"""
+
+        with timed('hash'):
+            return self._pool.submit(self._verify, hashed, password).result()
+
+    @abstractmethod
+    def needs_rehash(self, hashed):
+        """Was `hashed` made under a different policy than the current one?"""
+
+    @abstractmethod
+    def _hash(self, password):
+        """Hash `password` (a str); return the hash as a str."""
+
+    @abstractmethod
+    def _verify(self, hashed, password):
+        """Does `password` match `hashed`?"""
+
+
+class BcryptHasher(PasswordHasher):
+    """bcrypt with a configurable work factor (log2 of the rounds)."""
+
+    def __init__(self, rounds=BCRYPT_LOG_ROUNDS, max_workers=HASHER_THREADS):
+        super().__init__(max_workers)
+        self.rounds = rounds
+
+    def needs_rehash(self, hashed):
+        # bcrypt hashes look like $2b$<rounds>$<salt and digest>
+        return int(hashed.split('$')[2]) != self.rounds
+
+    def calibrate(self, target_seconds, max_rounds=20):
+        """Return the most rounds whose hash takes at most `target_seconds`.
+
+        Never returns less than bcrypt's minimum of 4.
+        """
+
+        rounds = 4
+        while rounds < max_rounds:
+            start = time.perf_counter()
+            bcrypt.hashpw(b"calibration", bcrypt.gensalt(rounds + 1))
+            if time.perf_counter() - start > target_seconds:
+                break
+            rounds += 1
+        return rounds
+
+    def _hash(self, password):
+        return bcrypt.hashpw(
+            password.encode('UTF-8'), bcrypt.gensalt(self.rounds)
+        ).decode('UTF-8')
+
+    def _verify(self, hashed, password):
+        return bcrypt.checkpw(password.encode('UTF-8'), hashed.encode('UTF-8'))
+
+
+hasher = BcryptHasher()
+
+
 class Follow(db.Model):
     """Connection of a follower <-> followed_user."""
 
@@ -35,6 +118,13 @@ class Follow(db.Model):
         primary_key=True,
     )
 
+    __table_args__ = (
+        # The primary key leads with the followed user; this serves lookups
+        # of who a user follows (home feed, recommendations).
+        db.Index('ix_follows_following',
+                 'user_following_id', 'user_being_followed_id'),
+    )
+
 
 class User(db.Model):
     """User in the system."""
@@ -87,6 +177,40 @@ class User(db.Model):
         nullable=False,
     )
 
+    # Set once an account has too many followers to fan out to; its messages
+    # are merged into followers' home timelines at read time instead.
+    merge_on_read = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+    )
+
+    # Denormalized counts, kept current by the routes that change them and
+    # recomputed by `flask reconcile-counters` (see counters.py).
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
     messages = db.relationship('Message', backref="user")
 
     followers = db.relationship(
@@ -100,6 +224,12 @@ class User(db.Model):
     liked_messages = db.relationship('Message', secondary='likes',
                                      backref='users_who_liked', collection_class=set)
 
+    __table_args__ = (
+        # Serves prefix search and its ordering (see search.py)
+        db.Index('ix_users_username_search',
+                 db.func.lower(username).collate('C'), id),
+    )
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
@@ -110,7 +240,7 @@ class User(db.Model):
         Hashes password and adds user to session.
         """
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -132,13 +262,18 @@ class User(db.Model):
 
         If this can't find matching user (or if password is wrong), returns
         False.
+
+        If the stored hash was made under an older hashing policy, it is
+        replaced with a new one (the caller commits).
         """
 
         user = cls.query.filter_by(username=username).one_or_none()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.verify(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
@@ -146,16 +281,20 @@ class User(db.Model):
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [
-            user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.is_following(self)
 
     def is_following(self, other_user):
-        """Is this user following `other_use`?"""
+        """Is this user following `other_use`?
 
-        found_user_list = [
-            user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        A single primary-key lookup on follows; doesn't load `following`.
+        """
+
+        return db.session.query(
+            Follow.query.filter_by(
+                user_being_followed_id=other_user.id,
+                user_following_id=self.id,
+            ).exists()
+        ).scalar()
 
 
 class Message(db.Model):
@@ -185,6 +324,17 @@ class Message(db.Model):
         nullable=False,
     )
 
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+    )
+
+    __table_args__ = (
+        db.Index('ix_messages_user_timestamp',
+                 'user_id', timestamp.desc(), id.desc()),
+    )
+
 
 class Like(db.Model):
     """Model for liked messages relation."""
@@ -203,6 +353,178 @@ class Like(db.Model):
         primary_key=True
     )
 
+    __table_args__ = (
+        # The primary key leads with the user; this serves lookups of who
+        # liked a message (deleting messages, releasing their like counts).
+        db.Index('ix_likes_message', 'message_id', 'user_id'),
+    )
+
+
+class UsernameTrigram(db.Model):
+    """One three-character substring of a (lowercased) username.
+
+    An inverted index for username search, maintained by search.py.
+    """
+
+    __tablename__ = 'username_trigrams'
+
+    trigram = db.Column(
+        db.String(3),
+        primary_key=True,
+    )
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+        index=True,
+    )
+
+
+class Recommendation(db.Model):
+    """An account suggested to a user under "Who to follow".
+
+    `score` is how many of the accounts the user follows already follow
+    the candidate. Rows are precomputed by recommendations.py.
+    """
+
+    __tablename__ = 'recommendations'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    candidate_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    score = db.Column(
+        db.Integer,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_recommendations_user_score',
+                 'user_id', score.desc(), 'candidate_id'),
+    )
+
+
+class StaleRecommendation(db.Model):
+    """A user whose recommendations need recomputing (their follows changed)."""
+
+    __tablename__ = 'stale_recommendations'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into a user's home timeline.
+
+    Rows are written by fan-out when a message is posted (see timelines.py);
+    `author_id` and `timestamp` are copied from the message so a timeline can
+    be read, ordered and pruned without touching the messages table.
+    """
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.Integer,
+        db.ForeignKey('messages.id', ondelete='CASCADE'),
+        primary_key=True,
+    )
+
+    author_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='CASCADE'),
+        nullable=False,
+    )
+
+    timestamp = db.Column(
+        db.DateTime,
+        nullable=False,
+    )
+
+    __table_args__ = (
+        db.Index('ix_timeline_entries_user_timestamp',
+                 'user_id', timestamp.desc(), message_id.desc()),
+        db.Index('ix_timeline_entries_user_author', 'user_id', 'author_id'),
+    )
+
+
+class SchemaMigration(db.Model):
+    """A migration from migrations.py that has been applied to this database."""
+
+    __tablename__ = 'schema_migrations'
+
+    version = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    applied_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        default=datetime.utcnow,
+    )
+
+
+class LoadCheckpoint(db.Model):
+    """How far a bulk load (see bulkload.py) has got through one CSV file.
+
+    `position` is the byte offset just past the last committed row.
+    """
+
+    __tablename__ = 'load_checkpoints'
+
+    path = db.Column(
+        db.Text,
+        primary_key=True,
+    )
+
+    position = db.Column(
+        db.BigInteger,
+        nullable=False,
+    )
+
+    rows = db.Column(
+        db.BigInteger,
+        nullable=False,
+        default=0,
+    )
+
+
+class DeferredDDL(db.Model):
+    """A statement that restores an index or constraint after a bulk load.
+
+    Run in `id` order, then deleted (see bulkload.py).
+    """
+
+    __tablename__ = 'deferred_ddl'
+
+    id = db.Column(
+        db.Integer,
+        primary_key=True,
+    )
+
+    statement = db.Column(
+        db.Text,
+        nullable=False,
+    )
+
 
 def connect_db(app):
     """Connect this database to provided Flask app.
@@ -210,6 +532,8 @@ def connect_db(app):
     You should call this in your Flask app.
     """
 
+    hasher.rounds = app.config.get('BCRYPT_LOG_ROUNDS', hasher.rounds)
+
     app.app_context().push()
     db.app = app
     db.init_app(app)
@@ -0,0 +1,95 @@
+"""Keyset (cursor) pagination helpers.
+
+A cursor is the sort key of the last row on a page, e.g. (timestamp, id).
+The next page is fetched with a row-value comparison against it, which an
+index in the same order can seek to directly, so page N costs the same as
+page 1 (unlike OFFSET, which has to walk every skipped row).
+"""
+
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime
+
+from flask import abort, request
+from sqlalchemy import tuple_
+
+
+def encode_cursor(*key):
+    """Encode a sort key (datetimes, ints, strings) as an opaque cursor.
+
+    The parts are kept apart as a JSON list, so a string part may contain
+    any character.
+    """
+
+    parts = [
+        part.isoformat() if isinstance(part, datetime) else str(part)
+        for part in key
+    ]
+    raw = json.dumps(parts, separators=(',', ':')).encode('UTF-8')
+    return urlsafe_b64encode(raw).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor, *types):
+    """Decode a cursor back into a sort key, converting each part by `types`.
+
+    Raises ValueError if the cursor is malformed.
+    """
+
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        parts = json.loads(urlsafe_b64decode(padded).decode('UTF-8'))
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from exc
+
+    if (not isinstance(parts, list) or len(parts) != len(types) or
+            not all(isinstance(part, str) for part in parts)):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+    return tuple(
+        datetime.fromisoformat(part) if kind is datetime else kind(part)
+        for kind, part in zip(types, parts)
+    )
+
+
+def cursor_arg(name, *types, decode=decode_cursor):
+    """Read and decode cursor query param `name`; 400 if it is malformed.
+
+    `decode` is called with the cursor and `types`, and raises ValueError
+    for a malformed one.
+    """
+
+    cursor = request.args.get(name)
+
+    if not cursor:
+        return None
+
+    try:
+        return decode(cursor, *types)
+    except ValueError:
+        abort(400)
+
+
+def before(columns, cursor):
+    """Filter for rows that sort after `cursor` in descending order."""
+
+    return tuple_(*columns) < tuple_(*cursor)
+
+
+def after(columns, cursor):
+    """Filter for rows that sort after `cursor` in ascending order."""
+
+    return tuple_(*columns) > tuple_(*cursor)
+
+
+def paginate(rows, limit, key):
+    """Split `limit + 1` fetched rows into (page, next_cursor).
+
+    `key` maps a row to its sort key; next_cursor is None on the last page.
+    """
+
+    page = rows[:limit]
+
+    if len(rows) > limit:
+        return page, encode_cursor(*key(page[-1]))
+
+    return page, None
@@ -0,0 +1,120 @@
+"""EXPLAIN checks for the queries behind the busiest pages.
+
+`check_query_plans()` requests each page in HOT_PAGES as one user, records
+every SELECT the page runs, and EXPLAINs each of them. A plan that reads
+all of a table of FULL_SCAN_ROW_LIMIT rows or more (a sequential scan, or an
+index scan with nothing to seek to) means a query has lost its index, and
+is reported. Run it as `flask check-query-plans` against a fully seeded
+database, where the planner's choices are the ones production would make.
+
+On a small database the planner rightly prefers sequential scans, so the
+tests check with `force_indexes=True` instead: sequential scans are then
+disabled for the session, and a full scan still shows up only when no
+index can serve the query.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import event, text
+
+from models import db
+
+FULL_SCAN_ROW_LIMIT = 10000
+
+HOT_PAGES = [
+    "/",
+    "/users",
+    "/users?q={username}",
+    "/users/{user_id}",
+    "/users/{user_id}/following",
+    "/users/{user_id}/followers",
+    "/users/{user_id}/likes",
+    "/messages/{message_id}",
+]
+
+FullScan = namedtuple('FullScan', 'url table statement')
+
+
+def capture_queries(client, url):
+    """Return the (statement, parameters) of each SELECT run to get `url`."""
+
+    queries = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT'):
+            queries.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        client.get(url)
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+    return queries
+
+
+def full_scans(plan, limited=False):
+    """The tables read in full anywhere in an EXPLAIN plan.
+
+    That's a sequential scan, or an index scan with no condition to seek
+    to, which walks the whole index unless a Limit above it stops early.
+    """
+
+    tables = []
+    node = plan.get('Node Type')
+    if node == 'Seq Scan' or (node in ('Index Scan', 'Index Only Scan')
+                              and 'Index Cond' not in plan
+                              and not limited):
+        tables.append(plan['Relation Name'])
+
+    limited = limited or node == 'Limit'
+    for child in plan.get('Plans', []):
+        tables.extend(full_scans(child, limited))
+    return tables
+
+
+def explain(conn, statement, parameters):
+    """The JSON plan Postgres would use for `statement`."""
+
+    [[result]] = conn.exec_driver_sql(
+        f"EXPLAIN (FORMAT JSON) {statement}", parameters).all()
+    return result[0]['Plan']
+
+
+def _table_sizes(conn):
+    # Estimated rows, as of the last ANALYZE
+    return dict(conn.execute(text("""
+        SELECT relname, reltuples FROM pg_class WHERE relkind = 'r'
+    """)).all())
+
+
+def check_query_plans(client, user, message, force_indexes=False):
+    """Return a FullScan for each full table read in the HOT_PAGES queries.
+
+    `client` must be logged in as `user`; `message` is a message to show.
+    With `force_indexes`, any full scan counts, whatever the table's size.
+    """
+
+    urls = [page.format(user_id=user.id, username=user.username[:3],
+                        message_id=message.id)
+            for page in HOT_PAGES]
+    queries = [(url, query) for url in urls
+               for query in capture_queries(client, url)]
+    db.session.rollback()
+
+    found = []
+
+    with db.engine.connect() as conn:
+        if force_indexes:
+            conn.execute(text("SET enable_seqscan = off"))
+
+        sizes = _table_sizes(conn)
+
+        for url, (statement, parameters) in queries:
+            for table in full_scans(explain(conn, statement, parameters)):
+                if force_indexes or sizes[table] >= FULL_SCAN_ROW_LIMIT:
+                    found.append(FullScan(url, table, statement))
+
+        conn.rollback()
+
+    return found
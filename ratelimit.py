@@ -0,0 +1,138 @@
+"""Token-bucket rate limiting.
+
+Each key (e.g. a client address or a username) has a bucket holding up to
+`capacity` tokens, refilled at `rate` tokens per second. A request spends
+one token and is refused when the bucket is empty, so a client can burst up
+to `capacity` requests and then keep going at `rate`.
+
+Bucket state lives in a backend. MemoryBackend keeps it in this process,
+which is enough for a single worker; with several workers each has its own
+buckets, so the effective limit is multiplied by the number of workers. A
+shared store (e.g. Redis) can be plugged in by implementing
+RateLimitBackend.take() atomically there.
+
+Login attempts are also limited per client address. Behind a reverse
+proxy every request comes from the proxy's address, so set TRUSTED_PROXIES
+to the number of proxies in front of the app: `trust_proxies()` then takes
+the client's address from the X-Forwarded-For header they append to. Only
+count proxies that overwrite or append to the header, or clients could
+pick their own address.
+"""
+
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+from werkzeug.middleware.proxy_fix import ProxyFix
+
+LOGIN_IP_BURST = 20
+LOGIN_IP_RATE = 10 / 60
+LOGIN_USERNAME_BURST = 10
+LOGIN_USERNAME_RATE = 5 / 60
+
+
+class RateLimitBackend(ABC):
+    """Where buckets are stored. Implementations must be atomic per key."""
+
+    @abstractmethod
+    def take(self, key, capacity, rate, now):
+        """Spend a token from `key`'s bucket.
+
+        Return 0 if one was available, else the seconds until one will be.
+        """
+
+    @abstractmethod
+    def clear(self):
+        """Forget every bucket."""
+
+
+class MemoryBackend(RateLimitBackend):
+    """Buckets in a dict in this process, about `maxsize` of them.
+
+    Past `maxsize`, least recently used buckets are dropped, but only once
+    they have refilled: a dropped bucket comes back full, so dropping one
+    that isn't would hand its tokens back. Flooding the backend with
+    throwaway keys can't reset a bucket someone has emptied; the dict just
+    grows past `maxsize` until the oldest buckets are full again (at most
+    capacity / rate seconds).
+    """
+
+    def __init__(self, maxsize=100000):
+        self.maxsize = maxsize
+        self._buckets = OrderedDict()
+        self._lock = Lock()
+
+    def take(self, key, capacity, rate, now):
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (capacity, now, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+
+            if tokens >= 1:
+                wait = 0
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+
+            full_at = now + (capacity - tokens) / rate
+            self._buckets[key] = (tokens, now, full_at)
+            self._buckets.move_to_end(key)
+
+            while len(self._buckets) > self.maxsize:
+                oldest = next(iter(self._buckets.values()))
+                if oldest[2] > now:
+                    break
+                self._buckets.popitem(last=False)
+
+            return wait
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+class RateLimiter:
+    """A named family of buckets sharing a capacity and refill rate."""
+
+    def __init__(self, name, capacity, rate, backend=None, clock=monotonic):
+        self.name = name
+        self.capacity = capacity
+        self.rate = rate
+        self.backend = backend or MemoryBackend()
+        self.clock = clock
+
+    def take(self, key):
+        """Spend a token for `key`; return 0 or the seconds to wait."""
+
+        return self.backend.take(f"{self.name}:{key}", self.capacity,
+                                 self.rate, self.clock())
+
+
+login_ip_limiter = RateLimiter('login-ip', LOGIN_IP_BURST, LOGIN_IP_RATE)
+login_username_limiter = RateLimiter(
+    'login-username', LOGIN_USERNAME_BURST, LOGIN_USERNAME_RATE)
+
+
+def throttle_login(address, username):
+    """Spend login tokens for `address` and `username`.
+
+    Return 0 if the attempt may go ahead, else the seconds to wait. The
+    username bucket is only charged once the address bucket allows the
+    attempt, so attempts refused by address don't use up the username's.
+    """
+
+    return (login_ip_limiter.take(address)
+            or login_username_limiter.take(username.lower()))
+
+
+def trust_proxies(app):
+    """Read client addresses through app.config['TRUSTED_PROXIES'] proxies.
+
+    Does nothing if there are none.
+    """
+
+    proxies = app.config.get('TRUSTED_PROXIES', 0)
+
+    if proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies,
+                                x_proto=proxies)
@@ -0,0 +1,232 @@
+"""'Who to follow' recommendations.
+
+A user's candidates are the accounts followed by the accounts they follow
+(friends of friends), scored by how many of those paths lead to each one.
+With A the follow matrix (A[u, v] = 1 if u follows v), the scores for a
+batch of users U are the rows of A[U] @ A; scipy does that as one sparse
+multiplication per batch, so there are no per-user Python loops.
+
+Results are stored in the `recommendations` table, RECOMMENDATIONS_PER_USER
+per user, and pages read them from there. When a user's follows change
+they and their followers are queued in `stale_recommendations`; `flask
+refresh-recommendations` (run from cron) recomputes just the queued users,
+reading only the part of the graph two hops out from them. `flask rebuild-recommendations`
+recomputes everyone, in batches.
+
+With FOLLOW_GRAPH_ENABLED, the process's in-memory follow graph (see
+followgraph.py) supplies the follow matrix instead, so a rebuild reads
+`follows` once, when the graph loads, rather than once per batch. The
+graph can lag the table by a reload; recommendations already do.
+"""
+
+from itertools import chain
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import (
+    delete, event, func, literal, select, text, union)
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from followgraph import get_follow_graph
+from models import db, Follow, Recommendation, StaleRecommendation, User
+from timelines import follow_changes
+
+RECOMMENDATIONS_PER_USER = 20
+RECOMMENDATION_BATCH_SIZE = 1000
+WHO_TO_FOLLOW_SIZE = 5
+STALE_FOLLOWERS_LIMIT = 1000
+
+
+def _follow_matrix(conn, user_ids):
+    """Sparse follow matrix holding the edges two hops out from `user_ids`.
+
+    Only rows for `user_ids` and for the accounts they follow are filled,
+    which is all A[user_ids] @ A needs. The in-memory graph, if there is
+    one, has every row already.
+    """
+
+    graph = get_follow_graph()
+    if graph is not None:
+        return graph.follow_matrix(max(user_ids) + 1)
+
+    edges_from = select(
+        Follow.user_following_id, Follow.user_being_followed_id)
+    followed = select(Follow.user_being_followed_id).where(
+        Follow.user_following_id.in_(user_ids))
+
+    # A UNION rather than an OR, so each half uses ix_follows_following;
+    # it also drops edges that both halves return.
+    edges = union(
+        edges_from.where(Follow.user_following_id.in_(user_ids)),
+        edges_from.where(Follow.user_following_id.in_(followed)),
+    ).subquery()
+
+    # Fetched as two arrays rather than a row per edge
+    followers, followed = conn.execute(
+        select(func.array_agg(edges.c[0]), func.array_agg(edges.c[1]))
+    ).one()
+    followers = np.array(followers or [], dtype=np.int64)
+    followed = np.array(followed or [], dtype=np.int64)
+    size = int(max(followed.max(initial=0), followers.max(initial=0),
+                   max(user_ids))) + 1
+
+    return sparse.csr_matrix(
+        (np.ones(len(followers), dtype=np.int32), (followers, followed)),
+        shape=(size, size),
+    )
+
+
+def compute_recommendations(conn, user_ids, limit=RECOMMENDATIONS_PER_USER):
+    """Return (user_id, candidate_id, score) arrays of the top candidates.
+
+    At most `limit` per user, best first. Users never get themselves or
+    accounts they already follow.
+    """
+
+    user_ids = np.asarray(sorted(user_ids), dtype=np.int64)
+    follows = _follow_matrix(conn, user_ids.tolist())
+    batch = follows[user_ids]
+
+    scores = (batch @ follows).tocoo()
+    users = user_ids[scores.row]
+    candidates = scores.col.astype(np.int64)
+
+    already = batch.tocoo()
+    followed_keys = (user_ids[already.row] << 32) | already.col
+    keep = ((candidates != users)
+            & ~np.isin((users << 32) | candidates, followed_keys))
+    users, candidates, score = users[keep], candidates[keep], scores.data[keep]
+
+    # Best first within each user, then keep each user's first `limit`
+    order = np.lexsort((candidates, -score, users))
+    users, candidates, score = users[order], candidates[order], score[order]
+    starts = np.searchsorted(users, users, side='left')
+    top = np.arange(len(users)) - starts < limit
+
+    return users[top], candidates[top], score[top]
+
+
+def store_recommendations(conn, user_ids):
+    """Recompute and replace the stored recommendations of `user_ids`."""
+
+    users, candidates, scores = compute_recommendations(conn, user_ids)
+
+    conn.execute(
+        delete(Recommendation).where(Recommendation.user_id.in_(user_ids)))
+
+    if len(users):
+        # One statement for the whole batch, passing each column as an array
+        conn.execute(text("""
+            INSERT INTO recommendations (user_id, candidate_id, score)
+            SELECT * FROM unnest(CAST(:users AS int[]),
+                                 CAST(:candidates AS int[]),
+                                 CAST(:scores AS int[]))
+        """), {'users': users.tolist(),
+               'candidates': candidates.tolist(),
+               'scores': scores.tolist()})
+
+
+def refresh_recommendations(batch_size=RECOMMENDATION_BATCH_SIZE):
+    """Recompute recommendations for every queued user; return how many.
+
+    Each batch is claimed with SKIP LOCKED and committed on its own, so
+    several refreshers can run at once.
+    """
+
+    refreshed = 0
+
+    while True:
+        conn = db.session.connection()
+        claimed = (
+            select(StaleRecommendation.user_id)
+            .limit(batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        user_ids = conn.execute(
+            delete(StaleRecommendation)
+            .where(StaleRecommendation.user_id.in_(claimed))
+            .returning(StaleRecommendation.user_id)
+        ).scalars().all()
+
+        if not user_ids:
+            db.session.commit()
+            return refreshed
+
+        store_recommendations(conn, user_ids)
+        db.session.commit()
+        refreshed += len(user_ids)
+
+
+def rebuild_recommendations(batch_size=RECOMMENDATION_BATCH_SIZE):
+    """Recompute recommendations for every user, `batch_size` at a time.
+
+    Commits after each batch. Returns the number of users processed.
+    """
+
+    last_id = db.session.scalar(select(func.max(User.id))) or 0
+    db.session.execute(delete(StaleRecommendation))
+
+    for start in range(1, last_id + 1, batch_size):
+        conn = db.session.connection()
+        user_ids = conn.execute(
+            select(User.id).where(User.id >= start,
+                                  User.id < start + batch_size)
+        ).scalars().all()
+
+        if user_ids:
+            store_recommendations(conn, user_ids)
+        db.session.commit()
+
+    return db.session.scalar(select(func.count()).select_from(User))
+
+
+def who_to_follow(user, limit=WHO_TO_FOLLOW_SIZE):
+    """The best `limit` stored recommendations for `user`, as Users.
+
+    Skips accounts `user` has followed since the recommendations were
+    computed.
+    """
+
+    followed = select(Follow.user_being_followed_id).where(
+        Follow.user_following_id == user.id)
+
+    return (
+        User.query
+        .join(Recommendation, Recommendation.candidate_id == User.id)
+        .filter(Recommendation.user_id == user.id,
+                Recommendation.candidate_id.not_in(followed))
+        .order_by(Recommendation.score.desc(), Recommendation.candidate_id)
+        .limit(limit)
+        .all()
+    )
+
+
+@event.listens_for(db.session, 'after_flush')
+def queue_stale_recommendations(session, flush_context):
+    """Queue users whose candidates changed this flush for a refresh.
+
+    When B follows or unfollows C, that's B, and everyone following B,
+    whose friends of friends now include or lose C. Only the first
+    STALE_FOLLOWERS_LIMIT of B's followers are queued; the rest keep their
+    recommendations until the next full rebuild.
+    """
+
+    added, removed = follow_changes(session)
+    changed = {follower_id for follower_id, _ in added | removed}
+
+    if not changed:
+        return
+
+    stale = union(*chain.from_iterable(
+        (select(literal(user_id)),
+         select(Follow.user_following_id)
+         .where(Follow.user_being_followed_id == user_id)
+         .limit(STALE_FOLLOWERS_LIMIT))
+        for user_id in changed
+    ))
+
+    session.connection().execute(
+        pg_insert(StaleRecommendation)
+        .from_select(['user_id'], stale)
+        .on_conflict_do_nothing()
+    )
@@ -0,0 +1,194 @@
+"""Username search for the /users page.
+
+Results come in two tiers, best first:
+
+1. usernames starting with the query (an exact match sorts first), read in
+   order straight off the (lower(username) COLLATE "C", id) index;
+2. other usernames containing the query, found through the
+   `username_trigrams` inverted index and ranked shortest first.
+
+A full first page of prefix matches never touches the trigram index.
+Queries shorter than three characters have no trigrams and only match by
+prefix. Matching is case-insensitive.
+"""
+
+from itertools import chain
+
+from sqlalchemy import delete, event, func, insert, select, text
+from sqlalchemy.orm import attributes
+
+from models import db, User, UsernameTrigram
+from pagination import after, decode_cursor, encode_cursor, paginate
+
+SEARCH_PAGE_SIZE = 30
+SEARCH_INDEX_BATCH_SIZE = 10000
+
+PREFIX_TIER = 1
+CONTAINS_TIER = 2
+
+
+def trigrams(username):
+    """Every three-character substring of lowercased `username`."""
+
+    username = username.lower()
+    return {username[i:i + 3] for i in range(len(username) - 2)}
+
+
+def _search_key():
+    return func.lower(User.username).collate('C')
+
+
+def _prefix_matches(query, key, last_id, limit):
+    search_key = _search_key()
+    users = User.query.filter(search_key.startswith(query, autoescape=True))
+
+    # Only seek past a real cursor: an empty one would become the index
+    # scan's start key and walk every username sorting before the prefix.
+    if last_id:
+        users = users.filter(after((search_key, User.id), (key, last_id)))
+
+    return users.order_by(search_key, User.id).limit(limit).all()
+
+
+def _contains_matches(query, length, last_id, limit):
+    grams = trigrams(query)
+    candidates = (
+        select(UsernameTrigram.user_id)
+        .where(UsernameTrigram.trigram.in_(grams))
+        .group_by(UsernameTrigram.user_id)
+        .having(func.count() == len(grams))
+    )
+    search_key = _search_key()
+    username_length = func.length(User.username)
+
+    users = User.query.filter(
+        User.id.in_(candidates),
+        search_key.contains(query, autoescape=True),
+        ~search_key.startswith(query, autoescape=True),
+    )
+
+    if last_id:
+        users = users.filter(
+            after((username_length, User.id), (length, last_id)))
+
+    return users.order_by(username_length, User.id).limit(limit).all()
+
+
+def decode_search_cursor(cursor):
+    """Decode a search cursor into (tier, key, id).
+
+    The key is a lowercased username in the prefix tier and a username
+    length in the contains tier. Raises ValueError if it is malformed.
+    """
+
+    tier, key, last_id = decode_cursor(cursor, int, str, int)
+
+    if tier == CONTAINS_TIER:
+        key = int(key)
+    elif tier != PREFIX_TIER:
+        raise ValueError(f"Invalid search cursor: {cursor!r}")
+
+    return tier, key, last_id
+
+
+def search_users(query, cursor=None, limit=SEARCH_PAGE_SIZE):
+    """Return (users, next_cursor) for a page of results for `query`.
+
+    `cursor` is the decoded (tier, key, id) from the previous page (see
+    decode_search_cursor()).
+    """
+
+    query = query.lower()
+    tier, key, last_id = cursor or (PREFIX_TIER, "", 0)
+    users = []
+
+    if tier == PREFIX_TIER:
+        users = _prefix_matches(query, key, last_id, limit + 1)
+
+        if len(users) > limit:
+            last = users[limit - 1]
+            return users[:limit], encode_cursor(
+                PREFIX_TIER, last.username.lower(), last.id)
+
+        key, last_id = 0, 0
+
+    if len(query) < 3:
+        return users, None
+
+    room = limit - len(users)
+    more = _contains_matches(query, key, last_id, room + 1)
+    users += more[:room]
+
+    if len(more) <= room:
+        return users, None
+
+    if room:
+        last = more[room - 1]
+        return users, encode_cursor(
+            CONTAINS_TIER, len(last.username), last.id)
+
+    return users, encode_cursor(CONTAINS_TIER, 0, 0)
+
+
+def browse_users(cursor=None, limit=SEARCH_PAGE_SIZE):
+    """Return (users, next_cursor) for a page of all users, by id."""
+
+    users = User.query.order_by(User.id)
+
+    if cursor:
+        users = users.filter(after((User.id,), cursor))
+
+    return paginate(users.limit(limit + 1).all(), limit,
+                    key=lambda user: (user.id,))
+
+
+def index_username(conn, user_id, username):
+    """Replace the trigram index entries for one user."""
+
+    conn.execute(
+        delete(UsernameTrigram).where(UsernameTrigram.user_id == user_id))
+
+    grams = trigrams(username)
+
+    if grams:
+        conn.execute(
+            insert(UsernameTrigram),
+            [{'trigram': gram, 'user_id': user_id} for gram in grams],
+        )
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_search_index(session, flush_context):
+    """Index usernames of users created or renamed this flush."""
+
+    for user in chain(session.new, session.dirty):
+        if not isinstance(user, User):
+            continue
+
+        if (user in session.new
+                or attributes.get_history(user, 'username').has_changes()):
+            index_username(session.connection(), user.id, user.username)
+
+
+def rebuild_search_index(batch_size=SEARCH_INDEX_BATCH_SIZE):
+    """Recompute the whole trigram index from the users table.
+
+    Used after bulk loads that bypass the session (e.g. seed.py). Works
+    through user id ranges of `batch_size`, committing after each.
+    """
+
+    last_id = db.session.scalar(select(func.max(User.id))) or 0
+
+    for start in range(1, last_id + 1, batch_size):
+        bounds = {'start': start, 'stop': start + batch_size}
+        conn = db.session.connection()
+        conn.execute(delete(UsernameTrigram).where(
+            UsernameTrigram.user_id >= start,
+            UsernameTrigram.user_id < start + batch_size))
+        conn.execute(text("""
+            INSERT INTO username_trigrams (trigram, user_id)
+            SELECT DISTINCT substr(lower(username), i, 3), id
+            FROM users, generate_series(1, length(username) - 2) AS i
+            WHERE id >= :start AND id < :stop
+        """), bounds)
+        db.session.commit()
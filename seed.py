@@ -1,19 +1,51 @@
-"""Seed database with sample data from CSV Files."""
+"""Seed database with sample data from CSV Files.
+
+The files are streamed in with COPY a chunk at a time (see bulkload.py).
+If a load is interrupted, running this again resumes it from the last
+committed chunk instead of starting over.
+"""
+
+import os
 
-from csv import DictReader
 from app import db
-from models import User, Message, Follow
+from models import User, Message, Follow, Like
+from bulkload import copy_csv, finish_load, load_in_progress, start_load
+from counters import reconcile_counters
+from migrations import stamp_migrations
+from recommendations import rebuild_recommendations
+from search import rebuild_search_index
+from timelines import rebuild_timelines
+
+LOADS = [
+    (User.__table__, 'users.csv'),
+    (Message.__table__, 'messages.csv'),
+    (Follow.__table__, 'follows.csv'),
+    (Like.__table__, 'likes.csv'),
+]
+
+
+def seed(directory='generator', report=print):
+    """Load the CSV files in `directory` and build everything derived."""
+
+    if not load_in_progress():
+        db.drop_all()
+        db.create_all()
+        stamp_migrations()
+        start_load([table for table, name in LOADS])
+
+    for table, name in LOADS:
+        copy_csv(table, os.path.join(directory, name), report=report)
+
+    finish_load()
 
-db.drop_all()
-db.create_all()
+    rebuild_timelines()
+    rebuild_search_index()
 
-with open('generator/users.csv') as users:
-    db.session.bulk_insert_mappings(User, DictReader(users))
+    db.session.commit()
 
-with open('generator/messages.csv') as messages:
-    db.session.bulk_insert_mappings(Message, DictReader(messages))
+    reconcile_counters()
+    rebuild_recommendations()
 
-with open('generator/follows.csv') as follows:
-    db.session.bulk_insert_mappings(Follow, DictReader(follows))
 
-db.session.commit()
+if __name__ == "__main__":
+    seed()
@@ -0,0 +1,111 @@
+"""Streamed rendering for the user listing pages.
+
+With STREAM_LISTINGS on, the /users page (when not searching) and the
+following and followers pages are sent with Flask's `stream_template()`.
+The page up to the listing goes out before the listing's query runs; the
+cards are then read from a server-side cursor (`yield_per`) and rendered
+STREAM_CHUNK_SIZE at a time, with the viewer's follow state loaded for
+each chunk. Memory is bounded by the chunk rather than the page, so a
+streamed page can hold STREAMED_PAGE_SIZE cards.
+
+Streamed pages have no ETag, since one can't be computed before the rows
+are read, so they are sent no-store like other unversioned responses.
+The session cookie goes out with the headers: views must build
+`g.csrf_form` (which may store a new CSRF token) before streaming starts.
+"""
+
+from flask import current_app, stream_template
+
+from hydration import load_follow_state
+from listings import LISTING_PAGE_SIZE
+from models import db
+from pagination import encode_cursor
+
+STREAM_CHUNK_SIZE = LISTING_PAGE_SIZE
+STREAMED_PAGE_SIZE = 10 * LISTING_PAGE_SIZE
+
+
+class StreamedCards:
+    """A page of user cards, fetched and hydrated while it is rendered.
+
+    Templates get it as both the list of cards and `follow_state`:
+    `follows()` answers for the chunk being rendered and for the `also`
+    users (a profile's owner, say). `next_cursor` is set once the page
+    has been read, and `cursor_after` reads it when rendered.
+
+    Can only be iterated once.
+    """
+
+    def __init__(self, cards, viewer, also=(), limit=STREAMED_PAGE_SIZE,
+                 chunk_size=STREAM_CHUNK_SIZE):
+        self.viewer = viewer
+        self.limit = limit
+        self.chunk_size = chunk_size
+        self.next_cursor = None
+        self.cursor_after = CursorAfter(self)
+
+        self._chunks = self._fetch(cards.limit(limit + 1))
+        self._first = None
+        self._also_state = load_follow_state(also, viewer)
+        self._chunk_state = load_follow_state([], viewer)
+
+    def _fetch(self, cards):
+        result = db.session.execute(
+            cards, execution_options={'yield_per': self.chunk_size})
+        count = 0
+
+        for rows in result.partitions():
+            chunk = rows[:self.limit - count]
+            count += len(rows)
+
+            if chunk:
+                last = chunk[-1]
+                yield chunk
+
+        # The query reads one card past the page, if there is one
+        if count > self.limit:
+            self.next_cursor = encode_cursor(last.id)
+
+    def _first_chunk(self):
+        if self._first is None:
+            self._first = next(self._chunks, [])
+        return self._first
+
+    def __bool__(self):
+        return bool(self._first_chunk())
+
+    def __iter__(self):
+        chunk = self._first_chunk()
+
+        while chunk:
+            self._chunk_state = load_follow_state(chunk, self.viewer)
+            yield from chunk
+            chunk = next(self._chunks, [])
+
+    def follows(self, user):
+        """Does the viewer follow `user`?"""
+
+        return (self._chunk_state.follows(user) or
+                self._also_state.follows(user))
+
+
+class CursorAfter:
+    """The `next_cursor` of some StreamedCards, read when it's rendered."""
+
+    def __init__(self, cards):
+        self.cards = cards
+
+    def __bool__(self):
+        return self.cards.next_cursor is not None
+
+    def __str__(self):
+        return self.cards.next_cursor
+
+
+def stream_listing(template, cards, **context):
+    """A response streaming `template`, with `cards` as its follow_state
+    and next_cursor; pass them as the template's list too."""
+
+    return current_app.response_class(stream_template(
+        template, follow_state=cards, next_cursor=cards.cursor_after,
+        **context))
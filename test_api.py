@@ -0,0 +1,188 @@
+"""JSON API tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_api.py
+
+
+import os
+from functools import partial
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from api import MAX_BATCH_IDS
+from counters import reconcile_counters
+from timelines import profile_timeline
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ApiTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        Follow.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        messages = [Message(text=f"Message {n}", user_id=u2.id)
+                    for n in range(3)]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        db.session.add(Like(user_id=u1.id, message_id=messages[0].id))
+        db.session.commit()
+        reconcile_counters()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m_ids = [m.id for m in messages]
+        self.client = app.test_client()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def tearDown(self):
+        db.session.rollback()
+
+        Like.query.delete()
+        Message.query.delete()
+        Follow.query.delete()
+        User.query.delete()
+        db.session.commit()
+
+    def test_feed(self):
+        resp = self.client.get('/api/v1/feed')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/json')
+        self.assertEqual([m["id"] for m in resp.json["messages"]],
+                         self.m_ids[::-1])
+        self.assertIsNone(resp.json["next_cursor"])
+
+        liked = resp.json["messages"][-1]
+        self.assertEqual(liked["text"], "Message 0")
+        self.assertTrue(liked["liked"])
+        self.assertEqual(liked["like_count"], 1)
+        self.assertEqual(liked["user"]["username"], "u2")
+        self.assertFalse(resp.json["messages"][0]["liked"])
+
+    def test_pagination(self):
+        url = f'/api/v1/users/{self.u2_id}/messages'
+
+        with patch('api.profile_timeline', partial(profile_timeline,
+                                                   limit=2)):
+            first = self.client.get(url).json
+            second = self.client.get(
+                url, query_string={"before": first["next_cursor"]}).json
+
+        self.assertEqual([m["id"] for m in first["messages"]],
+                         self.m_ids[:0:-1])
+        self.assertEqual([m["id"] for m in second["messages"]],
+                         self.m_ids[:1])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_users(self):
+        profile = self.client.get(f'/api/v1/users/{self.u2_id}').json
+
+        self.assertEqual(profile["username"], "u2")
+        self.assertEqual(profile["messages_count"], 3)
+        self.assertEqual(profile["followers_count"], 1)
+        self.assertTrue(profile["following"])
+
+        followers = self.client.get(
+            f'/api/v1/users/{self.u2_id}/followers').json
+        self.assertEqual([u["username"] for u in followers["users"]],
+                         ["u1"])
+
+        following = self.client.get(
+            f'/api/v1/users/{self.u1_id}/following').json
+        self.assertEqual([u["username"] for u in following["users"]],
+                         ["u2"])
+        self.assertTrue(following["users"][0]["following"])
+
+    def test_message(self):
+        resp = self.client.get(f'/api/v1/messages/{self.m_ids[0]}')
+
+        self.assertEqual(resp.json["text"], "Message 0")
+        self.assertTrue(resp.json["liked"])
+
+    def test_messages_by_id(self):
+        ids = [self.m_ids[2], 0, self.m_ids[0], self.m_ids[2]]
+
+        resp = self.client.get('/api/v1/messages', query_string={
+            "ids": ",".join(map(str, ids))})
+
+        self.assertEqual([m["id"] for m in resp.json["messages"]],
+                         [self.m_ids[2], self.m_ids[0]])
+
+    def test_bad_batches(self):
+        for ids in ["1,two", ",".join(["1"] * (MAX_BATCH_IDS + 1))]:
+            with self.subTest(ids=ids[:10]):
+                resp = self.client.get('/api/v1/messages',
+                                       query_string={"ids": ids})
+
+                self.assertEqual(resp.status_code, 400)
+                self.assertIn("error", resp.json)
+
+    def test_not_modified(self):
+        url = f'/api/v1/users/{self.u2_id}/messages'
+        etag = self.client.get(url).headers['ETag']
+
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+
+        self.client.post(f'/users/like/{self.m_ids[1]}?next=/')
+        resp = self.client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_errors(self):
+        resp = self.client.get('/api/v1/messages/0')
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(resp.mimetype, 'application/json')
+        self.assertIn("error", resp.json)
+
+        for url in ['/api/v1/nope', '/api/v1']:
+            with self.subTest(url=url):
+                resp = self.client.get(url)
+
+                self.assertEqual(resp.status_code, 404)
+                self.assertEqual(resp.mimetype, 'application/json')
+                self.assertIn("error", resp.json)
+
+        self.assertEqual(self.client.get('/api/v10').mimetype, 'text/html')
+
+        with self.client.session_transaction() as sess:
+            del sess[CURR_USER_KEY]
+
+        resp = self.client.get('/api/v1/feed')
+
+        self.assertEqual(resp.status_code, 401)
+        self.assertEqual(resp.json, {"error": "Log in first."})
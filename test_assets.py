@@ -0,0 +1,123 @@
+"""Fingerprinted static asset tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_assets.py
+
+
+import gzip
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app
+from assets import ASSETS_MAX_AGE, build_assets, use_assets
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class AssetsTestCase(TestCase):
+    def setUp(self):
+        User.query.delete()
+        db.session.commit()
+
+        self.directory = tempfile.mkdtemp()
+        self.manifest = build_assets(app.static_folder, self.directory)
+        use_assets(self.directory)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        use_assets(app.config['ASSETS_DIR'])
+        shutil.rmtree(self.directory)
+
+    def read(self, hashed, suffix=''):
+        with open(os.path.join(self.directory, hashed + suffix), 'rb') as f:
+            return f.read()
+
+    def test_build(self):
+        css = self.manifest['stylesheets/style.css']
+        self.assertRegex(css, r'^stylesheets/style\.[0-9a-f]{10}\.css$')
+
+        # Stylesheet references point at the hashed files
+        logo_bg = self.manifest['images/nav-bg.png']
+        self.assertIn(f'url("/assets/{logo_bg}")'.encode(), self.read(css))
+        self.assertNotIn(b'/static/', self.read(css))
+
+        # Text is precompressed; images aren't
+        self.assertEqual(gzip.decompress(self.read(css, '.gz')),
+                         self.read(css))
+        self.assertFalse(os.path.exists(os.path.join(
+            self.directory, self.manifest['images/warbler-hero.jpg'] + '.gz')))
+
+    def test_stable_names(self):
+        """Rebuilding unchanged files gives the same names."""
+
+        self.assertEqual(build_assets(app.static_folder, self.directory),
+                         self.manifest)
+
+    def test_pages_link_assets(self):
+        html = self.client.get('/').get_data(as_text=True)
+
+        self.assertIn(f'/assets/{self.manifest["stylesheets/style.css"]}',
+                      html)
+        self.assertIn(f'/assets/{self.manifest["js/redirect.js"]}', html)
+        self.assertNotIn('/static/', html)
+
+    def test_serve(self):
+        url = f'/assets/{self.manifest["stylesheets/style.css"]}'
+
+        resp = self.client.get(url, headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.content_encoding, 'gzip')
+        self.assertEqual(resp.mimetype, 'text/css')
+        self.assertIn('Accept-Encoding', resp.vary)
+        self.assertTrue(resp.cache_control.immutable)
+        self.assertTrue(resp.cache_control.public)
+        self.assertEqual(resp.cache_control.max_age, ASSETS_MAX_AGE)
+        self.assertFalse(resp.cache_control.no_store)
+        self.assertLess(len(resp.data), len(self.read(url[8:])))
+        resp.close()
+
+        resp = self.client.get(url)
+
+        self.assertIsNone(resp.content_encoding)
+        self.assertEqual(resp.data, self.read(url[8:]))
+        resp.close()
+
+    def test_unknown_asset(self):
+        self.assertEqual(self.client.get('/assets/manifest.json').status_code,
+                         404)
+        self.assertEqual(self.client.get('/assets/../app.py').status_code,
+                         404)
+
+    def test_unbuilt(self):
+        """Without a build, pages link plain static files."""
+
+        use_assets(os.path.join(self.directory, 'nowhere'))
+
+        html = self.client.get('/').get_data(as_text=True)
+
+        self.assertIn('/static/stylesheets/style.css', html)
@@ -0,0 +1,146 @@
+"""Streaming bulk load tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_bulkload.py
+
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from sqlalchemy import inspect, text
+
+from models import db, User, Message, Like, LoadCheckpoint
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app
+from bulkload import copy_csv, finish_load, load_in_progress, start_load
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class Interrupted(Exception):
+    pass
+
+
+class BulkLoadTestCase(TestCase):
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        self.directory = tempfile.mkdtemp()
+        self.users_path = self.write("users.csv", [
+            "email,username,password",
+            *[f"u{n}@email.com,u{n},x" for n in range(5)],
+        ])
+        self.messages_path = self.write("messages.csv", [
+            "text,timestamp,user_id",
+            '"Hello, world",2021-02-12 06:41:25,1',
+            "Second,2021-02-12 06:41:26,5",
+        ])
+
+    def tearDown(self):
+        db.session.rollback()
+        shutil.rmtree(self.directory)
+        finish_load()
+
+    def write(self, name, lines):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write("\r\n".join(lines) + "\r\n")
+        return path
+
+    def index_names(self, table):
+        return {index['name']
+                for index in inspect(db.engine).get_indexes(table)}
+
+    def test_copy(self):
+        self.assertEqual(copy_csv(User.__table__, self.users_path,
+                                  report=lambda line: None), 5)
+        self.assertEqual(copy_csv(Message.__table__, self.messages_path,
+                                  report=lambda line: None), 2)
+
+        user = User.query.filter_by(username="u4").one()
+        self.assertEqual(user.id, 5)
+        self.assertEqual(user.bio, "")
+        self.assertEqual(user.messages_count, 0)
+        self.assertFalse(user.merge_on_read)
+        self.assertEqual([m.text for m in user.messages], ["Second"])
+        self.assertEqual(Message.query.get(1).text, "Hello, world")
+
+    def test_resume(self):
+        """An interrupted load resumes after the last committed chunk."""
+
+        progress = []
+
+        def interrupt(line):
+            progress.append(line)
+            raise Interrupted
+
+        with self.assertRaises(Interrupted):
+            copy_csv(User.__table__, self.users_path, chunk_rows=2,
+                     report=interrupt)
+        self.assertEqual(len(progress), 1)
+        self.assertTrue(
+            progress[0].startswith(f"{self.users_path}: 2 rows ("))
+
+        # A chunk that rolled back still used up ids
+        db.session.execute(text("SELECT nextval('users_id_seq')"))
+        db.session.commit()
+
+        self.assertTrue(load_in_progress())
+        self.assertEqual(copy_csv(User.__table__, self.users_path,
+                                  chunk_rows=2, report=progress.append), 5)
+        self.assertEqual(progress[-1], f"{self.users_path}: 5 rows (100%)")
+        self.assertEqual([user.id for user in User.query.order_by(User.id)],
+                         [1, 2, 3, 4, 5])
+
+        # Finished files are skipped
+        self.assertEqual(copy_csv(User.__table__, self.users_path), 5)
+
+        finish_load()
+        self.assertFalse(load_in_progress())
+        self.assertEqual(LoadCheckpoint.query.count(), 0)
+
+    def test_deferred_indexes(self):
+        """Indexes and constraints are dropped for the load and restored."""
+
+        indexes = self.index_names('messages') | self.index_names('users')
+
+        start_load([User.__table__, Message.__table__, Like.__table__])
+
+        self.assertTrue(load_in_progress())
+        self.assertNotIn('ix_messages_user_timestamp',
+                         self.index_names('messages'))
+        self.assertNotIn('users_username_key', self.index_names('users'))
+        self.assertEqual(inspect(db.engine).get_foreign_keys('messages'), [])
+
+        copy_csv(User.__table__, self.users_path, report=lambda line: None)
+        copy_csv(Message.__table__, self.messages_path,
+                 report=lambda line: None)
+        finish_load()
+
+        self.assertFalse(load_in_progress())
+        self.assertEqual(self.index_names('messages') |
+                         self.index_names('users'), indexes)
+        self.assertEqual(len(inspect(db.engine).get_foreign_keys('likes')), 2)
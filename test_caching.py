@@ -0,0 +1,170 @@
+"""Cache tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_caching.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, User, Message, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from caching import TTLCache, current_users
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class TTLCacheTestCase(TestCase):
+    def test_hit_and_miss(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 1)
+        self.assertEqual(cache.get('a'), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_expiry(self):
+        clock = FakeClock()
+        cache = TTLCache(maxsize=2, ttl=10, clock=clock)
+        cache.set('a', 1)
+
+        clock.now = 9
+        self.assertEqual(cache.get('a'), 1)
+        clock.now = 10
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    def test_invalidate(self):
+        cache = TTLCache(maxsize=2, ttl=10)
+        cache.set('a', 1)
+        cache.invalidate('a')
+        cache.invalidate('missing')
+
+        self.assertIsNone(cache.get('a'))
+
+
+class CurrentUserCacheTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.client = app.test_client()
+        current_users.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def count_user_lookups(self, path, method='get', **kwargs):
+        """Request `path` as u1; return (response, users-by-id queries)."""
+
+        statements = []
+
+        def record(conn, cursor, statement, params, context, executemany):
+            if 'FROM users' in statement and 'users.id =' in statement:
+                statements.append(statement)
+
+        # Start from an empty identity map, as a new request would.
+        db.session.expunge_all()
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            with self.client as c:
+                with c.session_transaction() as sess:
+                    sess[CURR_USER_KEY] = self.u1_id
+                resp = getattr(c, method)(path, **kwargs)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+
+        return resp, len(statements)
+
+    def test_second_request_hits_cache(self):
+        """Only the first request looks the current user up."""
+
+        _, first = self.count_user_lookups('/nowhere')
+        resp, second = self.count_user_lookups('/nowhere')
+
+        self.assertEqual(resp.status_code, 404)
+        self.assertEqual(first, 1)
+        self.assertEqual(second, 0)
+        self.assertEqual(current_users.hits, 1)
+        self.assertEqual(current_users.misses, 1)
+
+    def test_profile_update_invalidates(self):
+        """A profile edit is visible on the very next request."""
+
+        self.count_user_lookups('/nowhere')
+        self.count_user_lookups('/users/profile', method='post', data={
+            "username": "renamed",
+            "email": "u1@email.com",
+            "image_url": "",
+            "header_image_url": "",
+            "bio": "",
+            "password": "password",
+        })
+
+        self.assertNotIn(self.u1_id, current_users._entries)
+        resp, _ = self.count_user_lookups('/users/profile')
+        self.assertIn('renamed', resp.get_data(as_text=True))
+
+    def test_counter_bump_invalidates(self):
+        """Writes to the cached user through the session drop its entry."""
+
+        self.count_user_lookups('/nowhere')
+        self.count_user_lookups('/messages/new', method='post',
+                                data={"text": "hello"})
+
+        self.assertNotIn(self.u1_id, current_users._entries)
+        self.assertEqual(db.session.get(User, self.u1_id).messages_count, 1)
+
+    def test_deleted_user_is_forgotten(self):
+        self.count_user_lookups('/nowhere')
+        self.count_user_lookups('/users/delete', method='post')
+
+        self.assertNotIn(self.u1_id, current_users._entries)
+        self.assertIsNone(db.session.get(User, self.u1_id))
@@ -0,0 +1,170 @@
+"""Conditional GET tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_conditional.py
+
+
+import os
+import time
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        Follow.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        db.session.add(Message(text="By u2", user_id=u2.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m_id = Message.query.one().id
+        self.client = app.test_client()
+        self.login(self.u1_id)
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, headers={'If-None-Match': etag})
+
+    def test_not_modified(self):
+        """Pages come with an ETag; a matching one skips rendering."""
+
+        for url in ['/', f'/users/{self.u2_id}', f'/messages/{self.m_id}',
+                    f'/users/{self.u2_id}/followers',
+                    f'/users/{self.u1_id}/following',
+                    f'/users/{self.u1_id}/likes']:
+            with self.subTest(url=url):
+                resp = self.client.get(url)
+
+                self.assertEqual(resp.status_code, 200)
+                self.assertIn('private', resp.headers['Cache-Control'])
+                self.assertIn('no-cache', resp.headers['Cache-Control'])
+                self.assertNotIn('no-store', resp.headers['Cache-Control'])
+                etag = resp.headers['ETag']
+
+                with patch('conditional.render_template') as render:
+                    resp = self.revalidate(url, etag)
+
+                self.assertEqual(resp.status_code, 304)
+                self.assertEqual(resp.headers['ETag'], etag)
+                render.assert_not_called()
+
+    def test_changes(self):
+        """A like, a follow or another viewer each change the ETag."""
+
+        url = f'/users/{self.u2_id}'
+        etag = self.client.get(url).headers['ETag']
+
+        self.client.post(f'/users/like/{self.m_id}?next=/')
+        resp = self.revalidate(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+
+        self.client.post(f'/users/stop-following/{self.u2_id}')
+        resp = self.revalidate(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn(f'action="/users/follow/{self.u2_id}"',
+                      resp.get_data(as_text=True))
+        etag = resp.headers['ETag']
+
+        self.login(self.u2_id)
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_csrf_window(self):
+        """Cached pages are re-rendered before their CSRF token expires."""
+
+        url = f'/users/{self.u2_id}'
+        etag = self.client.get(url).headers['ETag']
+        later = time.time() + app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+
+        with patch('conditional.time.time', return_value=later):
+            self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_flashed_messages(self):
+        """A page with a flash waiting is rendered, to show it."""
+
+        url = f'/users/{self.u2_id}'
+        etag = self.client.get(url).headers['ETag']
+
+        with self.client.session_transaction() as sess:
+            sess['_flashes'] = [('success', 'Hello!')]
+
+        resp = self.revalidate(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('Hello!', resp.get_data(as_text=True))
+
+    def test_new_session(self):
+        """A page cached under another session isn't reused: its CSRF
+        token wouldn't be accepted."""
+
+        url = f'/users/{self.u2_id}'
+        app.config['WTF_CSRF_ENABLED'] = True
+
+        try:
+            etag = self.client.get(url).headers['ETag']
+            self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+            # Same user, fresh cookie jar: no CSRF secret yet
+            self.client = app.test_client()
+            self.login(self.u1_id)
+            resp = self.revalidate(url, etag)
+            self.assertEqual(resp.status_code, 200)
+
+            # Now with a secret of its own, which the old page wasn't
+            # made with
+            self.assertEqual(self.revalidate(url, etag).status_code, 200)
+            new_etag = resp.headers['ETag']
+            self.assertNotEqual(new_etag, etag)
+            self.assertEqual(self.revalidate(url, new_etag).status_code,
+                             304)
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+
+    def test_forms_not_stored(self):
+        for url in ['/messages/new', '/users/profile']:
+            with self.subTest(url=url):
+                resp = self.client.get(url)
+
+                self.assertIn('no-store', resp.headers['Cache-Control'])
+                self.assertNotIn('ETag', resp.headers)
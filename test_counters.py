@@ -0,0 +1,154 @@
+"""Denormalized counter tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_counters.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Like, Follow
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from counters import reconcile_counters
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class CounterTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        m2 = Message(text="m2-text", user_id=u2.id)
+        db.session.add(m2)
+        db.session.commit()
+        reconcile_counters()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m2_id = m2.id
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+        # Other test modules delete messages without clearing likes first
+        Like.query.delete()
+        db.session.commit()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def test_follow_counts(self):
+        """Following and unfollowing update both users' counts."""
+
+        with self.client as c:
+            self.login(c)
+
+            c.post(f"/users/follow/{self.u2_id}")
+            c.post(f"/users/follow/{self.u2_id}")
+            self.assertEqual(User.query.get(self.u1_id).following_count, 1)
+            self.assertEqual(User.query.get(self.u2_id).followers_count, 1)
+
+            c.post(f"/users/stop-following/{self.u2_id}")
+            self.assertEqual(User.query.get(self.u1_id).following_count, 0)
+            self.assertEqual(User.query.get(self.u2_id).followers_count, 0)
+
+    def test_like_counts(self):
+        """Liking and unliking update the liker's and the message's counts."""
+
+        with self.client as c:
+            self.login(c)
+
+            c.post(f"/users/like/{self.m2_id}?next=/")
+            c.post(f"/users/like/{self.m2_id}?next=/")
+            self.assertEqual(User.query.get(self.u1_id).likes_count, 1)
+            self.assertEqual(Message.query.get(self.m2_id).like_count, 1)
+
+            c.post(f"/users/unlike/{self.m2_id}?next=/")
+            self.assertEqual(User.query.get(self.u1_id).likes_count, 0)
+            self.assertEqual(Message.query.get(self.m2_id).like_count, 0)
+
+    def test_message_counts(self):
+        """Posting and deleting a message update the author's count."""
+
+        with self.client as c:
+            self.login(c)
+
+            c.post("/messages/new", data={"text": "Hello"})
+            self.assertEqual(User.query.get(self.u1_id).messages_count, 1)
+
+            msg = Message.query.filter_by(text="Hello").one()
+            c.post(f"/messages/{msg.id}/delete")
+            self.assertEqual(User.query.get(self.u1_id).messages_count, 0)
+
+    def test_profile_shows_counts(self):
+        """The profile page prints the stored counters."""
+
+        with self.client as c:
+            self.login(c)
+
+            c.post(f"/users/follow/{self.u2_id}")
+            resp = c.get(f"/users/{self.u2_id}/followers")
+            html = resp.get_data(as_text=True)
+
+            self.assertIn(f'href="/users/{self.u2_id}/followers">\n'
+                          '                1\n', html)
+
+    def test_delete_user_releases_counts(self):
+        """Deleting a user decrements counts that referenced them."""
+
+        with self.client as c:
+            self.login(c)
+
+            c.post(f"/users/follow/{self.u2_id}")
+            c.post(f"/users/like/{self.m2_id}?next=/")
+            c.post("/users/delete")
+
+            self.assertEqual(User.query.get(self.u2_id).followers_count, 0)
+            self.assertEqual(Message.query.get(self.m2_id).like_count, 0)
+
+    def test_reconcile_counters(self):
+        """Reconciling fixes drifted counters and reports how many."""
+
+        db.session.add(Follow(user_being_followed_id=self.u2_id,
+                              user_following_id=self.u1_id))
+        db.session.add(Like(user_id=self.u1_id, message_id=self.m2_id))
+        db.session.commit()
+
+        self.assertEqual(reconcile_counters(batch_size=1), (2, 1))
+        self.assertEqual(reconcile_counters(), (0, 0))
+
+        u1 = User.query.get(self.u1_id)
+        u2 = User.query.get(self.u2_id)
+        self.assertEqual((u1.following_count, u1.likes_count), (1, 1))
+        self.assertEqual((u2.followers_count, u2.messages_count), (1, 1))
+        self.assertEqual(Message.query.get(self.m2_id).like_count, 1)
@@ -0,0 +1,201 @@
+"""In-memory follow graph tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_followgraph.py
+
+
+import os
+import threading
+from unittest import TestCase
+from unittest.mock import patch
+
+import numpy as np
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import followgraph
+from followgraph import FollowGraph, reload_follow_graph
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FollowGraphTestCase(TestCase):
+    def setUp(self):
+        # 1 -> 2, 1 -> 3, 2 -> 3, 4 -> 1
+        self.graph = FollowGraph([1, 1, 2, 4], [2, 3, 3, 1])
+
+    def test_lookups(self):
+        self.assertTrue(self.graph.is_following(1, 3))
+        self.assertFalse(self.graph.is_following(3, 1))
+        self.assertFalse(self.graph.is_following(99, 1))
+        self.assertEqual(list(self.graph.following_ids(1)), [2, 3])
+        self.assertEqual(list(self.graph.follower_ids(3)), [1, 2])
+        self.assertEqual(self.graph.followers_count(3), 2)
+        self.assertEqual(self.graph.following_count(99), 0)
+        self.assertEqual(len(self.graph), 4)
+
+    def test_add_and_remove(self):
+        self.graph.add(3, 1)
+        self.graph.add(1, 2)
+        self.graph.remove(1, 3)
+        self.graph.add(100, 1)
+
+        self.assertEqual(list(self.graph.following_ids(1)), [2])
+        self.assertEqual(list(self.graph.follower_ids(1)), [3, 4, 100])
+        self.assertEqual(self.graph.following_count(3), 1)
+        self.assertEqual(len(self.graph), 5)
+
+        self.graph.remove_user(1)
+        self.assertEqual(list(self.graph.follower_ids(1)), [])
+        self.assertEqual(list(self.graph.follower_ids(2)), [])
+        self.assertEqual(len(self.graph), 1)
+
+    def test_compaction(self):
+        """Folding changes back into the arrays keeps answers the same."""
+
+        with patch('followgraph.COMPACT_THRESHOLD', 2):
+            self.graph.add(3, 1)
+            self.graph.remove(1, 2)
+            self.graph.add(5, 1)
+
+        self.assertEqual(self.graph._following.pending, 0)
+        self.assertEqual(list(self.graph.following_ids(1)), [3])
+        self.assertEqual(list(self.graph.follower_ids(1)), [3, 4, 5])
+        self.assertEqual(len(self.graph), 5)
+
+    def test_reads_wait_for_changes(self):
+        """Reads wait while a change or compaction holds the lock."""
+
+        for read in [lambda: self.graph.is_following(1, 2),
+                     lambda: self.graph.following_count(1),
+                     lambda: self.graph.followers_count(2),
+                     lambda: self.graph.following_ids(1)]:
+            reader = threading.Thread(target=read)
+
+            with self.subTest(read=read), self.graph._lock:
+                reader.start()
+                reader.join(0.05)
+                self.assertTrue(reader.is_alive())
+
+            reader.join()
+
+    def test_follow_matrix(self):
+        self.graph.add(3, 1)
+        self.graph.remove(1, 2)
+        matrix = self.graph.follow_matrix(10)
+
+        self.assertEqual(matrix.shape, (10, 10))
+        self.assertEqual(sorted(zip(*matrix.nonzero())),
+                         [(1, 3), (2, 3), (3, 1), (4, 1)])
+        self.assertTrue(np.shares_memory(matrix.indices,
+                                         self.graph._following.indices))
+
+    def test_empty(self):
+        graph = FollowGraph([], [])
+
+        self.assertFalse(graph.is_following(1, 2))
+        self.assertEqual(list(graph.follower_ids(1)), [])
+
+
+class FollowGraphViewsTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+        u1.following.append(u2)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+        self.client = app.test_client()
+
+        reload_follow_graph()
+
+    def tearDown(self):
+        db.session.rollback()
+        followgraph._graph = None
+
+    def test_routes_keep_graph_current(self):
+        graph = followgraph.get_follow_graph()
+        self.assertTrue(graph.is_following(self.u1_id, self.u2_id))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            c.post(f'/users/follow/{self.u3_id}')
+            c.post(f'/users/stop-following/{self.u2_id}')
+
+        self.assertTrue(graph.is_following(self.u1_id, self.u3_id))
+        self.assertFalse(graph.is_following(self.u1_id, self.u2_id))
+
+    def test_load_in_chunks(self):
+        db.session.add(Follow(user_following_id=self.u3_id,
+                              user_being_followed_id=self.u1_id))
+        db.session.commit()
+
+        with db.engine.connect() as conn:
+            graph = FollowGraph.load(conn, chunk_size=1)
+
+        self.assertEqual(len(graph), 2)
+        self.assertEqual(list(graph.follower_ids(self.u1_id)), [self.u3_id])
+        self.assertEqual(list(graph.following_ids(self.u1_id)),
+                         [self.u2_id])
+
+    def test_reload_keeps_changes_made_meanwhile(self):
+        """A follow recorded while the graph reloads isn't lost."""
+
+        load = FollowGraph.load
+
+        def load_then_follow(conn):
+            graph = load(conn)
+            followgraph.record_follow(self.u3_id, self.u1_id)
+            return graph
+
+        with patch.object(FollowGraph, 'load', side_effect=load_then_follow):
+            reload_follow_graph()
+
+        graph = followgraph.get_follow_graph()
+        self.assertTrue(graph.is_following(self.u3_id, self.u1_id))
+        self.assertTrue(graph.is_following(self.u1_id, self.u2_id))
+
+    def test_follow_state_not_from_graph(self):
+        """Buttons show the viewer's follows even when the graph is stale."""
+
+        followgraph._graph = FollowGraph([self.u1_id], [self.u3_id])
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            html = c.get('/users').get_data(as_text=True)
+
+        self.assertIn(f'action="/users/stop-following/{self.u2_id}"', html)
+        self.assertIn(f'action="/users/follow/{self.u3_id}"', html)
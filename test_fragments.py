@@ -0,0 +1,122 @@
+"""Message fragment cache tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_fragments.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from fragments import fragments
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FragmentCacheTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        Follow.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        u2.following.append(u1)
+        db.session.add_all([
+            Message(text="By u1", user_id=u1.id),
+            Message(text="By u2 <b>bold</b>", user_id=u2.id),
+        ])
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.m2_id = Message.query.filter_by(user_id=u2.id).one().id
+        self.client = app.test_client()
+        fragments.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def home(self, user_id):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = user_id
+
+        resp = self.client.get('/')
+        self.assertEqual(resp.status_code, 200)
+        return resp.get_data(as_text=True)
+
+    def like_form(self, html, message_id):
+        start = html.index('<form', html.index(f'/messages/{message_id}"'))
+        return html[start:html.index('</form>', start)]
+
+    def test_shared_between_viewers(self):
+        """Viewers share cached items, each with their own overlay."""
+
+        html = self.home(self.u1_id)
+        self.assertEqual(fragments.stats()['misses'], 2)
+
+        form = self.like_form(html, self.m2_id)
+        self.assertIn(f'action="/users/like/{self.m2_id}?next=/"', form)
+        self.assertIn('class="like-button"', form)
+
+        html = self.home(self.u2_id)
+        self.assertEqual(fragments.stats()['hits'], 2)
+
+        # Their own message: disabled
+        form = self.like_form(html, self.m2_id)
+        self.assertIn('class="like-button  disabled-like"', form)
+
+    def test_like_changes_key(self):
+        """A like re-renders the item with the new count."""
+
+        self.home(self.u1_id)
+        self.client.post(f'/users/like/{self.m2_id}?next=/')
+
+        html = self.home(self.u1_id)
+        self.assertEqual(fragments.stats()['misses'], 3)
+
+        form = self.like_form(html, self.m2_id)
+        self.assertIn(f'action="/users/unlike/{self.m2_id}?next=/"', form)
+        self.assertIn('bi-heart-fill', form)
+        self.assertRegex(form, r'</button>\s+1\s*$')
+
+    def test_profile_change_changes_key(self):
+        self.home(self.u1_id)
+        User.query.get(self.u2_id).username = "renamed"
+        db.session.commit()
+
+        html = self.home(self.u1_id)
+
+        self.assertIn('@renamed', html)
+        self.assertNotIn('@u2', html)
+
+    def test_text_is_escaped(self):
+        html = self.home(self.u1_id)
+
+        self.assertIn("By u2 &lt;b&gt;bold&lt;/b&gt;", html)
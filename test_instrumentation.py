@@ -0,0 +1,117 @@
+"""Server-Timing instrumentation tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_instrumentation.py
+
+
+import json
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from instrumentation import server_timing
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+def parse_server_timing(header):
+    """{name: (duration, description)} from a Server-Timing header."""
+
+    metrics = {}
+
+    for entry in header.split(", "):
+        name, *params = entry.split(";")
+        params = dict(param.split("=", 1) for param in params)
+        metrics[name] = (float(params["dur"]),
+                         params.get("desc", "").strip('"'))
+
+    return metrics
+
+
+class InstrumentationTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.client = app.test_client()
+        self.sample_rate = app.config['TIMING_SAMPLE_RATE']
+        app.config['TIMING_SAMPLE_RATE'] = 1
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['TIMING_SAMPLE_RATE'] = self.sample_rate
+
+    def test_server_timing(self):
+        self.assertEqual(
+            server_timing([("db", 1.234, "2 queries"), ("total", 5, None)]),
+            'db;dur=1.2;desc="2 queries", total;dur=5.0')
+
+    def test_page_timing(self):
+        """A sampled page reports its queries, render time and a log line."""
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+        with self.assertLogs('warbler.timing', 'INFO') as logs:
+            resp = self.client.get(f'/users/{self.u1_id}')
+
+        self.assertEqual(resp.status_code, 200)
+        metrics = parse_server_timing(resp.headers['Server-Timing'])
+        self.assertEqual(set(metrics), {"db", "render", "hash", "total"})
+        self.assertGreater(metrics["render"][0], 0)
+        self.assertGreaterEqual(metrics["total"][0], metrics["render"][0])
+
+        queries = int(metrics["db"][1].split()[0])
+        self.assertGreater(queries, 0)
+
+        [line] = logs.records
+        line = json.loads(line.getMessage())
+        self.assertEqual(line["endpoint"], "show_user")
+        self.assertEqual(line["status"], 200)
+        self.assertEqual(line["queries"], queries)
+
+    def test_login_times_hashing(self):
+        with self.assertLogs('warbler.timing', 'INFO'):
+            resp = self.client.post('/login', data={
+                "username": "u1", "password": "password"})
+
+        self.assertEqual(resp.status_code, 302)
+        metrics = parse_server_timing(resp.headers['Server-Timing'])
+        self.assertGreater(metrics["hash"][0], 0)
+        self.assertEqual(metrics["render"][0], 0)
+
+    def test_unsampled(self):
+        """Requests outside the sample get no header."""
+
+        app.config['TIMING_SAMPLE_RATE'] = 0
+
+        resp = self.client.get('/')
+
+        self.assertNotIn('Server-Timing', resp.headers)
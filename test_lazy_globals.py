@@ -0,0 +1,128 @@
+"""Lazy request globals tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_lazy_globals.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from caching import current_users
+from lazy_globals import lazy_stats
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class LazyGlobalsTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.client = app.test_client()
+        current_users.clear()
+        lazy_stats.clear()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def login(self, c):
+        with c.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.u1_id
+
+    def test_redirect_skips_csrf_form(self):
+        """An anonymous redirect reads g.user but never builds a form."""
+
+        with patch('app.CSRFForm') as form:
+            resp = self.client.get('/users')
+
+        self.assertEqual(resp.status_code, 302)
+        form.assert_not_called()
+        self.assertEqual(lazy_stats.saved()['list_users'],
+                         {'user': 0, 'csrf_form': 1})
+
+    def test_page_computes_each_global_once(self):
+        with self.client as c:
+            self.login(c)
+
+            with patch('app.CSRFForm') as form:
+                resp = c.get(f'/users/{self.u1_id}')
+
+        self.assertEqual(resp.status_code, 200)
+        form.assert_called_once()
+        self.assertEqual(current_users.misses, 1)
+
+    def test_lightweight_endpoint_skips_everything(self):
+        """Static files don't look the user up or build a form."""
+
+        with self.client as c:
+            self.login(c)
+
+            with patch('app.get_current_user') as get_user, \
+                    patch('app.CSRFForm') as form:
+                resp = c.get('/static/favicon.ico')
+                resp.close()
+
+        self.assertEqual(resp.status_code, 200)
+        get_user.assert_not_called()
+        form.assert_not_called()
+        self.assertEqual(lazy_stats.saved()['static'],
+                         {'user': 1, 'csrf_form': 1})
+
+    def test_globals_reset_between_requests(self):
+        """A logged-out request doesn't see the previous request's user."""
+
+        with self.client as c:
+            self.login(c)
+            self.assertEqual(c.get(f'/users/{self.u1_id}').status_code, 200)
+
+            with c.session_transaction() as sess:
+                del sess[CURR_USER_KEY]
+
+            self.assertEqual(c.get(f'/users/{self.u1_id}').status_code, 302)
+
+    def test_csrf_token_not_shared(self):
+        """Flask-WTF's token cached on `g` doesn't reach another session."""
+
+        app.config['WTF_CSRF_ENABLED'] = True
+
+        try:
+            tokens = []
+            for client in [app.test_client(), app.test_client()]:
+                self.login(client)
+                client.get(f'/users/{self.u1_id}')
+                with client.session_transaction() as sess:
+                    tokens.append(sess.get('csrf_token'))
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = False
+
+        self.assertIsNotNone(tokens[1])
+        self.assertNotEqual(tokens[0], tokens[1])
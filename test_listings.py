@@ -0,0 +1,147 @@
+"""Paginated following/followers/likes page tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_listings.py
+
+
+import os
+import re
+from functools import partial
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Like, Follow
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from listings import followers_page, following_page, likes_page
+from pagination import decode_cursor
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class ListingTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        hub = User(username="hub", email="hub@email.com", password="x")
+        others = [User(username=f"o{i}", email=f"o{i}@email.com",
+                       password="x")
+                  for i in range(5)]
+        db.session.add_all([hub, *others])
+        db.session.flush()
+
+        for other in others:
+            db.session.add(Follow(user_following_id=hub.id,
+                                  user_being_followed_id=other.id))
+            db.session.add(Follow(user_following_id=other.id,
+                                  user_being_followed_id=hub.id))
+
+        messages = [Message(text=f"m{i}", user_id=others[i].id)
+                    for i in range(5)]
+        db.session.add_all(messages)
+        db.session.flush()
+        db.session.add_all([Like(user_id=hub.id, message_id=msg.id)
+                            for msg in messages])
+        db.session.commit()
+
+        self.hub_id = hub.id
+        self.other_ids = [other.id for other in others]
+        self.message_ids = [msg.id for msg in messages]
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        Like.query.delete()
+        db.session.commit()
+
+    def walk(self, fetch, *types):
+        """Collect every row by following cursors two rows at a time."""
+
+        rows, cursor = fetch(self.hub_id, limit=2)
+        seen = list(rows)
+
+        while cursor:
+            rows, cursor = fetch(self.hub_id,
+                                 decode_cursor(cursor, *types), limit=2)
+            seen.extend(rows)
+
+        return seen
+
+    def test_following_pages(self):
+        cards = self.walk(following_page, int)
+
+        self.assertEqual([card.id for card in cards], self.other_ids)
+        self.assertEqual(set(cards[0]._fields),
+                         {'id', 'username', 'image_url', 'header_image_url',
+                          'bio'})
+
+    def test_followers_pages(self):
+        cards = self.walk(followers_page, int)
+
+        self.assertEqual([card.id for card in cards], self.other_ids)
+
+    def test_likes_pages(self):
+        messages = self.walk(likes_page, int)
+
+        self.assertEqual([msg.id for msg in messages],
+                         self.message_ids[::-1])
+        self.assertEqual(messages[-1].author_username, "o0")
+
+    def test_following_view(self):
+        """A short list fits on one page, with no "Load more" link."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.hub_id
+
+            resp = c.get(f"/users/{self.hub_id}/following")
+            html = resp.get_data(as_text=True)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@o4", html)
+        self.assertNotIn('id="load-more"', html)
+
+    def test_likes_view_load_older(self):
+        """The "Load older" link leads to the next page of likes."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.hub_id
+
+            with patch('app.likes_page', partial(likes_page, limit=2)):
+                html = c.get(f"/users/{self.hub_id}/likes").get_data(
+                    as_text=True)
+                self.assertIn("m4", html)
+                self.assertNotIn("m2", html)
+
+                next_url = re.search(
+                    r'href="([^"]+)"[^>]*id="load-older"', html).group(1)
+                html = c.get(next_url.replace("&amp;", "&")).get_data(
+                    as_text=True)
+
+        self.assertIn("m2", html)
+        self.assertIn("@o2", html)
+        self.assertNotIn("m4", html)
+
@@ -20,6 +20,7 @@ os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
 # Now we can import app
 
 from app import app, CURR_USER_KEY
+from instrumentation import count_queries
 
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
 
@@ -149,6 +150,21 @@ class MessageAddViewTestCase(MessageBaseViewTestCase):
             self.assertIn("@u1", html)
             self.assertIn('id="warbler-hero"', html)
 
+    def test_add_message_skips_message_list(self):
+        """Posting a message doesn't load the author's other messages."""
+        with self.client as c:
+
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            db.session.expire_all()
+            with count_queries(db.engine) as statements:
+                resp = c.post("/messages/new", data={"text": "Hello"})
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertFalse([s for s in statements
+                          if s.lstrip().startswith("SELECT messages.")])
+
     def test_invalid_add_message(self):
         """Test adding a message while logged out."""
         with self.client as c:
@@ -277,3 +293,48 @@ class MessageLikeTestCase(MessageBaseViewTestCase):
 
             html = resp.get_data(as_text=True)
             self.assertIn('Access unauthorized.', html)
+
+
+class MessageFeedQueryCountTestCase(MessageBaseViewTestCase):
+    def add_feed(self, count):
+        """Add `count` liked messages by followed authors to u1's feed."""
+
+        u1 = User.query.get(self.u1_id)
+        n = len(u1.following)
+
+        for i in range(count):
+            author = User(username=f"author{n + i}",
+                          email=f"author{n + i}@email.com",
+                          password="password")
+            u1.following.append(author)
+            msg = Message(text=f"feed-{n + i}", user=author)
+            db.session.add(msg)
+            author.liked_messages.add(Message.query.get(self.m2_id))
+            User.query.get(self.u2_id).liked_messages.add(msg)
+
+        db.session.commit()
+
+    def queries_for(self, url):
+        """Count the SQL statements run while GETting `url`."""
+
+        db.session.expire_all()
+        with count_queries(db.engine) as statements:
+            resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+        return len(statements)
+
+    def test_feed_query_count_is_fixed(self):
+        """Like state and authors load in a fixed number of queries."""
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            self.add_feed(3)
+            small = self.queries_for("/")
+
+            self.add_feed(30)
+            large = self.queries_for("/")
+
+            self.assertEqual(small, large)
@@ -0,0 +1,101 @@
+"""Schema migration tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_migrations.py
+
+
+import os
+from unittest import TestCase
+
+from sqlalchemy import text
+
+from models import db, User, Message, Like, SchemaMigration
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app
+from migrations import MIGRATIONS, migrate, stamp_migrations
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class MigrationTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+        SchemaMigration.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        u1.following.append(u2)
+        db.session.add(Message(text="hello", user_id=u2.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def index_is_valid(self, name):
+        return db.session.scalar(text("""
+            SELECT indisvalid
+            FROM pg_index JOIN pg_class ON pg_class.oid = pg_index.indexrelid
+            WHERE pg_class.relname = :name
+        """), {'name': name})
+
+    def test_stamp(self):
+        stamp_migrations()
+
+        self.assertEqual(SchemaMigration.query.count(), len(MIGRATIONS))
+        self.assertEqual(migrate(), [])
+
+    def test_migrate_old_schema(self):
+        """An index and columns missing from an older database are added."""
+
+        db.session.execute(text("DROP INDEX ix_likes_message"))
+        db.session.execute(text("ALTER TABLE users DROP COLUMN likes_count"))
+        db.session.commit()
+
+        applied = migrate()
+
+        self.assertEqual(applied, [step.version for step in MIGRATIONS])
+        self.assertTrue(self.index_is_valid('ix_likes_message'))
+
+        db.session.expire_all()
+        u1 = db.session.get(User, self.u1_id)
+        self.assertEqual(u1.likes_count, 0)
+        self.assertEqual(u1.following_count, 1)
+        self.assertEqual(migrate(), [])
+
+    def test_rebuilds_invalid_index(self):
+        """An index left INVALID by an interrupted build is rebuilt."""
+
+        db.session.execute(text("""
+            UPDATE pg_index SET indisvalid = false
+            WHERE indexrelid = 'ix_likes_message'::regclass
+        """))
+        db.session.commit()
+
+        migrate()
+
+        self.assertTrue(self.index_is_valid('ix_likes_message'))
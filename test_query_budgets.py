@@ -0,0 +1,219 @@
+"""Query budget tests: how many SQL statements each route may run."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_query_budgets.py
+
+
+import os
+from contextlib import contextmanager
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from caching import current_users
+from counters import reconcile_counters
+from instrumentation import count_queries
+from recommendations import rebuild_recommendations
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+OTHER_USERS = 40
+FOLLOWED = 30
+MESSAGES_EACH = 5
+
+# (endpoint, method, url, form data, logged in, budget), run in this order
+# against one fixture. URLs are filled in from QueryBudgetTestCase.ids.
+# Budgets are for a cold current-user cache; every route must have one.
+ROUTES = [
+    ('homepage', 'GET', '/', None, False, 0),
+    ('signup', 'GET', '/signup', None, False, 0),
+    ('login', 'GET', '/login', None, False, 0),
+    ('page_not_found', 'GET', '/nowhere', None, False, 0),
+
+    ('homepage', 'GET', '/', None, True, 7),
+    ('list_users', 'GET', '/users', None, True, 3),
+    ('list_users', 'GET', '/users?q=user', None, True, 3),
+    ('show_user', 'GET', '/users/{other}', None, True, 5),
+    ('show_following', 'GET', '/users/{me}/following', None, True, 3),
+    ('show_followers', 'GET', '/users/{me}/followers', None, True, 3),
+    ('show_likes', 'GET', '/users/{me}/likes', None, True, 3),
+    ('show_message', 'GET', '/messages/{liked}', None, True, 5),
+    ('add_message', 'GET', '/messages/new', None, True, 1),
+    ('update_profile', 'GET', '/users/profile', None, True, 1),
+
+    ('api.feed', 'GET', '/api/v1/feed', None, True, 6),
+    ('api.user_profile', 'GET', '/api/v1/users/{other}', None, True, 3),
+    ('api.user_messages', 'GET', '/api/v1/users/{other}/messages', None,
+     True, 5),
+    ('api.user_following', 'GET', '/api/v1/users/{me}/following', None,
+     True, 3),
+    ('api.user_followers', 'GET', '/api/v1/users/{me}/followers', None,
+     True, 3),
+    ('api.message', 'GET', '/api/v1/messages/{liked}', None, True, 4),
+    ('api.messages_by_id', 'GET', '/api/v1/messages?ids={liked},{mine}',
+     None, True, 4),
+
+    ('start_following', 'POST', '/users/follow/{stranger}', None, True, 12),
+    ('stop_following', 'POST', '/users/stop-following/{other}', None, True,
+     9),
+    ('like_message', 'POST', '/users/like/{unliked}?next=/', None, True, 6),
+    ('unlike_message', 'POST', '/users/unlike/{liked}?next=/', None, True,
+     6),
+    ('add_message', 'POST', '/messages/new', {"text": "Budgeted"}, True, 6),
+    ('delete_message', 'POST', '/messages/{mine}/delete', None, True, 8),
+    ('update_profile', 'POST', '/users/profile', {
+        "username": "u1", "email": "u1@email.com", "password": "password",
+        "bio": "Counting queries"}, True, 4),
+    ('logout', 'POST', '/logout', None, True, 1),
+    ('login', 'POST', '/login', {
+        "username": "u1", "password": "password"}, False, 2),
+    ('signup', 'POST', '/signup', {
+        "username": "newcomer", "email": "newcomer@email.com",
+        "password": "password"}, False, 4),
+    ('delete_user', 'POST', '/users/delete', None, True, 15),
+]
+
+# The listing routes again with STREAM_LISTINGS on, which reads their rows
+# through a server-side cursor while the template streams
+STREAMED_ROUTES = [
+    ('list_users', 'GET', '/users', None, True, 3),
+    ('show_following', 'GET', '/users/{me}/following', None, True, 3),
+    ('show_followers', 'GET', '/users/{me}/followers', None, True, 3),
+]
+
+UNBUDGETED_ENDPOINTS = {'static', 'asset'}
+
+
+class QueryBudgetTestCase(TestCase):
+    """Routes against a fixture big enough for per-row queries to show.
+
+    The viewer follows FOLLOWED of OTHER_USERS users and is followed by as
+    many; everyone has MESSAGES_EACH messages, and the viewer has liked
+    most of their timeline.
+    """
+
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        Follow.query.delete()
+        User.query.delete()
+
+        me = User.signup("u1", "u1@email.com", "password", None)
+        others = [User(username=f"user{n}", email=f"user{n}@email.com",
+                       password=me.password)
+                  for n in range(OTHER_USERS)]
+        db.session.add_all(others)
+        db.session.flush()
+
+        db.session.add_all(
+            [Follow(user_being_followed_id=user.id, user_following_id=me.id)
+             for user in others[:FOLLOWED]] +
+            [Follow(user_being_followed_id=me.id, user_following_id=user.id)
+             for user in others[-FOLLOWED:]])
+        db.session.flush()
+
+        messages = [Message(text=f"Message {n} by {user.username}",
+                            user_id=user.id)
+                    for user in [me] + others for n in range(MESSAGES_EACH)]
+        db.session.add_all(messages)
+        db.session.flush()
+
+        mine = [m for m in messages if m.user_id == me.id]
+        followed = {user.id for user in others[:FOLLOWED]}
+        theirs = [m for m in messages if m.user_id in followed]
+        db.session.add_all(
+            [Like(user_id=me.id, message_id=m.id) for m in theirs[1:]] +
+            [Like(user_id=user.id, message_id=m.id)
+             for user in others for m in mine])
+        db.session.commit()
+
+        reconcile_counters()
+        rebuild_recommendations()
+
+        self.ids = {
+            "me": me.id,
+            "other": others[0].id,
+            "stranger": others[FOLLOWED].id,
+            "liked": theirs[1].id,
+            "unliked": theirs[0].id,
+            "mine": mine[0].id,
+        }
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    @contextmanager
+    def assertQueryBudget(self, budget):
+        """Fail if the block runs more than `budget` SQL statements.
+
+        The current-user cache is emptied first, so the count includes
+        loading the logged-in user.
+        """
+
+        current_users.clear()
+
+        with count_queries(db.engine) as statements:
+            yield statements
+
+        if len(statements) > budget:
+            self.fail(f"{len(statements)} queries, over the budget of "
+                      f"{budget}:\n\n" + "\n\n".join(statements))
+
+    def test_every_route_has_a_budget(self):
+        endpoints = {rule.endpoint for rule in app.url_map.iter_rules()
+                     if not rule.endpoint.startswith('_debug_toolbar')}
+        budgeted = {endpoint for endpoint, *rest in ROUTES}
+
+        self.assertEqual(endpoints - UNBUDGETED_ENDPOINTS - budgeted, set())
+
+    def check_budgets(self, routes):
+        for endpoint, method, url, data, logged_in, budget in routes:
+            url = url.format(**self.ids)
+
+            with self.subTest(endpoint=endpoint, method=method, url=url):
+                with self.client.session_transaction() as sess:
+                    if logged_in:
+                        sess[CURR_USER_KEY] = self.ids["me"]
+                    else:
+                        sess.pop(CURR_USER_KEY, None)
+
+                # Read the body inside the block, so a streamed response's
+                # queries are counted too
+                with self.assertQueryBudget(budget):
+                    resp = self.client.open(url, method=method, data=data)
+                    resp.get_data()
+
+                self.assertLess(resp.status_code, 500)
+
+    def test_query_budgets(self):
+        self.check_budgets(ROUTES)
+
+    def test_streamed_query_budgets(self):
+        app.config['STREAM_LISTINGS'] = True
+
+        try:
+            self.check_budgets(STREAMED_ROUTES)
+        finally:
+            app.config['STREAM_LISTINGS'] = False
@@ -0,0 +1,103 @@
+"""Query plan checks for the busiest pages."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_query_plans.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from query_plans import check_query_plans, full_scans
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class QueryPlanTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        db.session.flush()
+        u1.following.append(u2)
+        msg = Message(text="hello", user_id=u2.id)
+        db.session.add(msg)
+        db.session.flush()
+        db.session.add(Like(user_id=u1.id, message_id=msg.id))
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.msg_id = msg.id
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def test_full_scans(self):
+        plan = {
+            'Node Type': 'Nested Loop',
+            'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'likes'},
+                {'Node Type': 'Index Scan', 'Relation Name': 'messages',
+                 'Index Cond': '(id = likes.message_id)'},
+                {'Node Type': 'Index Scan', 'Relation Name': 'users'},
+                {'Node Type': 'Limit', 'Plans': [
+                    {'Node Type': 'Index Scan', 'Relation Name': 'follows'},
+                ]},
+            ],
+        }
+
+        self.assertEqual(full_scans(plan), ['likes', 'users'])
+
+    def check(self):
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            return check_query_plans(
+                c, db.session.get(User, self.u1_id),
+                db.session.get(Message, self.msg_id), force_indexes=True)
+
+    def test_hot_pages_use_indexes(self):
+        self.assertEqual(self.check(), [])
+
+    def test_missing_index_reported(self):
+        """Profiles read all messages without ix_messages_user_timestamp."""
+
+        index = next(index for index in Message.__table__.indexes
+                     if index.name == 'ix_messages_user_timestamp')
+        index.drop(db.session.connection())
+        db.session.commit()
+        try:
+            problems = self.check()
+        finally:
+            index.create(db.session.connection())
+            db.session.commit()
+
+        self.assertIn((f"/users/{self.u1_id}", 'messages'),
+                      [(problem.url, problem.table) for problem in problems])
@@ -0,0 +1,180 @@
+"""Rate limiting tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_ratelimit.py
+
+
+import os
+from unittest import TestCase
+from unittest.mock import patch
+
+from models import db, User, Message, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app
+from ratelimit import (
+    MemoryBackend, RateLimitBackend, RateLimiter, login_ip_limiter,
+    login_username_limiter, trust_proxies, LOGIN_IP_BURST,
+    LOGIN_USERNAME_BURST)
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimiterTestCase(TestCase):
+    def test_burst_then_refill(self):
+        clock = FakeClock()
+        limiter = RateLimiter('test', capacity=2, rate=0.5, clock=clock)
+
+        self.assertEqual(limiter.take('a'), 0)
+        self.assertEqual(limiter.take('a'), 0)
+        self.assertEqual(limiter.take('a'), 2)
+
+        clock.now = 2
+        self.assertEqual(limiter.take('a'), 0)
+        self.assertGreater(limiter.take('a'), 0)
+
+    def test_keys_are_independent(self):
+        limiter = RateLimiter('test', capacity=1, rate=0.1)
+
+        self.assertEqual(limiter.take('a'), 0)
+        self.assertGreater(limiter.take('a'), 0)
+        self.assertEqual(limiter.take('b'), 0)
+
+    def test_emptied_buckets_not_evicted(self):
+        """Flooding with new keys doesn't refill an emptied bucket."""
+
+        clock = FakeClock()
+        limiter = RateLimiter('test', capacity=2, rate=0.5,
+                              backend=MemoryBackend(maxsize=3), clock=clock)
+
+        limiter.take('target')
+        limiter.take('target')
+        for n in range(10):
+            limiter.take(f'throwaway{n}')
+
+        self.assertGreater(limiter.take('target'), 0)
+
+        # Once refilled, old buckets make way again
+        clock.now = 10
+        limiter.take('new')
+        self.assertEqual(len(limiter.backend._buckets), 3)
+
+    def test_incomplete_backend(self):
+        """A backend missing part of its interface can't be created."""
+
+        class TakeOnly(RateLimitBackend):
+            def take(self, key, capacity, rate, now):
+                return 0
+
+        with self.assertRaises(TypeError):
+            TakeOnly()
+
+
+class LoginThrottleTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        User.signup("u1", "u1@email.com", "password", None)
+        db.session.commit()
+
+        login_ip_limiter.backend.clear()
+        login_username_limiter.backend.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+        login_ip_limiter.backend.clear()
+        login_username_limiter.backend.clear()
+
+    def attempt(self, username, address='10.0.0.1'):
+        return self.client.post(
+            '/login',
+            data={"username": username, "password": "wrong-password"},
+            environ_base={'REMOTE_ADDR': address},
+        )
+
+    def test_throttled_by_username(self):
+        """Guesses at one username from many addresses are throttled."""
+
+        for i in range(LOGIN_USERNAME_BURST):
+            self.assertEqual(self.attempt("u1", f"10.0.0.{i}").status_code,
+                             200)
+
+        with patch('app.User.authenticate') as authenticate:
+            resp = self.attempt("U1", "10.0.1.1")
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertIn("Too many login attempts", resp.get_data(as_text=True))
+        self.assertGreater(int(resp.headers['Retry-After']), 0)
+        authenticate.assert_not_called()
+
+    def test_throttled_by_address(self):
+        """Guesses at many usernames from one address are throttled."""
+
+        for i in range(LOGIN_IP_BURST):
+            self.assertEqual(self.attempt(f"user{i}").status_code, 200)
+
+        with patch('app.User.authenticate') as authenticate:
+            resp = self.attempt("u1")
+
+        self.assertEqual(resp.status_code, 429)
+        authenticate.assert_not_called()
+
+        # The refused attempt didn't spend u1's tokens
+        self.assertEqual(self.attempt("u1", "10.0.1.1").status_code, 200)
+
+    def test_behind_proxy(self):
+        """Behind a trusted proxy, clients are told apart by the address it
+        forwards, not the proxy's own."""
+
+        wsgi_app = app.wsgi_app
+        app.config['TRUSTED_PROXIES'] = 1
+        trust_proxies(app)
+
+        def attempt(username, client):
+            return self.client.post(
+                '/login',
+                data={"username": username, "password": "wrong-password"},
+                headers={'X-Forwarded-For': client},
+                environ_base={'REMOTE_ADDR': '10.0.0.1'},
+            )
+
+        try:
+            for i in range(LOGIN_IP_BURST):
+                self.assertEqual(
+                    attempt(f"user{i}", '192.0.2.1').status_code, 200)
+
+            self.assertEqual(attempt("u1", '192.0.2.1').status_code, 429)
+            self.assertEqual(attempt("u1", '192.0.2.2').status_code, 200)
+        finally:
+            app.wsgi_app = wsgi_app
+            app.config['TRUSTED_PROXIES'] = 0
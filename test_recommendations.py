@@ -0,0 +1,142 @@
+"""Who-to-follow recommendation tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_recommendations.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Like, Recommendation, StaleRecommendation
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+import followgraph
+from instrumentation import count_queries
+from recommendations import (
+    rebuild_recommendations, refresh_recommendations, who_to_follow)
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class RecommendationTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        users = [User.signup(f"u{i}", f"u{i}@email.com", "password", None)
+                 for i in range(6)]
+        db.session.flush()
+        u0, u1, u2, u3, u4, u5 = users
+
+        # u0 follows u1 and u2; both follow u3, only u1 follows u4;
+        # u2 follows u0 back.
+        u0.following.extend([u1, u2])
+        u1.following.extend([u3, u4])
+        u2.following.extend([u3, u0])
+        db.session.commit()
+
+        self.ids = [user.id for user in users]
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def recommended(self, index):
+        return [self.ids.index(user.id)
+                for user in who_to_follow(User.query.get(self.ids[index]))]
+
+    def test_rebuild_ranks_friends_of_friends(self):
+        """Candidates reached through more follows rank first."""
+
+        rebuild_recommendations(batch_size=2)
+
+        self.assertEqual(self.recommended(0), [3, 4])
+        self.assertEqual(self.recommended(2), [1])
+        self.assertEqual(self.recommended(5), [])
+        self.assertEqual(StaleRecommendation.query.count(), 0)
+
+    def test_rebuild_from_follow_graph(self):
+        """With a follow graph loaded, batches don't re-read `follows`."""
+
+        followgraph.reload_follow_graph()
+
+        try:
+            with count_queries(db.engine) as statements:
+                rebuild_recommendations(batch_size=2)
+        finally:
+            followgraph._graph = None
+
+        self.assertEqual(self.recommended(0), [3, 4])
+        self.assertEqual(self.recommended(2), [1])
+        self.assertFalse([s for s in statements if 'follows' in s])
+
+    def test_follow_queues_refresh(self):
+        """Changing follows queues the follower; refresh recomputes them."""
+
+        rebuild_recommendations()
+        u5 = User.query.get(self.ids[5])
+        u5.following.append(User.query.get(self.ids[1]))
+        db.session.commit()
+
+        self.assertEqual([s.user_id for s in StaleRecommendation.query],
+                         [self.ids[5]])
+        self.assertEqual(refresh_recommendations(), 1)
+        self.assertEqual(self.recommended(5), [3, 4])
+        self.assertEqual(StaleRecommendation.query.count(), 0)
+
+    def test_follow_queues_followers(self):
+        """Followers of someone whose follows changed are queued too."""
+
+        rebuild_recommendations()
+        u1 = User.query.get(self.ids[1])
+        u1.following.append(User.query.get(self.ids[5]))
+        db.session.commit()
+
+        self.assertEqual(
+            sorted(s.user_id for s in StaleRecommendation.query),
+            [self.ids[0], self.ids[1]])
+        self.assertEqual(refresh_recommendations(), 2)
+        self.assertEqual(self.recommended(0), [3, 4, 5])
+
+    def test_followed_candidates_hidden_before_refresh(self):
+        rebuild_recommendations()
+        u0 = User.query.get(self.ids[0])
+        u0.following.append(User.query.get(self.ids[3]))
+        db.session.commit()
+
+        self.assertEqual(self.recommended(0), [4])
+
+    def test_homepage_who_to_follow(self):
+        rebuild_recommendations()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.ids[0]
+
+            html = c.get("/").get_data(as_text=True)
+
+        self.assertIn('id="who-to-follow"', html)
+        self.assertIn(f'action="/users/follow/{self.ids[4]}"', html)
+        self.assertEqual(Recommendation.query.filter_by(
+            user_id=self.ids[0]).count(), 2)
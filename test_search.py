@@ -0,0 +1,163 @@
+"""Username search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+import os
+import re
+from html import unescape
+from unittest import TestCase
+
+from models import db, User, Message, Like, UsernameTrigram
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from pagination import decode_cursor, encode_cursor
+from search import (
+    CONTAINS_TIER, PREFIX_TIER, SEARCH_PAGE_SIZE, browse_users,
+    decode_search_cursor, rebuild_search_index, search_users)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+class SearchTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        for username in ["bob", "Bobby", "bob_smith", "jimbob", "ab_bob",
+                         "alice", "bo%b"]:
+            db.session.add(User(username=username,
+                                email=f"{username}@email.com",
+                                password="password"))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.rollback()
+
+    def search_all(self, query, limit):
+        """Follow cursors to collect every result for `query`."""
+
+        users, cursor = search_users(query, limit=limit)
+        results = [u.username for u in users]
+
+        while cursor:
+            users, cursor = search_users(
+                query, decode_search_cursor(cursor), limit=limit)
+            results += [u.username for u in users]
+
+        return results
+
+    def test_ranking(self):
+        """Exact match, then prefixes, then substrings shortest-first."""
+
+        self.assertEqual(self.search_all("BOB", 30),
+                         ["bob", "bob_smith", "Bobby", "jimbob", "ab_bob"])
+
+    def test_cursor_pages(self):
+        """Small pages walk the same results without repeats or gaps."""
+
+        for limit in (1, 2, 3):
+            self.assertEqual(self.search_all("bob", limit),
+                             self.search_all("bob", 30))
+
+    def test_short_query_prefix_only(self):
+        """Queries under three characters only match by prefix."""
+
+        self.assertEqual(self.search_all("bo", 30),
+                         ["bo%b", "bob", "bob_smith", "Bobby"])
+
+    def test_wildcards_are_literal(self):
+        """LIKE wildcards in the query match themselves."""
+
+        self.assertEqual(self.search_all("b_s", 30), ["bob_smith"])
+        self.assertEqual(self.search_all("bo%", 30), ["bo%b"])
+
+    def test_rename_reindexes(self):
+        """Renaming a user updates their trigrams."""
+
+        user = User.query.filter_by(username="alice").one()
+        user.username = "carol"
+        db.session.commit()
+
+        self.assertEqual(self.search_all("lic", 30), [])
+        self.assertEqual(self.search_all("aro", 30), ["carol"])
+
+    def test_rebuild_search_index(self):
+        """Rebuilding the index gives the same results."""
+
+        before = self.search_all("bob", 30)
+        UsernameTrigram.query.delete()
+        rebuild_search_index(batch_size=1)
+
+        self.assertEqual(self.search_all("bob", 30), before)
+
+    def test_browse_users(self):
+        """Browsing with no query pages through every user."""
+
+        users, cursor = browse_users(limit=4)
+        self.assertEqual(len(users), 4)
+
+        more, cursor = browse_users(decode_cursor(cursor, int), limit=4)
+        self.assertEqual(len(more), 3)
+        self.assertIsNone(cursor)
+
+    def test_separator_in_username(self):
+        """A "Load more" link works when the page ends on a username with
+        characters a cursor could use as separators."""
+
+        for n in range(SEARCH_PAGE_SIZE + 5):
+            db.session.add(User(username=f"ab|{n:02}",
+                                email=f"ab{n}@email.com",
+                                password="password"))
+        db.session.commit()
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = User.query.first().id
+
+        resp = client.get('/users', query_string={"q": "ab|"})
+        self.assertIn('@ab|29', resp.get_data(as_text=True))
+        [link] = re.findall(r'href="([^"]*after=[^"]*)"',
+                            resp.get_data(as_text=True))
+
+        resp = client.get(unescape(link))
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn('@ab|34', resp.get_data(as_text=True))
+        self.assertNotIn('@ab|29', resp.get_data(as_text=True))
+
+    def test_bad_cursors(self):
+        """Cursors crafted with an unknown tier or a non-numeric length
+        are rejected with a 400."""
+
+        client = app.test_client()
+        with client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = User.query.first().id
+
+        for cursor in [encode_cursor(CONTAINS_TIER, "abc", 0),
+                       encode_cursor(7, "x", 1)]:
+            with self.subTest(cursor=cursor):
+                resp = client.get('/users', query_string={
+                    "q": "alice", "after": cursor})
+                self.assertEqual(resp.status_code, 400)
+
+        resp = client.get('/users', query_string={
+            "q": "alice", "after": encode_cursor(PREFIX_TIER, "abc", 0)})
+        self.assertEqual(resp.status_code, 200)
@@ -0,0 +1,131 @@
+"""Streamed listing page tests."""
+
+# run these tests like:
+#
+#    FLASK_DEBUG=False python -m unittest test_streaming.py
+
+
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Follow, Like
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app, CURR_USER_KEY
+from instrumentation import count_queries
+from listings import following_cards
+from pagination import encode_cursor
+from streaming import StreamedCards
+
+app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
+app.config['DEBUG_TB_HOSTS'] = ['dont-show-debug-toolbar']
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+app.config['WTF_CSRF_ENABLED'] = False
+
+
+class StreamingTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        Follow.query.delete()
+        User.query.delete()
+
+        users = [User.signup(f"u{n}", f"u{n}@email.com", "password", None)
+                 for n in range(7)]
+        db.session.flush()
+
+        # u0 follows u1-u5, and u1 follows u2 and u4
+        users[0].following.extend(users[1:6])
+        users[1].following.extend([users[2], users[4]])
+        users[6].following.append(users[0])
+        db.session.commit()
+
+        self.ids = [user.id for user in users]
+        self.client = app.test_client()
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.ids[1]
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config['STREAM_LISTINGS'] = False
+
+    def get(self, url, stream):
+        app.config['STREAM_LISTINGS'] = stream
+        return self.client.get(url)
+
+    def test_same_pages(self):
+        """Streamed pages are the same as rendered ones."""
+
+        for url in ['/users', f'/users/{self.ids[0]}/following',
+                    f'/users/{self.ids[0]}/followers',
+                    f'/users/{self.ids[6]}/followers']:
+            with self.subTest(url=url):
+                rendered = self.get(url, stream=False)
+                streamed = self.get(url, stream=True)
+
+                # Streamed responses can't know their length up front
+                self.assertIsNotNone(rendered.content_length)
+                self.assertIsNone(streamed.content_length)
+                self.assertEqual(streamed.status_code, 200)
+                self.assertEqual(streamed.get_data(as_text=True),
+                                 rendered.get_data(as_text=True))
+                self.assertIn('no-store', streamed.headers['Cache-Control'])
+
+    def test_search_not_streamed(self):
+        resp = self.get('/users?q=u', stream=True)
+
+        self.assertIsNotNone(resp.content_length)
+        self.assertIn('@u6', resp.get_data(as_text=True))
+
+    def test_chunks(self):
+        """Cards come a chunk at a time, each with its follow state."""
+
+        viewer = db.session.get(User, self.ids[1])
+        cards = StreamedCards(following_cards(self.ids[0]), viewer,
+                              limit=4, chunk_size=2)
+
+        with count_queries(db.engine) as statements:
+            self.assertTrue(cards)
+            follows = [(card.id, cards.follows(card)) for card in cards]
+
+        self.assertEqual(follows, [(self.ids[1], False),
+                                   (self.ids[2], True),
+                                   (self.ids[3], False),
+                                   (self.ids[4], True)])
+        self.assertEqual(cards.next_cursor, encode_cursor(self.ids[4]))
+
+        # The cards query, then the follow state for each of two chunks
+        self.assertEqual(len(statements), 3)
+
+    def test_last_page(self):
+        viewer = db.session.get(User, self.ids[1])
+        cards = StreamedCards(
+            following_cards(self.ids[0], (self.ids[1],)), viewer,
+            limit=4, chunk_size=3)
+
+        self.assertEqual([card.id for card in cards], self.ids[2:6])
+        self.assertIsNone(cards.next_cursor)
+        self.assertFalse(cards.cursor_after)
+
+    def test_empty(self):
+        viewer = db.session.get(User, self.ids[1])
+        cards = StreamedCards(following_cards(self.ids[5]), viewer)
+
+        self.assertFalse(cards)
+        self.assertEqual(list(cards), [])
@@ -0,0 +1,239 @@
+"""Materialized timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timelines.py
+
+
+import os
+from datetime import datetime, timedelta
+from unittest import TestCase
+
+from models import db, User, Message, Like, TimelineEntry
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler_test"
+
+# Now we can import app
+
+from app import app
+from pagination import decode_cursor
+from timelines import (
+    TIMELINE_BACKFILL_SIZE, home_timeline, rebuild_timelines, trim_timelines)
+
+# Create our tables (we do this here, so we only create the tables
+# once for all tests --- in each test, we'll delete the data
+# and create fresh new clean test data
+
+db.drop_all()
+db.create_all()
+
+
+class TimelineTestCase(TestCase):
+    def setUp(self):
+        Like.query.delete()
+        Message.query.delete()
+        User.query.delete()
+
+        u1 = User.signup("u1", "u1@email.com", "password", None)
+        u2 = User.signup("u2", "u2@email.com", "password", None)
+        u3 = User.signup("u3", "u3@email.com", "password", None)
+        db.session.flush()
+
+        u1.following.append(u2)
+        db.session.commit()
+
+        self.u1_id = u1.id
+        self.u2_id = u2.id
+        self.u3_id = u3.id
+
+    def tearDown(self):
+        db.session.rollback()
+        app.config.pop('TIMELINE_FANOUT_LIMIT', None)
+
+    def timeline_ids(self, user_id):
+        return {e.message_id for e in
+                TimelineEntry.query.filter_by(user_id=user_id)}
+
+    def test_fan_out_on_post(self):
+        """New messages land in the author's and followers' timelines."""
+
+        m = Message(text="hello", user_id=self.u2_id)
+        db.session.add(m)
+        db.session.commit()
+
+        self.assertIn(m.id, self.timeline_ids(self.u1_id))
+        self.assertIn(m.id, self.timeline_ids(self.u2_id))
+        self.assertNotIn(m.id, self.timeline_ids(self.u3_id))
+
+    def test_follow_backfills_and_unfollow_prunes(self):
+        """Following copies recent messages in; unfollowing removes them."""
+
+        m = Message(text="hello", user_id=self.u3_id)
+        db.session.add(m)
+        db.session.commit()
+
+        u1 = User.query.get(self.u1_id)
+        u3 = User.query.get(self.u3_id)
+
+        u1.following.append(u3)
+        db.session.commit()
+        self.assertIn(m.id, self.timeline_ids(self.u1_id))
+
+        u1.following.remove(u3)
+        db.session.commit()
+        self.assertNotIn(m.id, self.timeline_ids(self.u1_id))
+
+    def test_merge_on_read(self):
+        """Popular accounts are not fanned out but still show on read."""
+
+        app.config['TIMELINE_FANOUT_LIMIT'] = 1
+
+        u1 = User.query.get(self.u1_id)
+        u3 = User.query.get(self.u3_id)
+        u1.following.append(u3)
+        db.session.commit()
+
+        self.assertTrue(User.query.get(self.u3_id).merge_on_read)
+
+        m = Message(text="popular", user_id=self.u3_id)
+        db.session.add(m)
+        db.session.commit()
+
+        self.assertNotIn(m.id, self.timeline_ids(self.u1_id))
+        messages, _ = home_timeline(u1)
+        self.assertIn(m, messages)
+
+    def test_home_timeline_order(self):
+        """Timeline reads come back newest first."""
+
+        u1 = User.query.get(self.u1_id)
+        m1 = Message(text="first", user_id=self.u2_id)
+        db.session.add(m1)
+        db.session.commit()
+        m2 = Message(text="second", user_id=self.u1_id)
+        db.session.add(m2)
+        db.session.commit()
+
+        self.assertEqual(home_timeline(u1), ([m2, m1], None))
+
+    def test_home_timeline_cursor(self):
+        """Cursor pages walk the timeline without repeats or gaps."""
+
+        u1 = User.query.get(self.u1_id)
+        messages = [Message(text=f"m{i}", user_id=self.u2_id)
+                    for i in range(5)]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        seen = []
+        page, cursor = home_timeline(u1, limit=2)
+        seen.extend(page)
+
+        while cursor:
+            page, cursor = home_timeline(
+                u1, limit=2, cursor=decode_cursor(cursor, datetime, int))
+            seen.extend(page)
+
+        self.assertEqual(len(seen), 5)
+        self.assertEqual(set(seen), set(messages))
+        self.assertEqual(
+            seen,
+            sorted(seen, key=lambda m: (m.timestamp, m.id), reverse=True))
+
+    def test_rebuild_timelines(self):
+        """Rebuilding produces the same timelines as incremental fan-out."""
+
+        m1 = Message(text="first", user_id=self.u2_id)
+        m2 = Message(text="second", user_id=self.u3_id)
+        db.session.add_all([m1, m2])
+        db.session.commit()
+
+        before = self.timeline_ids(self.u1_id)
+
+        # In one range, and in a range per user
+        for batch_size in [1000, 1]:
+            with self.subTest(batch_size=batch_size):
+                TimelineEntry.query.delete()
+                rebuild_timelines(batch_size=batch_size)
+
+                self.assertEqual(self.timeline_ids(self.u1_id), before)
+                self.assertEqual(self.timeline_ids(self.u3_id), {m2.id})
+
+    def test_trim_timelines(self):
+        """Trimming keeps the newest entries, and the feed stays whole."""
+
+        start = datetime(2020, 1, 1)
+        messages = [Message(text=f"m{i}", user_id=self.u2_id,
+                            timestamp=start + timedelta(minutes=i))
+                    for i in range(6)]
+        db.session.add_all(messages)
+        db.session.commit()
+
+        ids = [msg.id for msg in reversed(messages)]
+        self.assertEqual(trim_timelines(size=4, batch_size=1), 4)
+
+        self.assertEqual(self.timeline_ids(self.u1_id), set(ids[:4]))
+        self.assertEqual(self.timeline_ids(self.u2_id), set(ids[:4]))
+        self.assertEqual(self.walk(self.u1_id), ids)
+        self.assertEqual(trim_timelines(size=4), 0)
+
+    def walk(self, user_id):
+        """Every message on `user_id`'s home feed, following cursors."""
+
+        user = User.query.get(user_id)
+        seen, cursor = home_timeline(user)
+
+        while cursor:
+            page, cursor = home_timeline(
+                user, cursor=decode_cursor(cursor, datetime, int))
+            seen.extend(page)
+
+        return [msg.id for msg in seen]
+
+    def test_history_past_stored_timeline(self):
+        """Older pages than the stored timeline keeps come from messages."""
+
+        start = datetime(2020, 1, 1)
+        old = [Message(text=f"old {i}", user_id=self.u2_id,
+                       timestamp=start + timedelta(minutes=i))
+               for i in range(3)]
+        many = [Message(text=f"m{i}", user_id=self.u3_id,
+                        timestamp=start + timedelta(days=1, minutes=i))
+                for i in range(TIMELINE_BACKFILL_SIZE + 150)]
+        db.session.add_all(old + many)
+        db.session.commit()
+
+        expected = [msg.id for msg in reversed(old + many)]
+
+        u1 = User.query.get(self.u1_id)
+        u1.following.append(User.query.get(self.u3_id))
+        db.session.commit()
+
+        # Only the newest messages are copied, and the entries older than
+        # them dropped, but every message is still on the feed
+        self.assertEqual(len(self.timeline_ids(self.u1_id)),
+                         TIMELINE_BACKFILL_SIZE)
+        self.assertEqual(self.walk(self.u1_id), expected)
+
+        TimelineEntry.query.delete()
+        rebuild_timelines(size=50)
+        db.session.commit()
+
+        self.assertEqual(len(self.timeline_ids(self.u1_id)), 50)
+        self.assertEqual(self.walk(self.u1_id), expected)
+
+        # An emptied timeline is refilled from everyone followed
+        TimelineEntry.query.delete()
+        u1 = User.query.get(self.u1_id)
+        u3 = User.query.get(self.u3_id)
+        u1.following.remove(u3)
+        db.session.commit()
+        u1.following.append(u3)
+        db.session.commit()
+
+        self.assertEqual(self.walk(self.u1_id), expected)
@@ -9,7 +9,7 @@ import os
 from unittest import TestCase
 from sqlalchemy.exc import IntegrityError
 
-from models import db, User
+from models import db, hasher, BcryptHasher, PasswordHasher, User
 
 # BEFORE we import our app, let's set an environmental variable
 # to use a different database for tests (we need to do this
@@ -96,3 +96,38 @@ class UserModelTestCase(TestCase):
         #Returns False when incorrect username or password
         self.assertFalse(User.authenticate('tuckerdiane', 'ewrghetheat'))
         self.assertFalse(User.authenticate('rwthejnmhraet', 'password'))
+
+    def test_user_authenticate_rehashes(self):
+        """A hash made under an older policy is replaced on login."""
+
+        u1 = User.query.get(self.u1_id)
+        old_rounds = hasher.rounds
+        old_hash = u1.password
+
+        try:
+            hasher.rounds = old_rounds - 1
+            self.assertTrue(hasher.needs_rehash(old_hash))
+
+            user = User.authenticate("u1", "password")
+            self.assertNotEqual(user.password, old_hash)
+            self.assertFalse(hasher.needs_rehash(user.password))
+            self.assertTrue(hasher.verify(user.password, "password"))
+        finally:
+            hasher.rounds = old_rounds
+
+    def test_hasher_calibrate(self):
+        """Calibration stays within bcrypt's limits."""
+
+        test_hasher = BcryptHasher(rounds=4)
+        self.assertEqual(test_hasher.calibrate(0), 4)
+        self.assertEqual(test_hasher.calibrate(60, max_rounds=6), 6)
+
+    def test_incomplete_hasher(self):
+        """A hasher missing part of its algorithm can't be created."""
+
+        class HashOnly(PasswordHasher):
+            def _hash(self, password):
+                return password
+
+        with self.assertRaises(TypeError):
+            HashOnly()
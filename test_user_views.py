@@ -6,6 +6,7 @@
 
 
 import os
+import re
 from unittest import TestCase
 
 from models import db, Message, User
@@ -193,6 +194,39 @@ class UserPagesTestCase(UserViewBaseCase):
             self.assertIn('@u1', html)
             self.assertIn('id="home-aside"', html)
 
+    def test_homepage_load_older(self):
+        """Test paging to older messages on the homepage."""
+        messages = [Message(text=f"warble-{i}", user_id=self.u2_id)
+                    for i in range(101)]
+        db.session.add_all(messages)
+        db.session.commit()
+        oldest = min(messages, key=lambda m: (m.timestamp, m.id))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/")
+            html = resp.get_data(as_text=True)
+            self.assertIn('id="load-older"', html)
+            self.assertNotIn(f'/messages/{oldest.id}"', html)
+
+            next_url = re.search(r'href="(/\?before=[^"]+)"', html).group(1)
+            resp = c.get(next_url)
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f'/messages/{oldest.id}"', html)
+            self.assertNotIn('id="load-older"', html)
+
+    def test_homepage_bad_cursor(self):
+        """Test that a malformed cursor is rejected."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/?before=not-a-cursor")
+            self.assertEqual(resp.status_code, 400)
+
     def test_invalid_homepage(self):
         """Test route to homepage without being logged in."""
         with self.client as c:
@@ -216,6 +250,19 @@ class UserPagesTestCase(UserViewBaseCase):
             self.assertEqual(resp.status_code, 200)
             self.assertIn('class="card-bio"', html)
 
+    def test_user_list_follow_buttons(self):
+        """Users the viewer follows get Unfollow, the rest get Follow."""
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get("/users")
+
+            html = resp.get_data(as_text=True)
+            self.assertIn(f'action="/users/stop-following/{self.u2_id}"', html)
+            self.assertIn(f'action="/users/follow/{self.u3_id}"', html)
+            self.assertNotIn(f'action="/users/follow/{self.u2_id}"', html)
+
     def test_invalid_user_list(self):
         """Test route to get list of users without being logged in."""
         with self.client as c:
@@ -267,6 +314,31 @@ class UserPagesTestCase(UserViewBaseCase):
             self.assertIn('@u1', html)
             self.assertIn('id="warbler-hero"', html)
 
+    def test_user_profile_load_older(self):
+        """Test paging to older messages on a user's profile."""
+        messages = [Message(text=f"warble-{i}", user_id=self.u2_id)
+                    for i in range(101)]
+        db.session.add_all(messages)
+        db.session.commit()
+        oldest = min(messages, key=lambda m: (m.timestamp, m.id))
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.u1_id
+
+            resp = c.get(f"/users/{self.u2_id}")
+            html = resp.get_data(as_text=True)
+            self.assertIn('id="load-older"', html)
+            self.assertNotIn(f'/messages/{oldest.id}"', html)
+
+            next_url = re.search(
+                rf'href="(/users/{self.u2_id}\?before=[^"]+)"', html).group(1)
+            resp = c.get(next_url)
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn(f'/messages/{oldest.id}"', html)
+            self.assertNotIn('id="load-older"', html)
+
     def test_invalid_user_profile(self):
         """Test route to get list of users without being logged in."""
         with self.client as c:
@@ -0,0 +1,494 @@
+"""Materialized home timelines for Warbler.
+
+Posting a message pushes its id into the timeline of its author and of every
+follower ("fan-out on write"). Following someone backfills their recent
+messages into the follower's timeline and unfollowing prunes them, so the
+home page reads a bounded slice of precomputed ids instead of scanning the
+messages table.
+
+Accounts with at least TIMELINE_FANOUT_LIMIT followers are switched to
+`merge_on_read`: their messages are not fanned out, and are merged into a
+follower's timeline when it is read.
+
+A stored timeline holds only recent history, but it is always complete
+back to its oldest entry: every message newer than that, by the user or by
+someone they follow (merged-on-read accounts aside), is in it. Reading past
+the oldest entry falls back to the messages table, one index seek per
+author. Whatever trims a timeline keeps that true: a rebuild, and the
+periodic trim_timelines(), keep each user's newest TIMELINE_REBUILD_SIZE
+entries, and following someone with more than TIMELINE_BACKFILL_SIZE
+messages since the oldest entry drops the entries older than the ones
+copied.
+"""
+
+from itertools import chain
+
+from flask import current_app
+from sqlalchemy import (
+    delete, event, func, literal, select, true, union, union_all, update)
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import attributes
+
+from models import db, Follow, Message, TimelineEntry, User
+from pagination import after, before, paginate
+
+TIMELINE_FANOUT_LIMIT = 10000
+TIMELINE_BACKFILL_SIZE = 100
+TIMELINE_PAGE_SIZE = 100
+TIMELINE_REBUILD_SIZE = 10 * TIMELINE_PAGE_SIZE
+TIMELINE_BATCH_SIZE = 1000
+
+ENTRY_COLUMNS = ['user_id', 'message_id', 'author_id', 'timestamp']
+
+
+def fanout_limit():
+    """Follower count at which an account switches to merge-on-read."""
+
+    return current_app.config.get('TIMELINE_FANOUT_LIMIT',
+                                  TIMELINE_FANOUT_LIMIT)
+
+
+def _is_merged_on_read(conn, user_id):
+    return conn.execute(
+        select(User.merge_on_read).where(User.id == user_id)
+    ).scalar()
+
+
+def fan_out_message(conn, message_id, author_id, timestamp):
+    """Push a new message into its author's and followers' timelines.
+
+    Timelines only grow here; trim_timelines() drops their oldest entries.
+    """
+
+    own = select(
+        literal(author_id),
+        literal(message_id),
+        literal(author_id),
+        literal(timestamp),
+    )
+
+    if _is_merged_on_read(conn, author_id):
+        source = own
+    else:
+        followers = (
+            select(
+                Follow.user_following_id,
+                literal(message_id),
+                literal(author_id),
+                literal(timestamp),
+            )
+            .where(Follow.user_being_followed_id == author_id)
+        )
+        source = union_all(own, followers)
+
+    conn.execute(
+        insert(TimelineEntry)
+        .from_select(ENTRY_COLUMNS, source)
+        .on_conflict_do_nothing()
+    )
+
+
+def stored_authors(user_id):
+    """Select the authors whose messages `user_id`'s timeline stores.
+
+    That's the user and everyone they follow who isn't merged on read.
+    """
+
+    return union(
+        select(literal(user_id).label('author_id')),
+        select(Follow.user_being_followed_id)
+        .join(User, User.id == Follow.user_being_followed_id)
+        .where(Follow.user_following_id == user_id,
+               User.merge_on_read.is_(False)),
+    )
+
+
+def newest_messages(authors, limit, cursor=None):
+    """Select the newest `limit` messages by `authors`, before `cursor`.
+
+    Each author's messages are read through ix_messages_user_timestamp
+    from the cursor onward, at most `limit` of them, so the cost doesn't
+    grow with how far back the cursor is. Rows are (id, timestamp,
+    user_id).
+    """
+
+    author_ids = authors.subquery()
+    recent = (
+        select(Message.id, Message.timestamp, Message.user_id)
+        .where(Message.user_id == author_ids.c.author_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(limit)
+    )
+
+    if cursor:
+        recent = recent.where(before((Message.timestamp, Message.id), cursor))
+
+    recent = recent.lateral()
+
+    return (
+        select(recent.c.id, recent.c.timestamp, recent.c.user_id)
+        .select_from(author_ids)
+        .join(recent, true())
+        .order_by(recent.c.timestamp.desc(), recent.c.id.desc())
+        .limit(limit)
+    )
+
+
+def _oldest_entry(conn, user_id):
+    return conn.execute(
+        select(TimelineEntry.timestamp, TimelineEntry.message_id)
+        .where(TimelineEntry.user_id == user_id)
+        .order_by(TimelineEntry.timestamp, TimelineEntry.message_id)
+        .limit(1)
+    ).first()
+
+
+def backfill(conn, follower_id, followed_id):
+    """Copy the followed user's recent messages into follower's timeline.
+
+    Copies their messages back to the timeline's oldest entry, at most
+    TIMELINE_BACKFILL_SIZE of them; if there are more, entries older than
+    the ones copied are dropped, so the timeline stays complete back to
+    its oldest entry. An empty timeline is refilled from everyone the
+    follower follows.
+    """
+
+    if _is_merged_on_read(conn, followed_id):
+        return
+
+    oldest = _oldest_entry(conn, follower_id)
+
+    if oldest is None:
+        recent = newest_messages(stored_authors(follower_id),
+                                 TIMELINE_BACKFILL_SIZE)
+    else:
+        recent = (
+            select(Message.id, Message.timestamp, Message.user_id)
+            .where(Message.user_id == followed_id,
+                   after((Message.timestamp, Message.id), oldest))
+            .order_by(Message.timestamp.desc(), Message.id.desc())
+            .limit(TIMELINE_BACKFILL_SIZE + 1)
+        )
+
+    rows = conn.execute(recent).all()
+
+    if len(rows) > TIMELINE_BACKFILL_SIZE:
+        rows = rows[:TIMELINE_BACKFILL_SIZE]
+        conn.execute(
+            delete(TimelineEntry)
+            .where(TimelineEntry.user_id == follower_id,
+                   before((TimelineEntry.timestamp, TimelineEntry.message_id),
+                          (rows[-1].timestamp, rows[-1].id)))
+        )
+
+    if rows:
+        conn.execute(
+            insert(TimelineEntry).on_conflict_do_nothing(),
+            [{'user_id': follower_id, 'message_id': row.id,
+              'author_id': row.user_id, 'timestamp': row.timestamp}
+             for row in rows],
+        )
+
+
+def prune(conn, follower_id, followed_id):
+    """Remove the unfollowed user's messages from follower's timeline."""
+
+    conn.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == follower_id,
+               TimelineEntry.author_id == followed_id)
+    )
+
+
+def update_merge_on_read(conn, user_id):
+    """Switch `user_id` to merge-on-read once it has enough followers.
+
+    The count is capped at the limit, so this never reads more than
+    TIMELINE_FANOUT_LIMIT follow rows however popular the account is.
+    """
+
+    limit = fanout_limit()
+    capped = (
+        select(literal(1))
+        .where(Follow.user_being_followed_id == user_id)
+        .limit(limit)
+        .subquery()
+    )
+    followers = conn.execute(
+        select(func.count()).select_from(capped)
+    ).scalar()
+
+    if followers >= limit:
+        conn.execute(
+            update(User)
+            .where(User.id == user_id, User.merge_on_read.is_(False))
+            .values(merge_on_read=True)
+        )
+
+
+def follow_changes(session):
+    """Return (added, removed) sets of (follower_id, followed_id) pairs.
+
+    Follows can be written as Follow rows or through the `following` /
+    `followers` collections; the latter are read from pending attribute
+    history, so this has to run before the flush is finalized.
+    """
+
+    added = {(follow.user_following_id, follow.user_being_followed_id)
+             for follow in session.new if isinstance(follow, Follow)}
+    removed = {(follow.user_following_id, follow.user_being_followed_id)
+               for follow in session.deleted if isinstance(follow, Follow)}
+
+    for user in chain(session.new, session.dirty):
+        if not isinstance(user, User):
+            continue
+
+        following = attributes.get_history(
+            user, 'following', passive=attributes.PASSIVE_NO_INITIALIZE)
+        followers = attributes.get_history(
+            user, 'followers', passive=attributes.PASSIVE_NO_INITIALIZE)
+
+        added.update((user.id, other.id) for other in following.added)
+        added.update((other.id, user.id) for other in followers.added)
+        removed.update((user.id, other.id) for other in following.deleted)
+        removed.update((other.id, user.id) for other in followers.deleted)
+
+    return added - removed, removed - added
+
+
+@event.listens_for(db.session, 'after_flush')
+def update_timelines(session, flush_context):
+    """Keep timelines current with messages and follows written this flush."""
+
+    new_messages = [obj for obj in session.new if isinstance(obj, Message)]
+    added, removed = follow_changes(session)
+
+    if not (new_messages or added or removed):
+        return
+
+    conn = session.connection()
+
+    for msg in new_messages:
+        fan_out_message(conn, msg.id, msg.user_id, msg.timestamp)
+
+    for follower_id, followed_id in removed:
+        prune(conn, follower_id, followed_id)
+
+    for follower_id, followed_id in added:
+        update_merge_on_read(conn, followed_id)
+        backfill(conn, follower_id, followed_id)
+
+
+def home_timeline(user, limit=TIMELINE_PAGE_SIZE, cursor=None):
+    """Return (messages, next_cursor) for a page of `user`'s home feed.
+
+    Reads the precomputed timeline, and merges in messages from followed
+    accounts that are merged on read. `cursor` is the (timestamp, id) of the
+    last message on the previous page. The timeline seeks to it through its
+    (user, timestamp DESC, id DESC) index; messages are read per author (see
+    `newest_messages()`), so deep pages cost the same as the first.
+
+    If the page reaches past the stored timeline's oldest entry, the rest
+    is read from the messages table.
+    """
+
+    materialized = (
+        select(TimelineEntry.message_id, TimelineEntry.timestamp)
+        .where(TimelineEntry.user_id == user.id)
+        .order_by(TimelineEntry.timestamp.desc(),
+                  TimelineEntry.message_id.desc())
+        .limit(limit + 1)
+    )
+
+    if cursor:
+        materialized = materialized.where(before(
+            (TimelineEntry.timestamp, TimelineEntry.message_id), cursor))
+
+    merged_authors = (
+        select(Follow.user_being_followed_id.label('author_id'))
+        .join(User, User.id == Follow.user_being_followed_id)
+        .where(Follow.user_following_id == user.id, User.merge_on_read)
+    )
+    merged = newest_messages(merged_authors, limit + 1, cursor)
+
+    stored = db.session.execute(materialized).all()
+    rows = {(row[0], row.timestamp) for row in stored}
+    rows.update((row.id, row.timestamp) for row in
+                db.session.execute(merged))
+
+    if len(stored) <= limit:
+        # Nothing older is stored: read on from the oldest stored entry
+        horizon = cursor
+        if stored:
+            horizon = (stored[-1].timestamp, stored[-1].message_id)
+        rows.update((row.id, row.timestamp) for row in db.session.execute(
+            newest_messages(stored_authors(user.id), limit + 1, horizon)))
+
+    newest = sorted(rows, key=lambda row: (row[1], row[0]), reverse=True)
+    page, next_cursor = paginate(newest, limit,
+                                 key=lambda row: (row[1], row[0]))
+    ids = [row[0] for row in page]
+
+    if not ids:
+        return [], None
+
+    position = {message_id: i for i, message_id in enumerate(ids)}
+    messages = Message.query.filter(Message.id.in_(ids)).all()
+    messages.sort(key=lambda msg: position[msg.id])
+    return messages, next_cursor
+
+
+def profile_timeline(user_id, limit=TIMELINE_PAGE_SIZE, cursor=None):
+    """Return (messages, next_cursor) for a page of `user_id`'s messages.
+
+    Newest first. `cursor` is the (timestamp, id) of the last message on the
+    previous page; the read seeks to it through ix_messages_user_timestamp.
+    """
+
+    messages = (
+        Message.query
+        .filter(Message.user_id == user_id)
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+    )
+
+    if cursor:
+        messages = messages.filter(
+            before((Message.timestamp, Message.id), cursor))
+
+    return paginate(messages.limit(limit + 1).all(), limit,
+                    key=lambda msg: (msg.timestamp, msg.id))
+
+
+def rebuild_timelines(size=TIMELINE_REBUILD_SIZE,
+                      batch_size=TIMELINE_BATCH_SIZE):
+    """Recompute every materialized timeline from follows and messages.
+
+    Used after bulk loads that bypass the session (e.g. seed.py). Keeps the
+    newest `size` entries per user; older pages are read from the messages
+    table. Works through user id ranges of `batch_size`, committing after
+    each, so it can run against a live database without holding long
+    locks: first settling which authors are merged on read, then
+    rebuilding the timelines of each range.
+    """
+
+    last_id = db.session.scalar(select(func.max(User.id))) or 0
+    ranges = [(start, start + batch_size)
+              for start in range(1, last_id + 1, batch_size)]
+
+    for start, stop in ranges:
+        _mark_popular(start, stop)
+        db.session.commit()
+
+    for start, stop in ranges:
+        _rebuild_range(start, stop, size)
+        db.session.commit()
+
+
+def trim_timelines(size=TIMELINE_REBUILD_SIZE,
+                   batch_size=TIMELINE_BATCH_SIZE):
+    """Drop all but each user's newest `size` timeline entries.
+
+    Fan-out only ever adds entries, so this runs periodically (`flask
+    trim-timelines`, from cron) to keep the store bounded. Only the oldest
+    entries go, so timelines stay complete back to the oldest one kept.
+    Works through user id ranges of `batch_size`, committing after each.
+    Returns the number of entries dropped.
+    """
+
+    last_id = db.session.scalar(select(func.max(User.id))) or 0
+    dropped = 0
+
+    for start in range(1, last_id + 1, batch_size):
+        dropped += _trim_range(start, start + batch_size, size)
+        db.session.commit()
+
+    return dropped
+
+
+def _trim_range(start, stop, size):
+    users = select(User.id).where(User.id >= start, User.id < stop).subquery()
+
+    # Each user's last entry to keep; users with fewer have no row
+    last_kept = (
+        select(TimelineEntry.timestamp, TimelineEntry.message_id)
+        .where(TimelineEntry.user_id == users.c.id)
+        .order_by(TimelineEntry.timestamp.desc(),
+                  TimelineEntry.message_id.desc())
+        .offset(size - 1)
+        .limit(1)
+        .lateral()
+    )
+    cutoffs = (
+        select(users.c.id, last_kept.c.timestamp, last_kept.c.message_id)
+        .join(last_kept, true())
+        .subquery()
+    )
+
+    return db.session.connection().execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == cutoffs.c.id,
+               before((TimelineEntry.timestamp, TimelineEntry.message_id),
+                      (cutoffs.c.timestamp, cutoffs.c.message_id)))
+    ).rowcount
+
+
+def _mark_popular(start, stop):
+    popular = (
+        select(Follow.user_being_followed_id)
+        .where(Follow.user_being_followed_id >= start,
+               Follow.user_being_followed_id < stop)
+        .group_by(Follow.user_being_followed_id)
+        .having(func.count() >= fanout_limit())
+    )
+    db.session.connection().execute(
+        update(User)
+        .where(User.id >= start, User.id < stop)
+        .values(merge_on_read=User.id.in_(popular))
+    )
+
+
+def _rebuild_range(start, stop, size):
+    conn = db.session.connection()
+    conn.execute(delete(TimelineEntry).where(TimelineEntry.user_id >= start,
+                                             TimelineEntry.user_id < stop))
+
+    own = select(
+        Message.user_id.label('user_id'),
+        Message.id.label('message_id'),
+        Message.user_id.label('author_id'),
+        Message.timestamp,
+    ).where(Message.user_id >= start, Message.user_id < stop)
+    followed = (
+        select(
+            Follow.user_following_id,
+            Message.id,
+            Message.user_id,
+            Message.timestamp,
+        )
+        .join(Message, Message.user_id == Follow.user_being_followed_id)
+        .join(User, User.id == Message.user_id)
+        .where(User.merge_on_read.is_(False),
+               Follow.user_following_id >= start,
+               Follow.user_following_id < stop)
+    )
+    candidates = union_all(own, followed).subquery()
+
+    ranked = select(
+        candidates,
+        func.row_number().over(
+            partition_by=candidates.c.user_id,
+            order_by=(candidates.c.timestamp.desc(),
+                      candidates.c.message_id.desc()),
+        ).label('rank'),
+    ).subquery()
+
+    conn.execute(
+        insert(TimelineEntry).from_select(
+            ENTRY_COLUMNS,
+            select(ranked.c.user_id,
+                   ranked.c.message_id,
+                   ranked.c.author_id,
+                   ranked.c.timestamp)
+            .where(ranked.c.rank <= size),
+        ).on_conflict_do_nothing()
+    )